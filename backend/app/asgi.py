@@ -0,0 +1,185 @@
+"""
+ASGI entrypoint của backend (chạy bằng uvicorn, xem run.py).
+POST /api/dialog/<id>/chat được xử lý bằng async view: load dialog và lưu message qua asyncpg,
+search qua AsyncQdrantClient và gọi Gemini bằng async client, nên một worker process giữ được
+rất nhiều lượt chat đang chờ LLM mà không cần một thread cho mỗi request. Các route còn lại
+vẫn là Flask app, chạy qua a2wsgi trong thread pool riêng (WSGI_THREADS).
+"""
+import asyncio
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from a2wsgi import WSGIMiddleware
+from flask import session
+from .config import Config
+from .main import app as flask_app, CORS_ORIGINS
+from services.rag_service_pool import get_rag_service_pool
+from db.async_database import aget_dialog_by_id, aadd_message, close_async_pool
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = re.compile(r'^/api/dialog/(\d+)/chat$')
+
+wsgi_app = WSGIMiddleware(flask_app, workers=Config.WSGI_THREADS)
+rag_service_pool = get_rag_service_pool(Config)
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+def _session_user_id(cookie):
+    """user_id trong Flask session (Flask-Session lưu trong PostgreSQL), giống require_auth của các blueprint"""
+    with flask_app.test_request_context('/', headers={'Cookie': cookie} if cookie else None):
+        return session.get('user_id')
+
+
+def _cors_headers(headers, preflight=False):
+    """CORS headers giống cấu hình flask-cors của Flask app (origins CORS_ORIGINS, có credentials)"""
+    origin = headers.get('origin')
+    if origin not in CORS_ORIGINS:
+        return []
+    cors = [
+        (b'access-control-allow-origin', origin.encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+        (b'vary', b'Origin')
+    ]
+    if preflight:
+        cors.append((b'access-control-allow-methods', b'POST, OPTIONS'))
+        requested = headers.get('access-control-request-headers')
+        if requested:
+            cors.append((b'access-control-allow-headers', requested.encode('latin-1')))
+    return cors
+
+
+async def _read_body(receive, limit):
+    """Đọc body của request, None nếu client đã ngắt kết nối"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.extend(message.get('body', b''))
+        if len(body) > limit:
+            raise RequestTooLarge()
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def _send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def chat_with_kb(scope, receive, send, dialog_id):
+    """
+    Chat với knowledge base trong dialog cụ thể (cùng request/response với API cũ).
+    Load dialog trước, sau đó lưu message của user song song với retrieval + Gemini
+    """
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    cors = _cors_headers(headers)
+
+    try:
+        body = await _read_body(receive, Config.MAX_REQUEST_SIZE_MB * 1024 * 1024)
+    except RequestTooLarge:
+        return await _send_json(send, 413, {'error': 'Request too large'}, cors)
+    if body is None:
+        return
+
+    # Đọc session là truy vấn đồng bộ qua Flask-Session, chạy trong thread pool của loop
+    user_id = await asyncio.to_thread(_session_user_id, headers.get('cookie'))
+    if user_id is None:
+        return await _send_json(send, 401, {'error': 'Authentication required'}, cors)
+
+    try:
+        message = json.loads(body).get('message', '').strip()
+    except (ValueError, AttributeError):
+        return await _send_json(send, 400, {'error': 'Invalid JSON body'}, cors)
+
+    if not message:
+        return await _send_json(send, 400, {'error': 'Message is required'}, cors)
+
+    try:
+        # Kiểm tra dialog trước để request 404 không tốn một lần encode câu hỏi
+        dialog = await aget_dialog_by_id(dialog_id, user_id)
+        if not dialog:
+            return await _send_json(send, 404, {'error': 'Dialog not found'}, cors)
+
+        # Dùng lại RAG pipeline đã khởi tạo cho config của dialog (tạo mới có thể phải load model)
+        rag_service = await asyncio.to_thread(rag_service_pool.get_for_dialog, dialog)
+        user_msg_task = asyncio.ensure_future(aadd_message(dialog_id, 'user', message))
+        rag_result = await rag_service.achat_with_rag(message, user_id)
+        user_msg = await user_msg_task
+
+        # Lưu phản hồi của bot
+        bot_response = rag_result['response']
+        bot_msg = await aadd_message(dialog_id, 'bot', bot_response)
+    except Exception as e:
+        logger.error(f"Error in chat_with_kb: {str(e)}")
+        return await _send_json(send, 500, {'error': 'Database error'}, cors)
+
+    await _send_json(send, 200, {
+        'message': 'Message sent successfully',
+        'user_message': {
+            'id': user_msg['id'],
+            'content': message,
+            'timestamp': user_msg['timestamp'].isoformat()
+        },
+        'bot_response': {
+            'id': bot_msg['id'],
+            'content': bot_response,
+            'timestamp': bot_msg['timestamp'].isoformat()
+        },
+        'search_results_count': rag_result.get('search_results_count', 0),
+        'sources': rag_result.get('sources', []),
+        'rag_details': {
+            'query': message,
+            'chunks_used': rag_result.get('search_results', []),
+            'context_used': rag_result.get('context_used', ''),
+            'context_stats': rag_result.get('context_stats'),
+            'used_rag': True  # RAG luôn được sử dụng, chỉ là có thể không tìm thấy chunks
+        }
+    }, cors)
+
+
+async def _preflight(scope, send):
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _cors_headers(headers, preflight=True)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Thread pool cho các bước blocking/CPU-bound của async chat (đọc session, encode câu hỏi, rerank)
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=Config.CHAT_IO_WORKERS, thread_name_prefix='chat-io')
+            )
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http':
+        match = CHAT_PATH.match(scope['path'])
+        if match and scope['method'] == 'POST':
+            return await chat_with_kb(scope, receive, send, int(match.group(1)))
+        if match and scope['method'] == 'OPTIONS':
+            return await _preflight(scope, send)
+    await wsgi_app(scope, receive, send)
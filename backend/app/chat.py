@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify, session
 import bcrypt
 from db.database import (
-    get_connection, create_dialogs_table, create_messages_table,
+    connection, create_dialogs_table, create_messages_table,
     create_dialog, add_message, get_dialogs_by_user, get_dialog_by_id,
     delete_dialog, get_chat_history
 )
 from services.qdrant_service import QdrantService
+from services.rag_service_pool import get_rag_service_pool
 from app.config import Config
 import logging
 
@@ -32,23 +33,18 @@ def login():
     password = data.get('password')
     if not username or not password:
         return jsonify({'error': 'Thiếu thông tin'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, password_hash FROM users WHERE username=%s", (username,))
-    row = cur.fetchone()
-    if not row:
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, password_hash FROM users WHERE username=%s", (username,))
+        row = cur.fetchone()
         cur.close()
-        conn.close()
+    if not row:
         return jsonify({'error': 'Sai tài khoản hoặc mật khẩu'}), 401
     user_id, hashed = row
     if not bcrypt.checkpw(password.encode(), hashed.encode() if isinstance(hashed, str) else hashed):
-        cur.close()
-        conn.close()
         return jsonify({'error': 'Sai tài khoản hoặc mật khẩu'}), 401
     session['user_id'] = user_id
     session['username'] = username
-    cur.close()
-    conn.close()
     return jsonify({'message': 'Đăng nhập thành công!', 'username': username}), 200
 
 @chat_bp.route('/register', methods=['POST'])
@@ -58,18 +54,16 @@ def register():
     password = data.get('password')
     if not username or not password:
         return jsonify({'error': 'Thiếu thông tin'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE username=%s", (username,))
-    if cur.fetchone():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users WHERE username=%s", (username,))
+        if cur.fetchone():
+            cur.close()
+            return jsonify({'error': 'User đã tồn tại'}), 409
+        hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)", (username, hashed.decode()))
+        conn.commit()
         cur.close()
-        conn.close()
-        return jsonify({'error': 'User đã tồn tại'}), 409
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-    cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)", (username, hashed.decode()))
-    conn.commit()
-    cur.close()
-    conn.close()
     return jsonify({'message': 'Đăng ký thành công!'}), 200
 
 @chat_bp.route('/logout', methods=['POST'])
@@ -154,6 +148,7 @@ def delete_dialog_endpoint(dialog_id):
         deleted = delete_dialog(dialog_id, user_id)
         if not deleted:
             return jsonify({'error': 'Dialog not found'}), 404
+        get_rag_service_pool(Config).invalidate_dialog(dialog_id)
         return jsonify({'message': 'Dialog deleted successfully'}), 200
     except Exception as e:
         logger.error(f"Error deleting dialog: {str(e)}")
@@ -173,11 +168,10 @@ def get_messages(dialog_id):
         if not dialog:
             return jsonify({'error': 'Dialog not found'}), 404
         
-        conn = get_connection()
-        cur = conn.cursor()
-        messages = get_chat_history(cur, dialog_id)
-        cur.close()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            messages = get_chat_history(cur, dialog_id)
+            cur.close()
         
         return jsonify({'messages': messages}), 200
     except Exception as e:
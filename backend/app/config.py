@@ -9,6 +9,10 @@ class Config:
     QDRANT_HOST = os.getenv('QDRANT_HOST', 'localhost')
     QDRANT_PORT = int(os.getenv('QDRANT_PORT', 6333))
     QDRANT_API_KEY = os.getenv('QDRANT_API_KEY', '')
+    # gRPC nhanh hơn REST cho search/upsert; client dùng chung giữ kết nối giữa các request
+    QDRANT_GRPC_PORT = int(os.getenv('QDRANT_GRPC_PORT', 6334))
+    QDRANT_PREFER_GRPC = os.getenv('QDRANT_PREFER_GRPC', 'false').lower() == 'true'
+    QDRANT_TIMEOUT = int(os.getenv('QDRANT_TIMEOUT', 30))
 
     # PostgreSQL - ưu tiên environment variables từ Docker
     POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
@@ -28,6 +32,108 @@ class Config:
     MINIO_ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY', 'daomed')
     MINIO_SECRET_KEY = os.getenv('MINIO_SECRET_KEY', 'daomed_secret')
     MINIO_BUCKET_NAME = os.getenv('MINIO_BUCKET_NAME', 'daomed-files')
+    # Connection pool của MinIO client dùng chung
+    MINIO_POOL_SIZE = int(os.getenv('MINIO_POOL_SIZE', 20))
+    MINIO_CONNECT_TIMEOUT = float(os.getenv('MINIO_CONNECT_TIMEOUT', 5))
+    MINIO_READ_TIMEOUT = float(os.getenv('MINIO_READ_TIMEOUT', 300))
     
     # Model path - ưu tiên environment variables từ Docker
-    MODEL_PATH = os.getenv('MODEL_PATH', '/models/vietnamese-bi-encoder')
\ No newline at end of file
+    MODEL_PATH = os.getenv('MODEL_PATH', '/models/vietnamese-bi-encoder')
+
+    # Load embedding model ngay lúc startup thay vì ở request đầu tiên
+    PRELOAD_EMBEDDING_MODEL = os.getenv('PRELOAD_EMBEDDING_MODEL', 'true').lower() == 'true'
+
+    # Batch size khi encode chunks và khi upsert points vào Qdrant
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+    QDRANT_UPSERT_BATCH_SIZE = int(os.getenv('QDRANT_UPSERT_BATCH_SIZE', 512))
+
+    # Profile lưu trữ của collection Qdrant (default, balanced, compact) và hnsw_ef khi search (0 = theo profile)
+    QDRANT_COLLECTION_PROFILE = os.getenv('QDRANT_COLLECTION_PROFILE', 'default')
+    QDRANT_SEARCH_EF = int(os.getenv('QDRANT_SEARCH_EF', 0))
+
+    # Tên collection chứa chunks (đổi sau khi chạy migrate_lexical_index.py)
+    QDRANT_COLLECTION_NAME = os.getenv('QDRANT_COLLECTION_NAME', 'daomed_chunks')
+
+    # Lexical (sparse) index lúc ingestion và chế độ retrieval mặc định: hybrid hoặc dense
+    LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true').lower() == 'true'
+    RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+
+    # Rerank bằng cross-encoder local: lấy dư ứng viên, chấm theo batch trong latency budget
+    RERANKER_ENABLED = os.getenv('RERANKER_ENABLED', 'false').lower() == 'true'
+    RERANKER_MODEL_PATH = os.getenv('RERANKER_MODEL_PATH', '/models/reranker')
+    RERANKER_CANDIDATE_MULTIPLIER = int(os.getenv('RERANKER_CANDIDATE_MULTIPLIER', 3))
+    RERANKER_BATCH_SIZE = int(os.getenv('RERANKER_BATCH_SIZE', 16))
+    RERANKER_BUDGET_MS = float(os.getenv('RERANKER_BUDGET_MS', 300))
+
+    # Số tokens tối đa của context gửi cho LLM (mỗi dialog có thể đổi qua model_config.context_token_budget)
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))
+    CONTEXT_TOKEN_ENCODING = os.getenv('CONTEXT_TOKEN_ENCODING', 'cl100k_base')
+
+    # Số RAG pipelines (theo config dialog) được giữ lại để dùng cho các lượt chat sau
+    RAG_SERVICE_POOL_SIZE = int(os.getenv('RAG_SERVICE_POOL_SIZE', 64))
+
+    # ASGI server (uvicorn): số worker process; job evaluation được theo dõi trong bộ nhớ
+    # của process nên chỉ tăng khi không dùng API evaluation
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 1))
+    # Số thread chạy các route Flask (mỗi request/stream SSE giữ một thread)
+    WSGI_THREADS = int(os.getenv('WSGI_THREADS', 64))
+    # Số thread cho các bước blocking/CPU-bound của async chat (đọc session, encode câu hỏi, rerank)
+    CHAT_IO_WORKERS = int(os.getenv('CHAT_IO_WORKERS', 16))
+
+    # Kiểm tra PostgreSQL/Qdrant/MinIO lúc startup; fail fast thì dừng process nếu vẫn lỗi sau các lần thử
+    STARTUP_FAIL_FAST = os.getenv('STARTUP_FAIL_FAST', 'true').lower() == 'true'
+    STARTUP_CHECK_RETRIES = int(os.getenv('STARTUP_CHECK_RETRIES', 5))
+    STARTUP_CHECK_DELAY = float(os.getenv('STARTUP_CHECK_DELAY', 2))
+
+    # Kích thước file upload tối đa (chỉ áp dụng cho API upload knowledge base);
+    # file upload được ghi ra đĩa theo stream nên không giới hạn bởi RAM
+    MAX_UPLOAD_SIZE_MB = int(os.getenv('MAX_UPLOAD_SIZE_MB', 4096))
+    # Kích thước request tối đa cho các API còn lại (JSON body được đọc hết vào bộ nhớ)
+    MAX_REQUEST_SIZE_MB = int(os.getenv('MAX_REQUEST_SIZE_MB', 16))
+    # Thư mục lưu tạm file upload cho tới khi ingestion job xử lý xong (mặc định thư mục temp của hệ thống)
+    UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR') or None
+
+    # Số ingestion job được xử lý song song ở background
+    INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))
+    # Mỗi process báo các job nó đang giữ còn sống sau mỗi INGESTION_HEARTBEAT_SECONDS;
+    # job không có heartbeat quá INGESTION_STALE_SECONDS coi như process đã dừng
+    INGESTION_HEARTBEAT_SECONDS = float(os.getenv('INGESTION_HEARTBEAT_SECONDS', 30))
+    INGESTION_STALE_SECONDS = float(os.getenv('INGESTION_STALE_SECONDS', 180))
+    # Số rows đọc mỗi lần khi chunking file upload
+    INGESTION_ROW_BATCH_SIZE = int(os.getenv('INGESTION_ROW_BATCH_SIZE', 2000))
+    # Số trang chunks (và index) vừa xem được cache trong process
+    CHUNK_PAGE_CACHE_SIZE = int(os.getenv('CHUNK_PAGE_CACHE_SIZE', 256))
+    # Số chunks trong một segment nén của chunk store (đơn vị nén và đọc theo trang)
+    CHUNK_SEGMENT_SIZE = int(os.getenv('CHUNK_SEGMENT_SIZE', 1024))
+
+    # PostgreSQL connection pool
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30))
+
+    # Semantic cache cho câu trả lời RAG
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.97))
+
+    # Dung lượng tối đa (MB) của cache embedding cho query
+    QUERY_EMBEDDING_CACHE_MAX_MB = float(os.getenv('QUERY_EMBEDDING_CACHE_MAX_MB', 64))
+
+    # Cache embedding của chunk texts trên đĩa (SQLite), dùng chung giữa các lần ingestion và các user
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'data/embedding_cache.sqlite3')
+    EMBEDDING_CACHE_MAX_MB = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 2048))
+
+    # Gom các request encode query đồng thời thành batch
+    EMBEDDING_DISPATCH_ENABLED = os.getenv('EMBEDDING_DISPATCH_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_DISPATCH_MAX_BATCH = int(os.getenv('EMBEDDING_DISPATCH_MAX_BATCH', 32))
+    EMBEDDING_DISPATCH_MAX_WAIT_MS = float(os.getenv('EMBEDDING_DISPATCH_MAX_WAIT_MS', 5))
+
+    # Evaluation: số lần chạy cùng lúc, số câu hỏi xử lý song song mỗi lần chạy,
+    # giới hạn gọi LLM và thư mục checkpoint
+    EVAL_RUN_WORKERS = int(os.getenv('EVAL_RUN_WORKERS', 1))
+    EVAL_CONCURRENCY = int(os.getenv('EVAL_CONCURRENCY', 4))
+    EVAL_REQUESTS_PER_MINUTE = float(os.getenv('EVAL_REQUESTS_PER_MINUTE', 60))
+    EVAL_CHECKPOINT_DIR = os.getenv('EVAL_CHECKPOINT_DIR', '/tmp/daomed-eval')
@@ -1,9 +1,10 @@
 # DoctorQA/backend/app/dialog.py
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
 from db.database import (
-    get_dialog_by_id, add_message, get_chat_history, get_connection, update_dialog_config
+    get_dialog_by_id, add_message, get_chat_history, connection, update_dialog_config,
+    get_knowledge_base_files_by_user, UNSET
 )
-from services.rag_service import RAGService
+from services.rag_service_pool import get_rag_service_pool
 from services.qdrant_service import QdrantService
 from app.config import Config
 import logging
@@ -15,17 +16,30 @@ dialog_bp = Blueprint('dialog', __name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# RAG pipelines dùng lại giữa các lượt chat, key theo config của dialog
+rag_service_pool = get_rag_service_pool(Config)
+
 def require_auth():
     """Kiểm tra user đã đăng nhập chưa"""
     if 'user_id' not in session:
         return False, 'User not authenticated'
     return True, session['user_id']
 
-@dialog_bp.route('/<int:dialog_id>/chat', methods=['POST'])
-def chat_with_kb(dialog_id):
+# POST /<dialog_id>/chat (không streaming) là async view trong app/asgi.py
+
+# Đánh dấu bot message của stream bị dừng giữa chừng (client ngắt kết nối hoặc lỗi)
+INTERRUPTED_RESPONSE_MARKER = "[Câu trả lời bị gián đoạn]"
+
+def _sse_event(event, data):
+    """Format một Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@dialog_bp.route('/<int:dialog_id>/chat/stream', methods=['POST'])
+def chat_with_kb_stream(dialog_id):
     """
-    Chat với knowledge base trong dialog cụ thể
-    Sử dụng toàn bộ knowledge base của user
+    Chat với knowledge base, trả về kết quả dạng Server-Sent Events:
+    user_message -> retrieval -> token (nhiều lần) -> done (hoặc error)
+    Bot message được lưu vào DB khi stream kết thúc, kể cả khi bị ngắt giữa chừng
     """
     is_auth, user_id = require_auth()
     if not is_auth:
@@ -46,46 +60,74 @@ def chat_with_kb(dialog_id):
         # Lưu message của user
         user_msg = add_message(dialog_id, 'user', message)
         
-        # Sử dụng RAG service với dialog config
-        rag_service = RAGService(
-            Config, 
-            system_prompt=dialog.get('system_prompt'),
-            model_config=dialog.get('model_config'),
-            max_chunks=dialog.get('max_chunks', 8),
-            cosine_threshold=dialog.get('cosine_threshold', 0.5)
-        )
-        rag_result = rag_service.chat_with_rag(message, user_id)
-        
-        bot_response = rag_result['response']
-        
-        # Lưu phản hồi của bot
-        bot_msg = add_message(dialog_id, 'bot', bot_response)
-        
-        return jsonify({
-            'message': 'Message sent successfully',
-            'user_message': {
-                'id': user_msg['id'],
-                'content': message,
-                'timestamp': user_msg['timestamp'].isoformat()
-            },
-            'bot_response': {
-                'id': bot_msg['id'],
-                'content': bot_response,
-                'timestamp': bot_msg['timestamp'].isoformat()
-            },
-            'search_results_count': rag_result.get('search_results_count', 0),
-            'sources': rag_result.get('sources', []),
-            'rag_details': {
-                'query': message,
-                'chunks_used': rag_result.get('search_results', []),
-                'context_used': rag_result.get('context_used', ''),
-                'used_rag': True  # RAG luôn được sử dụng, chỉ là có thể không tìm thấy chunks
-            }
-        }), 200
-        
+        rag_service = rag_service_pool.get_for_dialog(dialog)
     except Exception as e:
-        logger.error(f"Error in chat_with_kb: {str(e)}")
+        logger.error(f"Error in chat_with_kb_stream: {str(e)}")
         return jsonify({'error': 'Database error'}), 500
+    
+    def generate():
+        yield _sse_event('user_message', {
+            'id': user_msg['id'],
+            'content': message,
+            'timestamp': user_msg['timestamp'].isoformat()
+        })
+        
+        retrieval = {}
+        parts = []
+        saved = False
+        try:
+            for event, payload in rag_service.stream_chat_with_rag(message, user_id):
+                if event == 'retrieval':
+                    retrieval = payload
+                    yield _sse_event('retrieval', {
+                        'search_results_count': payload['search_results_count'],
+                        'sources': payload['sources'],
+                        'chunks_used': payload['search_results']
+                    })
+                elif event == 'token':
+                    parts.append(payload)
+                    yield _sse_event('token', {'content': payload})
+                elif event == 'done':
+                    bot_response = payload['response']
+                    bot_msg = add_message(dialog_id, 'bot', bot_response)
+                    saved = True
+                    yield _sse_event('done', {
+                        'bot_response': {
+                            'id': bot_msg['id'],
+                            'content': bot_response,
+                            'timestamp': bot_msg['timestamp'].isoformat()
+                        },
+                        'search_results_count': retrieval.get('search_results_count', 0),
+                        'sources': retrieval.get('sources', []),
+                        'rag_details': {
+                            'query': message,
+                            'chunks_used': retrieval.get('search_results', []),
+                            'context_used': retrieval.get('context_used', ''),
+                            'context_stats': retrieval.get('context_stats'),
+                            'used_rag': True
+                        }
+                    })
+        except Exception as e:
+            logger.error(f"Error streaming chat for dialog {dialog_id}: {str(e)}")
+            yield _sse_event('error', {'error': str(e)})
+        finally:
+            # Client ngắt kết nối (GeneratorExit) hoặc lỗi trước 'done': vẫn lưu phần đã trả lời
+            # để lịch sử dialog không có câu hỏi mà thiếu câu trả lời
+            if not saved:
+                partial = "".join(parts).rstrip()
+                try:
+                    add_message(dialog_id, 'bot', f"{partial}\n\n{INTERRUPTED_RESPONSE_MARKER}" if partial else INTERRUPTED_RESPONSE_MARKER)
+                except Exception as e:
+                    logger.error(f"Could not save interrupted response for dialog {dialog_id}: {str(e)}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Tắt buffering của nginx để token tới client ngay
+        }
+    )
 
 @dialog_bp.route('/<int:dialog_id>/config', methods=['PUT'])
 def update_dialog_config_endpoint(dialog_id):
@@ -101,8 +143,10 @@ def update_dialog_config_endpoint(dialog_id):
     model_config = data.get('model_config')
     max_chunks = data.get('max_chunks')
     cosine_threshold = data.get('cosine_threshold')
+    # kb_ids: danh sách KB dùng cho retrieval, null = tất cả KB của user
+    kb_ids = data.get('kb_ids', UNSET)
     
-    if all(v is None for v in [system_prompt, model_config, max_chunks, cosine_threshold]):
+    if all(v is None for v in [system_prompt, model_config, max_chunks, cosine_threshold]) and kb_ids is UNSET:
         return jsonify({'error': 'At least one configuration parameter must be provided'}), 400
     
     try:
@@ -141,17 +185,42 @@ def update_dialog_config_endpoint(dialog_id):
                     temp = float(model_config_dict['temperature'])
                     if temp < 0.0 or temp > 1.0:
                         return jsonify({'error': 'temperature must be between 0.0 and 1.0'}), 400
+                
+                if model_config_dict.get('retrieval_mode', 'hybrid') not in ('hybrid', 'dense'):
+                    return jsonify({'error': "retrieval_mode must be 'hybrid' or 'dense'"}), 400
+                
+                if 'context_token_budget' in model_config_dict:
+                    budget = int(model_config_dict['context_token_budget'])
+                    if budget < 100 or budget > 100000:
+                        return jsonify({'error': 'context_token_budget must be between 100 and 100000'}), 400
+                
+                if not isinstance(model_config_dict.get('rerank', False), bool):
+                    return jsonify({'error': 'rerank must be a boolean'}), 400
             except (ValueError, TypeError, json.JSONDecodeError):
                 return jsonify({'error': 'Invalid model_config format'}), 400
         
+        # Validate kb_ids: phải là các KB thuộc về user
+        if kb_ids is not UNSET and kb_ids is not None:
+            if not isinstance(kb_ids, list):
+                return jsonify({'error': 'kb_ids must be a list of knowledge base ids or null'}), 400
+            try:
+                kb_ids = sorted(set(int(kb_id) for kb_id in kb_ids))
+            except (ValueError, TypeError):
+                return jsonify({'error': 'kb_ids must contain valid integers'}), 400
+            owned_ids = {kb_file['id'] for kb_file in get_knowledge_base_files_by_user(user_id)}
+            unknown_ids = [kb_id for kb_id in kb_ids if kb_id not in owned_ids]
+            if unknown_ids:
+                return jsonify({'error': f'Knowledge bases not found: {unknown_ids}'}), 400
+        
         # Convert model_config dict to JSON string if provided
         if model_config is not None:
             model_config = json.dumps(model_config)
         
         # Update config
-        success = update_dialog_config(dialog_id, user_id, system_prompt, model_config, max_chunks, cosine_threshold)
-        
+        success = update_dialog_config(dialog_id, user_id, system_prompt, model_config, max_chunks, cosine_threshold, kb_ids)
         if success:
+            # Pipeline cũ của dialog không còn đúng config
+            rag_service_pool.invalidate_dialog(dialog_id)
             return jsonify({
                 'message': 'Dialog configuration updated successfully',
                 'dialog_id': dialog_id
@@ -194,11 +263,10 @@ def get_dialog_messages(dialog_id):
         if not dialog:
             return jsonify({'error': 'Dialog not found'}), 404
         
-        conn = get_connection()
-        cur = conn.cursor()
-        messages = get_chat_history(cur, dialog_id)
-        cur.close()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            messages = get_chat_history(cur, dialog_id)
+            cur.close()
         
         return jsonify({'messages': messages}), 200
     except Exception as e:
@@ -230,7 +298,7 @@ def search_in_dialog(dialog_id):
         
         # Tìm kiếm trong knowledge base
         qdrant_service = QdrantService(Config)
-        success, results = qdrant_service.search_chunks(query, user_id, top_k, score_threshold)
+        success, results = qdrant_service.search_chunks(query, user_id, top_k, score_threshold, kb_ids=dialog.get('kb_ids'))
         
         if not success:
             return jsonify({'error': f'Search failed: {results}'}), 500
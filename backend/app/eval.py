@@ -16,6 +16,12 @@ from flask import Blueprint, request, jsonify, session
 from app.config import Config
 import logging
 from services.rag_service import RAGService
+from services.rag_service_pool import get_rag_service_pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import threading
+import time
 
 eval_pb = Blueprint("eval", __name__)
 
@@ -67,7 +73,7 @@ def normalize_data(input: list[dict]):
         formatted_input.append(
             {
                 **item,
-                "retrieved_contexts": [],
+                "retrieved_contexts": item.get("retrieved_contexts", []),
                 "response": item.get("answer", ""),
                 "ground_truth": item.get("expected_answer", ""),
                 "reference": item.get("expected_answer", ""),
@@ -107,19 +113,227 @@ def init_model():
     return wrapped_llm
 
 
-def get_assistant_response(user_id: str, question: str):
-    config = get_default_config()
-    rag_service = RAGService(
-        Config,
-        system_prompt=config.get("system_prompt"),
-        model_config=config.get("model_config"),
-        max_chunks=config.get("max_chunks", 8),
-        cosine_threshold=config.get("cosine_threshold", 0.5),
-    )
-    rag_result = rag_service.chat_with_rag(question, user_id)
+def get_assistant_response(rag_service: RAGService, user_id: str, question: str):
+    """
+    Trả lời một câu hỏi bằng RAG pipeline dùng chung, kèm các contexts đã retrieve.
+    Lỗi khi gọi LLM được raise để câu hỏi không bị checkpoint và được chạy lại khi resume.
+    Không dùng response cache: câu trả lời cache cho câu hỏi gần giống sẽ làm sai điểm đánh giá
+    """
+    rag_result = rag_service.chat_with_rag(question, user_id, use_cache=False)
+    if rag_result.get("error"):
+        raise RuntimeError(f"RAG failed for question: {rag_result['error']}")
 
     bot_response = rag_result["response"]
-    return bot_response
+    retrieved_contexts = [result["content"] for result in rag_result.get("search_results", [])]
+    return bot_response, retrieved_contexts
+
+
+class RateLimiter:
+    """Giới hạn số lần gọi LLM mỗi phút, dùng chung giữa các worker threads"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class EvaluationRun:
+    """
+    Một lần chạy evaluation: sinh câu trả lời song song (giới hạn bởi EVAL_CONCURRENCY
+    và EVAL_REQUESTS_PER_MINUTE) bằng một RAG pipeline dùng chung, checkpoint sau mỗi câu
+    để chạy lại cùng bộ dữ liệu sẽ tiếp tục từ chỗ đã dừng, sau đó chấm điểm bằng ragas.
+    Mỗi câu trả lời được append vào journal (.jsonl), snapshot (.json) chỉ được ghi lại
+    khi kết thúc một giai đoạn nên chi phí checkpoint không tăng theo số câu đã trả lời.
+    """
+
+    def __init__(self, run_id, user_id, items):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.items = items
+        self.status = "queued"
+        self.stage = None
+        self.error = None
+        self.result = None
+        self.answers = {}
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self.checkpoint_path = os.path.join(Config.EVAL_CHECKPOINT_DIR, f"{run_id}.json")
+        self.journal_path = os.path.join(Config.EVAL_CHECKPOINT_DIR, f"{run_id}.jsonl")
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                    checkpoint = json.load(f)
+                self.answers = {int(index): record for index, record in checkpoint.get("answers", {}).items()}
+                self.result = checkpoint.get("result")
+            except Exception as e:
+                logger.warning(f"Could not read evaluation checkpoint {self.checkpoint_path}: {str(e)}")
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Dòng cuối ghi dở khi process dừng
+                        break
+                    self.answers[int(entry["index"])] = entry["record"]
+        if self.answers:
+            logger.info(f"Resuming evaluation {self.run_id}: {len(self.answers)}/{len(self.items)} answers checkpointed")
+
+    def _append_answer(self, index, record):
+        line = json.dumps({"index": index, "record": record}, ensure_ascii=False, default=str)
+        with self._lock:
+            self.answers[index] = record
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _compact_checkpoint(self):
+        """Gộp journal vào snapshot rồi xóa journal (chạy lại sau crash ở giữa cũng không sao)"""
+        with self._lock:
+            checkpoint = {"answers": self.answers, "result": self.result}
+            tmp_path = f"{self.checkpoint_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.checkpoint_path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def _answer(self, rag_service, limiter, index):
+        item = dict(self.items[index])
+        question = item.get("question").strip()
+        expected_answer = item.get("expected_answer").strip()
+        limiter.acquire()
+        answer, retrieved_contexts = get_assistant_response(rag_service, self.user_id, question)
+        self._append_answer(index, {
+            "question": question,
+            "expected_answer": expected_answer,
+            "answer": answer,
+            "retrieved_contexts": retrieved_contexts,
+        })
+
+    def run(self):
+        try:
+            self.status = "running"
+            os.makedirs(Config.EVAL_CHECKPOINT_DIR, exist_ok=True)
+            self._load_checkpoint()
+
+            if self.result is None:
+                self.stage = "answering"
+                pending = [index for index in range(len(self.items)) if index not in self.answers]
+                if pending:
+                    config = get_default_config()
+                    rag_service = get_rag_service_pool(Config).get(
+                        system_prompt=config.get("system_prompt"),
+                        model_config=config.get("model_config"),
+                        max_chunks=config.get("max_chunks", 8),
+                        cosine_threshold=config.get("cosine_threshold", 0.5),
+                    )
+                    limiter = RateLimiter(Config.EVAL_REQUESTS_PER_MINUTE)
+                    with ThreadPoolExecutor(max_workers=Config.EVAL_CONCURRENCY) as executor:
+                        futures = [executor.submit(self._answer, rag_service, limiter, index) for index in pending]
+                        for future in as_completed(futures):
+                            try:
+                                future.result()
+                            except Exception as e:
+                                self.failed += 1
+                                logger.error(f"Evaluation {self.run_id}: question failed: {str(e)}")
+                    self._compact_checkpoint()
+
+                if len(self.answers) < len(self.items):
+                    raise RuntimeError(
+                        f"{len(self.items) - len(self.answers)} questions failed; run again to resume"
+                    )
+
+                self.stage = "scoring"
+                fully_data = [self.answers[index] for index in range(len(self.items))]
+                dataset = normalize_data(fully_data)
+                llm = init_model()
+                result = evaluate(
+                    dataset=dataset,
+                    metrics=[
+                        answer_correctness,
+                        answer_similarity,
+                        context_recall,
+                        faithfulness,
+                    ],
+                    llm=llm,
+                )
+                evaluation_result = result.__dict__.get("scores", {})
+
+                self.result = [
+                    {**item, "score": score}
+                    for item, score in zip(fully_data, evaluation_result)
+                ]
+                self._compact_checkpoint()
+
+            self.stage = "done"
+            self.status = "completed"
+        except Exception as e:
+            logger.error(f"Error during evaluation {self.run_id}: {str(e)}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+
+    def to_status(self):
+        with self._lock:
+            answered = len(self.answers)
+        return {
+            "run_id": self.run_id,
+            "status": self.status,
+            "stage": self.stage,
+            "total": len(self.items),
+            "answered": answered,
+            "failed": self.failed,
+            "error": self.error,
+            "result": self.result if self.status == "completed" else None,
+        }
+
+
+_runs = {}
+_runs_lock = threading.Lock()
+_run_executor = ThreadPoolExecutor(max_workers=Config.EVAL_RUN_WORKERS, thread_name_prefix="evaluation")
+
+
+def make_run_id(user_id, items):
+    """Cùng user và cùng bộ dữ liệu cho ra cùng run_id, nhờ đó dùng lại được checkpoint"""
+    raw = json.dumps([user_id, items], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def start_evaluation_run(user_id, items):
+    """Tạo (hoặc trả về run đang chạy) và đưa vào hàng đợi background"""
+    run_id = make_run_id(user_id, items)
+    with _runs_lock:
+        run = _runs.get(run_id)
+        if run is not None and run.status in ("queued", "running"):
+            return run, None
+        run = EvaluationRun(run_id, user_id, items)
+        _runs[run_id] = run
+    future = _run_executor.submit(run.run)
+    return run, future
+
+
+def validate_items(items):
+    if not items or not isinstance(items, list):
+        return "Input data is required"
+    for item in items:
+        if not isinstance(item, dict) or not item.get("question") or not item.get("expected_answer"):
+            return "Each item requires 'question' and 'expected_answer'"
+    return None
 
 
 @eval_pb.route("/evaluate", methods=["POST"])
@@ -130,43 +344,50 @@ def evaluate_data():
 
     try:
         input: list[dict] = request.get_json()
-        fully_data: list[dict] = []
 
-        if not input:
-            return jsonify({"error": "Input data is required"}), 400
+        error = validate_items(input)
+        if error:
+            return jsonify({"error": error}), 400
+
+        # Chạy qua cùng engine với background job và chờ kết quả
+        run, future = start_evaluation_run(user_id, input)
+        if future is not None:
+            future.result()
         else:
-            for item in input:
-                question = dict(item).get("question").strip()
-                answer = get_assistant_response(user_id, question)
-                expected_answer = dict(item).get("expected_answer").strip()
-                fully_data.append(
-                    {
-                        "question": question,
-                        "expected_answer": expected_answer,
-                        "answer": answer,
-                    }
-                )
-        dataset = normalize_data(fully_data)
-        print("Dataset loaded successfully")
-
-        llm = init_model()
-        result = evaluate(
-            dataset=dataset,
-            metrics=[
-                answer_correctness,
-                answer_similarity,
-                context_recall,
-                faithfulness,
-            ],
-            llm=llm,
-        )
-        evaluation_result = result.__dict__.get("scores", {})
+            while run.status in ("queued", "running"):
+                time.sleep(1)
 
-        fully_result = [
-            {**item, "score": score}
-            for item, score in zip(fully_data, evaluation_result)
-        ]
-        return jsonify(fully_result), 200
+        if run.status != "completed":
+            return jsonify({"error": f"An error occurred during evaluation: {run.error}"}), 500
+        return jsonify(run.result), 200
     except Exception as e:
         logger.error(f"Error during evaluation: {str(e)}")
         return jsonify({"error": f"An error occurred during evaluation: {str(e)}"}), 500
+
+
+@eval_pb.route("/jobs", methods=["POST"])
+def start_evaluation_job():
+    is_auth, user_id = require_auth()
+    if not is_auth:
+        return jsonify({"error": "Authentication required"}), 401
+
+    input: list[dict] = request.get_json()
+    error = validate_items(input)
+    if error:
+        return jsonify({"error": error}), 400
+
+    run, _ = start_evaluation_run(user_id, input)
+    return jsonify(run.to_status()), 202
+
+
+@eval_pb.route("/jobs/<run_id>", methods=["GET"])
+def get_evaluation_job(run_id):
+    is_auth, user_id = require_auth()
+    if not is_auth:
+        return jsonify({"error": "Authentication required"}), 401
+
+    with _runs_lock:
+        run = _runs.get(run_id)
+    if run is None or run.user_id != user_id:
+        return jsonify({"error": "Evaluation job not found"}), 404
+    return jsonify(run.to_status()), 200
@@ -1,12 +1,28 @@
 from flask import Blueprint, request, jsonify, session
-from db.database import get_connection, create_knowledge_base_table, insert_knowledge_base_file, get_knowledge_base_files_by_user
+from db.database import (
+    create_knowledge_base_table, insert_knowledge_base_file, get_knowledge_base_files_by_user, get_knowledge_base_file,
+    update_knowledge_base_file_content, delete_knowledge_base_file, find_knowledge_base_file,
+    create_knowledge_base_chunk_hashes_table, get_knowledge_base_chunk_hashes, save_knowledge_base_chunk_hashes,
+    reset_knowledge_base_chunk_hashes, create_ingestion_jobs_table, create_ingestion_job, update_ingestion_job,
+    fail_stale_ingestion_jobs, get_ingestion_job, get_ingestion_jobs_by_user
+)
 from app.config import Config
 from services.minio_service import MinioService
 from services.qdrant_service import QdrantService
+from services.ingestion_service import IngestionQueue, estimate_eta_seconds, cleanup_staging_dir, staging_prefix
+from services.response_cache import get_response_cache
+from services.chunking import iter_row_batches, iter_chunks, count_rows, chunk_content_hash
+from services.chunk_segments import ColumnarChunkWriter
+from services.chunk_store import (
+    chunk_segments_object_name, chunk_manifest_object_name, stored_chunk_object_names,
+    download_stored_chunks, get_chunk_page_store
+)
+import hashlib
 import logging
-import pandas as pd
 import os
 import json
+import shutil
+import tempfile
 from werkzeug.utils import secure_filename
 from io import BytesIO
 
@@ -18,6 +34,18 @@ logger = logging.getLogger(__name__)
 
 # Tạo bảng knowledge_base_files nếu chưa có
 create_knowledge_base_table()
+create_knowledge_base_chunk_hashes_table()
+create_ingestion_jobs_table()
+
+# Prefix của file upload chờ xử lý và thư mục làm việc của ingestion job trong UPLOAD_STAGING_DIR
+UPLOAD_STAGING_PREFIX = 'daomed-upload-'
+INGEST_WORK_DIR_PREFIX = 'daomed-ingest-'
+
+# Worker pool xử lý upload ở background
+ingestion_queue = IngestionQueue(Config.INGESTION_WORKERS)
+
+# File upload của các job chưa kịp chạy trước khi process dừng sẽ không còn ai xử lý
+cleanup_staging_dir(Config.UPLOAD_STAGING_DIR, (UPLOAD_STAGING_PREFIX, INGEST_WORK_DIR_PREFIX))
 
 def require_auth():
     """Kiểm tra user đã đăng nhập chưa"""
@@ -63,142 +91,393 @@ def upload_kb():
     if ext not in ['.xlsx', '.xls', '.csv']:
         return jsonify({'error': 'Only Excel (.xlsx, .xls) and CSV (.csv) files are allowed'}), 400
 
-    # Lưu file vào MinIO
+    # Ghi file upload ra đĩa theo từng khối (không đọc cả file vào bộ nhớ), file này
+    # vừa là nguồn upload lên MinIO với kích thước biết trước, vừa được chuyển cho
+    # ingestion job đọc trực tiếp thay vì tải lại từ MinIO
+    fd, staged_path = tempfile.mkstemp(prefix=staging_prefix(UPLOAD_STAGING_PREFIX), suffix=ext, dir=Config.UPLOAD_STAGING_DIR)
+    job = None
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as staged_file:
+            while True:
+                block = file.stream.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                staged_file.write(block)
+        file_size = os.path.getsize(staged_path)
+        content_hash = digest.hexdigest()
+        
+        # File trùng nội dung với một knowledge base đã có thì không xử lý lại
+        duplicate = find_knowledge_base_file(user_id, content_hash=content_hash)
+        if duplicate:
+            os.remove(staged_path)
+            logger.info(f"Upload of {filename} is identical to KB {duplicate['id']}, skipping ingestion")
+            return jsonify({
+                'message': 'Identical file already uploaded',
+                'filename': filename,
+                'file_size': file_size,
+                'duplicate': True,
+                'kb_id': duplicate['id'],
+                'metadata': duplicate
+            }), 200
+        
+        # Mỗi user chỉ có một job đang chạy cho mỗi tên file: hai upload cùng tên đồng thời
+        # sẽ cùng tạo KB mới hoặc cùng cập nhật một KB
+        source_object = source_object_name(filename, content_hash)
+        job = create_ingestion_job(user_id, filename, source_object, file_size, exclusive=True)
+        if job is None:
+            os.remove(staged_path)
+            return jsonify({'error': f'{filename} is already being processed, please wait for the current upload to finish'}), 409
+        
+        # Cùng tên với knowledge base đã có: cập nhật KB đó, chỉ embed lại các rows thay đổi.
+        # Tìm sau khi đã có job nên job trước cho cùng tên (nếu có) đã xong
+        existing = find_knowledge_base_file(user_id, filename=filename)
+        if existing:
+            update_ingestion_job(job['id'], job_type='update', kb_id=existing['id'])
+        
+        # Upload lên MinIO với tên theo nội dung, file gốc đang dùng chỉ được thay khi job thành công
+        minio_service = MinioService(Config)
+        success, msg = minio_service.upload_local_file(staged_path, source_object, file.mimetype)
+        if not success:
+            os.remove(staged_path)
+            update_ingestion_job(job['id'], status='failed', error=f'Failed to upload to MinIO: {msg}', finished_at=True)
+            return jsonify({'error': f'Failed to upload to MinIO: {msg}'}), 500
+        
+        # Parse, chunking và vectorize chạy ở background worker
+        ingestion_queue.submit(
+            job['id'], run_upload_job, filename, ext, file_size, user_id,
+            source_object=source_object, staged_path=staged_path, content_hash=content_hash, kb=existing
+        )
+        logger.info(f"Queued ingestion job {job['id']} for {filename} ({file_size} bytes)")
+    except Exception as e:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+        if job is not None:
+            # Không để job 'queued' mãi chặn các lần upload sau của cùng file
+            update_ingestion_job(job['id'], status='failed', error=str(e), finished_at=True)
+        logger.error(f"Error queueing ingestion job for {filename}: {str(e)}")
+        return jsonify({'error': f'Failed to queue ingestion job: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'File uploaded, processing in background',
+        'filename': filename,
+        'file_size': file_size,
+        'kb_id': existing['id'] if existing else None,
+        'job_id': job['id'],
+        'status_url': f"/api/kb/jobs/{job['id']}"
+    }), 202
+
+def source_object_name(filename, content_hash):
+    """Tên object của file gốc trên MinIO, gắn với nội dung để bản mới không ghi đè bản đang dùng"""
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{content_hash[:12]}{ext}"
+
+def recover_interrupted_jobs():
+    """
+    Dọn các job queued/running mà process giữ job đã dừng (không còn heartbeat, hàng đợi
+    nằm trong bộ nhớ của process đó): đánh dấu failed để frontend ngừng theo dõi. Job của
+    các worker process khác còn sống không bị động tới. Upload job chạy dở thì xóa KB đã tạo
+    một phần giống như khi job bị lỗi; update job chạy dở thì khôi phục phiên bản trước.
+    Chạy lúc startup và sau mỗi lần heartbeat của ingestion_queue
+    """
+    jobs = fail_stale_ingestion_jobs(
+        'Interrupted because the worker processing it stopped, please upload the file again',
+        Config.INGESTION_STALE_SECONDS
+    )
+    for job in jobs:
+        try:
+            if job['job_type'] == 'upload' and job['kb_id'] is not None:
+                delete_knowledge_base_file(job['kb_id'])
+                QdrantService(Config).delete_kb_chunks(job['kb_id'])
+                MinioService(Config).delete_file(job['minio_path'])
+            elif job['job_type'] == 'update' and job['kb_id'] is not None:
+                restore_knowledge_base(job)
+        except Exception as e:
+            logger.error(f"Could not clean up interrupted ingestion job {job['id']}: {str(e)}")
+    if jobs:
+        logger.warning(f"Marked {len(jobs)} interrupted ingestion jobs as failed")
+    return jobs
+
+def restore_knowledge_base(job):
+    """
+    Update job bị dừng giữa chừng có thể đã upsert một phần vectors và chunks của file mới,
+    trong khi KB vẫn trỏ tới file gốc cũ: bỏ hash đã lưu (KB không còn khớp hash) rồi ingest
+    lại file gốc cũ, embed lại toàn bộ rows (phần lớn lấy từ embedding cache)
+    """
+    kb = get_knowledge_base_file(job['kb_id'], job['user_id'])
+    if not kb:
+        return None
+    if job['minio_path'] != kb['minio_path']:
+        MinioService(Config).delete_file(job['minio_path'])
+    reset_knowledge_base_chunk_hashes(kb['id'])
+    
+    restore_job = create_ingestion_job(
+        job['user_id'], kb['filename'], kb['minio_path'], kb['file_size'], job_type='update', kb_id=kb['id'], exclusive=True
+    )
+    if restore_job is None:
+        # User đã upload lại file này, job đó sẽ embed lại toàn bộ vì hash đã bị xóa
+        return None
+    ext = os.path.splitext(kb['filename'])[1].lower()
+    ingestion_queue.submit(
+        restore_job['id'], run_upload_job, kb['filename'], ext, kb['file_size'], job['user_id'],
+        source_object=kb['minio_path'], content_hash=kb['content_hash'], kb=kb
+    )
+    logger.warning(f"Queued job {restore_job['id']} to restore KB {kb['id']} after interrupted update job {job['id']}")
+    return restore_job
+
+def _changed_chunks(chunks, old_hashes, new_hashes, progress):
+    """
+    Chỉ yield chunks có hash khác với lần upload trước (theo chunk_id), ghi hash mới vào new_hashes.
+    Các chunk_id còn lại trong old_hashes sau khi đọc hết là rows đã bị bỏ khỏi file
+    """
+    for chunk in chunks:
+        content_hash = chunk_content_hash(chunk)
+        if old_hashes.pop(chunk['id'], None) == content_hash:
+            progress.advance(1)
+            continue
+        new_hashes[chunk['id']] = content_hash
+        yield chunk
+
+def run_upload_job(progress, filename, ext, file_size, user_id, source_object, staged_path=None, content_hash=None, kb=None):
+    """
+    Xử lý một file đã upload lên MinIO (object source_object): đọc theo batch rows, chunking,
+    ghi chunks ra file tạm và vectorize tăng dần, nên bộ nhớ chỉ phụ thuộc batch size.
+    staged_path là bản local của file do upload_kb để lại, nếu có thì không cần tải lại.
+    Với kb (upload lại file cùng tên) chỉ embed/upsert các rows có hash thay đổi và
+    xóa vectors của rows đã bị bỏ; KB chỉ chuyển sang source_object khi job thành công.
+    Chạy trong ingestion worker.
+    """
     minio_service = MinioService(Config)
+    # Object gốc của KB trước khi cập nhật (KB cũ có thể đã dùng đúng tên này)
+    previous_object = kb['minio_path'] if kb is not None else None
     
-    # Đọc toàn bộ file content trước
-    file_content = file.read()
+    with tempfile.TemporaryDirectory(prefix=staging_prefix(INGEST_WORK_DIR_PREFIX), dir=Config.UPLOAD_STAGING_DIR) as work_dir:
+        source_path = os.path.join(work_dir, f"source{ext}")
+        if staged_path and os.path.exists(staged_path):
+            # Cùng thư mục staging nên chỉ là rename; file được dọn cùng work_dir
+            shutil.move(staged_path, source_path)
+        else:
+            progress.stage('downloading')
+            success, msg = minio_service.download_file(source_object, source_path)
+            if not success:
+                raise RuntimeError(f"Failed to download {source_object} from MinIO: {msg}")
+        
+        total_rows = count_rows(source_path, ext)
+        if total_rows is not None:
+            progress.set_total(total_rows)
+        
+        if kb is None:
+            # Lưu metadata trước để có kb_id cho Qdrant, num_chunks và content_hash cập nhật khi xong
+            progress.stage('saving_metadata')
+            meta = insert_knowledge_base_file(
+                filename=filename,
+                minio_path=source_object,
+                num_chunks=0,
+                file_size=file_size,
+                description=None,
+                user_id=user_id
+            )
+            kb_id = meta['id']
+            update_ingestion_job(progress.job_id, kb_id=kb_id)
+            old_hashes = {}
+        else:
+            meta = dict(kb)
+            kb_id = kb['id']
+            old_hashes = get_knowledge_base_chunk_hashes(kb_id)
+        new_hashes = {}
+        
+        try:
+            # Đọc file, chunking, ghi chunks và vectorize theo từng batch
+            progress.stage('vectorizing')
+            qdrant_service = QdrantService(Config)
+            with open(os.path.join(work_dir, 'chunks.seg'), 'w+b') as chunks_file:
+                writer = ColumnarChunkWriter(chunks_file, filename, segment_size=Config.CHUNK_SEGMENT_SIZE)
+                chunks = _changed_chunks(
+                    writer.tee(iter_chunks(iter_row_batches(source_path, ext, Config.INGESTION_ROW_BATCH_SIZE))),
+                    old_hashes, new_hashes, progress
+                )
+                
+                vectorization = None
+                success, result = qdrant_service.vectorize_chunks(chunks, kb_id, user_id, progress_callback=progress.advance)
+                # Vectorize dừng giữa chừng thì đọc nốt để vẫn ghi đủ chunks (đã đọc hết thì không làm gì)
+                for _ in chunks:
+                    pass
+                if writer.error is not None:
+                    # File lỗi khi đọc/chunking thì fail cả job
+                    raise writer.error
+                if success:
+                    vectorization = result
+                    logger.info(f"Successfully vectorized chunks: {result}")
+                elif not new_hashes:
+                    # Không có chunk nào cần embed (upload lại mà không row nào thay đổi, hoặc file rỗng)
+                    vectorization = {'vectorized_chunks': 0}
+                elif kb is not None:
+                    # Upload lại: giữ nguyên KB cũ thay vì lưu chunks chưa được embed
+                    raise RuntimeError(f"Failed to vectorize changed chunks: {result}")
+                else:
+                    # Không fail job nếu vectorize thất bại, vẫn lưu đủ chunks và metadata;
+                    # không lưu hash (cả hash của file) để upload lại cùng file sẽ embed lại toàn bộ
+                    logger.warning(f"Failed to vectorize chunks: {result}")
+                    new_hashes = {}
+                    content_hash = None
+                
+                num_chunks = writer.count
+                chunks_size = writer.close()
+                logger.info(
+                    f"Created {num_chunks} chunks from file {filename} "
+                    f"({writer.raw_bytes} bytes -> {chunks_size} bytes {writer.codec})"
+                )
+                
+                # Lưu chunks vào MinIO: file segments trước, manifest sau cùng
+                # (có manifest nghĩa là segments đã đầy đủ)
+                progress.stage('storing_chunks')
+                segments_filename = chunk_segments_object_name(filename)
+                success, msg = minio_service.upload_file(chunks_file, segments_filename, 'application/octet-stream', length=chunks_size)
+                if not success:
+                    logger.warning(f"Failed to save chunks to MinIO: {msg}")
+                else:
+                    manifest_data = json.dumps(writer.manifest(), ensure_ascii=False).encode('utf-8')
+                    success, msg = minio_service.upload_file(
+                        BytesIO(manifest_data), chunk_manifest_object_name(filename), 'application/json', length=len(manifest_data)
+                    )
+                    if not success:
+                        logger.warning(f"Failed to save chunks manifest to MinIO: {msg}")
+                    else:
+                        logger.info(f"Successfully saved chunks to MinIO: {segments_filename}")
+            
+            # Rows không còn trong file mới (chunk_id >= số chunks mới): xóa vectors và hash.
+            # Không dựa vào old_hashes vì KB cũ hoặc KB embed lỗi có thể không có hash
+            removed_chunks = 0
+            if kb is not None:
+                success, result = qdrant_service.delete_chunks_from(kb_id, num_chunks)
+                if not success:
+                    raise RuntimeError(f"Failed to delete removed chunks: {result}")
+                removed_chunks = max(len(old_hashes), (kb.get('num_chunks') or 0) - num_chunks)
+            save_knowledge_base_chunk_hashes(kb_id, new_hashes, num_chunks)
+            
+            update_knowledge_base_file_content(kb_id, num_chunks, file_size, content_hash, source_object)
+            get_chunk_page_store(Config).invalidate(kb_id)
+            # Knowledge base thay đổi, các câu trả lời đã cache không còn đúng
+            get_response_cache(Config).invalidate_kb(user_id)
+        except Exception:
+            if kb is None:
+                # Dọn metadata và vectors đã ghi dở để không để lại KB lỗi
+                delete_knowledge_base_file(kb_id)
+                QdrantService(Config).delete_kb_chunks(kb_id)
+            if source_object != previous_object:
+                # KB vẫn trỏ tới file gốc cũ, bản mới không còn được dùng
+                minio_service.delete_file(source_object)
+            raise
     
-    # Tính file size chính xác
-    file_size = len(file_content)
+    if previous_object and previous_object != source_object:
+        minio_service.delete_file(previous_object)
     
-    # Upload to MinIO
-    file_stream = BytesIO(file_content)
-    success, msg = minio_service.upload_file(file_stream, filename, file.mimetype)
-    if not success:
-        return jsonify({'error': f'Failed to upload to MinIO: {msg}'}), 500
+    meta['num_chunks'] = num_chunks
+    meta['file_size'] = file_size
+    meta['content_hash'] = content_hash
+    meta['minio_path'] = source_object
+    return {
+        'filename': filename,
+        'num_chunks': num_chunks,
+        'file_size': file_size,
+        'metadata': meta,
+        'vectorization': vectorization,
+        'changed_chunks': len(new_hashes),
+        'removed_chunks': removed_chunks
+    }
 
-    # Đọc file và thực hiện chunking
+@kb_bp.route('/<int:kb_id>/reindex', methods=['POST'])
+def reindex_kb(kb_id):
+    """Embed lại knowledge base (ví dụ sau khi đổi model) ở background, search vẫn chạy trong lúc reindex"""
+    is_auth, user_id = require_auth()
+    if not is_auth:
+        return jsonify({'error': 'Authentication required'}), 401
+    
     try:
-        file_stream = BytesIO(file_content)
-        if ext == '.csv':
-            # Đọc CSV với TAB delimiter như yêu cầu
-            df = pd.read_csv(file_stream, encoding='utf-8', sep='\t')
-        elif ext == '.xlsx':
-            # Đọc XLSX với openpyxl engine
-            df = pd.read_excel(file_stream, engine='openpyxl')
-        else:
-            # Đọc XLS với xlrd engine
-            df = pd.read_excel(file_stream, engine='xlrd')
-        
-        logger.info(f"Successfully read file: {filename}, shape: {df.shape}")
-        
-        # Thực hiện chunking
-        chunks = perform_chunking(df)
-        num_chunks = len(chunks)
-        
-        logger.info(f"Created {num_chunks} chunks from file {filename}")
-        
+        kb = get_knowledge_base_file(kb_id, user_id)
+        if not kb:
+            return jsonify({'error': 'Knowledge base not found'}), 404
+        
+        # Không reindex trong lúc file của KB đang được upload lại (và ngược lại)
+        job = create_ingestion_job(user_id, kb['filename'], kb['minio_path'], kb.get('file_size'), job_type='reindex', kb_id=kb_id, exclusive=True)
+        if job is None:
+            return jsonify({'error': 'Knowledge base is being processed, please try again later'}), 409
+        ingestion_queue.submit(job['id'], run_reindex_job, kb, user_id)
+        logger.info(f"Queued reindex job {job['id']} for KB {kb_id}")
     except Exception as e:
-        logger.error(f"Error processing file {filename}: {str(e)}")
-        return jsonify({'error': f'Failed to process file: {str(e)}'}), 400
+        logger.error(f"Error queueing reindex job for KB {kb_id}: {str(e)}")
+        return jsonify({'error': f'Failed to queue reindex job: {str(e)}'}), 500
+    
+    return jsonify({
+        'message': 'Reindex started',
+        'kb_id': kb_id,
+        'job_id': job['id'],
+        'status_url': f"/api/kb/jobs/{job['id']}"
+    }), 202
 
-    minio_path = filename
+def run_reindex_job(progress, kb, user_id):
+    """
+    Đọc lại chunks đã lưu trong MinIO và upsert theo batch với index_generation mới,
+    sau đó xóa các vectors cũ của KB bằng payload filter. Chạy trong ingestion worker.
+    """
+    minio_service = MinioService(Config)
+    kb_id = kb['id']
     
-    # Lưu chunks vào MinIO
-    try:
-        chunks_filename = f"{os.path.splitext(filename)[0]}_chunks.json"
-        chunks_data = {
-            'filename': filename,
-            'total_chunks': num_chunks,
-            'chunks': chunks
-        }
+    with tempfile.TemporaryDirectory(prefix='daomed-reindex-') as work_dir:
+        progress.stage('downloading')
+        chunks = download_stored_chunks(minio_service, kb['filename'], work_dir)
         
-        chunks_json = json.dumps(chunks_data, indent=2, ensure_ascii=False)
-        chunks_stream = BytesIO(chunks_json.encode('utf-8'))
+        if kb.get('num_chunks'):
+            progress.set_total(kb['num_chunks'])
         
-        success, msg = minio_service.upload_file(chunks_stream, chunks_filename, 'application/json')
+        progress.stage('vectorizing')
+        success, result = QdrantService(Config).reindex_kb(
+            chunks, kb_id, user_id, progress_callback=progress.advance
+        )
         if not success:
-            logger.warning(f"Failed to save chunks to MinIO: {msg}")
-        
-        logger.info(f"Successfully saved chunks to MinIO: {chunks_filename}")
-        
-    except Exception as e:
-        logger.error(f"Error saving chunks to MinIO: {str(e)}")
+            raise RuntimeError(f"Failed to reindex KB {kb_id}: {result}")
+    
+    get_response_cache(Config).invalidate_kb(user_id)
+    logger.info(f"Reindexed KB {kb_id}: {result}")
+    return {
+        'kb_id': kb_id,
+        'filename': kb['filename'],
+        'vectorization': result
+    }
 
-    # Lưu metadata vào DB trước
+@kb_bp.route('/jobs', methods=['GET'])
+def list_ingestion_jobs():
+    """Danh sách ingestion jobs gần đây của user"""
+    is_auth, user_id = require_auth()
+    if not is_auth:
+        return jsonify({'error': 'Authentication required'}), 401
+    
     try:
-        meta = insert_knowledge_base_file(
-            filename=filename,
-            minio_path=minio_path,
-            num_chunks=num_chunks,
-            file_size=file_size,
-            description=None,
-            user_id=user_id
-        )
-        
-        logger.info(f"Successfully saved metadata for {filename}")
-        
+        jobs = get_ingestion_jobs_by_user(user_id)
+        for job in jobs:
+            job['eta_seconds'] = estimate_eta_seconds(job)
+        return jsonify({'jobs': jobs}), 200
     except Exception as e:
-        logger.error(f"Error saving metadata: {str(e)}")
-        return jsonify({'error': f'Failed to save metadata: {str(e)}'}), 500
+        logger.error(f"Error listing ingestion jobs: {str(e)}")
+        return jsonify({'error': 'Database error'}), 500
 
-    # Vectorize chunks và lưu vào Qdrant
+@kb_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_ingestion_job_status(job_id):
+    """Trạng thái của một ingestion job: stage, số rows đã xử lý và ETA"""
+    is_auth, user_id = require_auth()
+    if not is_auth:
+        return jsonify({'error': 'Authentication required'}), 401
+    
     try:
-        qdrant_service = QdrantService(Config)
-        success, msg = qdrant_service.vectorize_chunks(chunks, meta['id'], user_id)
-        if not success:
-            logger.warning(f"Failed to vectorize chunks: {msg}")
-        else:
-            logger.info(f"Successfully vectorized chunks: {msg}")
+        job = get_ingestion_job(job_id, user_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        job['eta_seconds'] = estimate_eta_seconds(job)
+        return jsonify(job), 200
     except Exception as e:
-        logger.error(f"Error vectorizing chunks: {str(e)}")
-        # Không fail upload nếu vectorize thất bại
-
-    return jsonify({
-        'message': 'File uploaded and processed successfully',
-        'filename': filename,
-        'num_chunks': num_chunks,
-        'file_size': file_size,
-        'metadata': meta
-    }), 200
-
-def perform_chunking(df):
-    """
-    Thực hiện chunking dữ liệu từ DataFrame theo từng row
-    Mỗi row sẽ trở thành một chunk riêng biệt
-    """
-    chunks = []
-    
-    # Lấy headers (column names)
-    headers = df.columns.tolist()
-    
-    # Xử lý từng row trong DataFrame
-    for index, row in df.iterrows():
-        # Tạo chunk text từ header và data của row
-        chunk_parts = []
-        
-        # Thêm headers và values
-        for header, value in zip(headers, row):
-            # Xử lý giá trị NaN
-            if pd.isna(value):
-                value = ""
-            else:
-                value = str(value).strip()
-            
-            chunk_parts.append(f"{header}: {value}")
-        
-        # Tạo chunk text
-        chunk_text = " | ".join(chunk_parts)
-        
-        chunks.append({
-            'id': index,
-            'text': chunk_text,
-            'row_index': index,
-            'headers': headers
-        })
-    
-    return chunks
+        logger.error(f"Error getting ingestion job {job_id}: {str(e)}")
+        return jsonify({'error': 'Database error'}), 500
 
 @kb_bp.route('/<int:kb_id>', methods=['DELETE'])
 def delete_kb(kb_id):
@@ -211,19 +490,19 @@ def delete_kb(kb_id):
         logger.info(f"Deleting knowledge base with ID: {kb_id} by user {user_id}")
         
         # Lấy thông tin file từ database và kiểm tra ownership
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT filename, minio_path FROM knowledge_base_files WHERE id = %s AND user_id = %s", (kb_id, user_id))
-        result = cur.fetchone()
+        kb_file = get_knowledge_base_file(kb_id, user_id)
         
-        if not result:
+        if not kb_file:
             return jsonify({'error': 'Knowledge base not found or access denied'}), 404
         
-        filename, minio_path = result
+        filename, minio_path = kb_file['filename'], kb_file['minio_path']
         
-        # Xóa file từ MinIO
+        # Xóa file gốc, chunks và index từ MinIO
         minio_service = MinioService(Config)
         minio_service.delete_file(minio_path)
+        for object_name in stored_chunk_object_names(filename):
+            minio_service.delete_file(object_name)
+        get_chunk_page_store(Config).invalidate(kb_id)
         
         # Xóa chunks khỏi Qdrant
         try:
@@ -231,13 +510,10 @@ def delete_kb(kb_id):
             qdrant_service.delete_kb_chunks(kb_id)
         except Exception as e:
             logger.warning(f"Failed to delete chunks from Qdrant: {str(e)}")
+        get_response_cache(Config).invalidate_kb(user_id)
         
         # Xóa record từ database
-        cur.execute("DELETE FROM knowledge_base_files WHERE id = %s", (kb_id,))
-        conn.commit()
-        
-        cur.close()
-        conn.close()
+        delete_knowledge_base_file(kb_id)
         
         logger.info(f"Successfully deleted knowledge base: {filename}")
         return jsonify({'message': f'Knowledge base {filename} deleted successfully'}), 200
@@ -270,35 +546,20 @@ def get_kb_chunks(kb_id):
         logger.info(f"Getting chunks for knowledge base ID: {kb_id} by user {user_id}, page {page}, size {page_size}")
         
         # Lấy thông tin file từ database và kiểm tra ownership
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT filename, minio_path FROM knowledge_base_files WHERE id = %s AND user_id = %s", (kb_id, user_id))
-        result = cur.fetchone()
+        kb_file = get_knowledge_base_file(kb_id, user_id)
         
-        if not result:
+        if not kb_file:
             return jsonify({'error': 'Knowledge base not found or access denied'}), 404
         
-        filename, minio_path = result
+        filename = kb_file['filename']
         
-        # Tạo tên file chunks
-        chunks_filename = f"{os.path.splitext(filename)[0]}_chunks.json"
-        
-        # Đọc chunks từ MinIO
-        minio_service = MinioService(Config)
-        chunks_file = minio_service.get_file(chunks_filename)
-        
-        if not chunks_file:
+        # Chỉ đọc byte range của trang cần xem (có cache các trang vừa xem)
+        page_data = get_chunk_page_store(Config).get_page(kb_id, filename, page, page_size)
+        if page_data is None:
             return jsonify({'error': 'Chunks file not found in MinIO'}), 404
-        
-        # Parse JSON chunks
-        chunks_data = json.loads(chunks_file.read().decode('utf-8'))
-        all_chunks = chunks_data.get('chunks', [])
-        total_chunks = len(all_chunks)
-        
-        # Calculate pagination
+        paginated_chunks, total_chunks = page_data
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
-        paginated_chunks = all_chunks[start_idx:end_idx]
         
         # Calculate pagination info
         total_pages = (total_chunks + page_size - 1) // page_size
@@ -340,12 +601,7 @@ def get_chunk_vector(kb_id, chunk_id):
         logger.info(f"Getting vector for chunk {chunk_id} in KB {kb_id} by user {user_id}")
         
         # Kiểm tra ownership của KB
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT filename FROM knowledge_base_files WHERE id = %s AND user_id = %s", (kb_id, user_id))
-        result = cur.fetchone()
-        
-        if not result:
+        if not get_knowledge_base_file(kb_id, user_id):
             return jsonify({'error': 'Knowledge base not found or access denied'}), 404
         
         # Lấy vector từ Qdrant
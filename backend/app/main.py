@@ -1,14 +1,40 @@
-from flask import Flask, session, jsonify
+from flask import Flask, Request, session, jsonify
 from flask_cors import CORS
 from flask_session import Session
 from sqlalchemy import create_engine
 from .chat import chat_bp
-from .kb import kb_bp
+from .kb import kb_bp, ingestion_queue, recover_interrupted_jobs
 from .config import Config
 from .dialog import dialog_bp
 from .eval import eval_pb
+from services.embedding_registry import embedding_registry
+from db.database import get_pool_stats
+from services.response_cache import get_response_cache
+from services.query_embedding_cache import get_query_embedding_cache
+from services.embedding_dispatcher import get_dispatcher_stats
+from services.reranker import get_reranker, get_reranker_stats
+from services.rag_service_pool import get_rag_service_pool
+from services.chunk_store import get_chunk_page_store
+from services.embedding_cache import get_embedding_cache
+from services.qdrant_service import VECTOR_SIZE
+from services.readiness import check_readiness, initialize_dependencies
+
+# Các endpoint nhận file upload lớn (ghi ra đĩa theo stream), được phép vượt MAX_REQUEST_SIZE_MB
+LARGE_UPLOAD_ENDPOINTS = {'kb.upload_kb'}
+
+
+class AppRequest(Request):
+    """Giới hạn kích thước request nhỏ cho mọi API, trừ các endpoint upload file"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint in LARGE_UPLOAD_ENDPOINTS:
+            return Config.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+        return Config.MAX_REQUEST_SIZE_MB * 1024 * 1024
+
 
 app = Flask(__name__)
+app.request_class = AppRequest
 app.secret_key = Config.SECRET_KEY
 
 # Cấu hình SQLAlchemy cho Flask-Session
@@ -27,7 +53,7 @@ Session(app)
 
 # Configure timeout for long operations
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_REQUEST_SIZE_MB * 1024 * 1024
 
 # Register blueprints
 app.register_blueprint(chat_bp, url_prefix='/api/chat')
@@ -35,12 +61,64 @@ app.register_blueprint(kb_bp, url_prefix='/api/kb')
 app.register_blueprint(dialog_bp, url_prefix='/api/dialog')
 app.register_blueprint(eval_pb, url_prefix='/api/eval')
 
-# Enable CORS
-CORS(app, supports_credentials=True, origins=['http://localhost:3000'])
+# Enable CORS (async chat route trong app/asgi.py dùng cùng danh sách origins)
+CORS_ORIGINS = ['http://localhost:3000']
+CORS(app, supports_credentials=True, origins=CORS_ORIGINS)
 
 @app.route('/api/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Backend is running'}), 200
 
+@app.route('/api/health/ready')
+def readiness_check():
+    ready, checks = check_readiness(Config)
+    return jsonify({'ready': ready, 'checks': checks}), 200 if ready else 503
+
+@app.route('/api/health/models')
+def models_health():
+    return jsonify({
+        'models': embedding_registry.get_stats(),
+        'dispatchers': get_dispatcher_stats(),
+        'reranker': get_reranker_stats()
+    }), 200
+
+@app.route('/api/health/db')
+def db_health():
+    return jsonify({'pool': get_pool_stats()}), 200
+
+@app.route('/api/health/cache')
+def cache_health():
+    embedding_cache = get_embedding_cache(Config, VECTOR_SIZE)
+    return jsonify({
+        'response_cache': get_response_cache(Config).get_stats(),
+        'query_embedding_cache': get_query_embedding_cache(Config).get_stats(),
+        'rag_service_pool': get_rag_service_pool(Config).get_stats(),
+        'chunk_pages': get_chunk_page_store(Config).get_stats(),
+        'embedding_cache': embedding_cache.get_stats() if embedding_cache else None
+    }), 200
+
+# Tạo Qdrant collection / MinIO bucket một lần lúc startup thay vì kiểm tra ở mỗi request
+initialize_dependencies(Config)
+
+# Ingestion jobs bị gián đoạn bởi lần restart trước; sau đó heartbeat các job của process
+# này và định kỳ dọn job của các process đã dừng
+try:
+    recover_interrupted_jobs()
+except Exception as e:
+    app.logger.warning(f"Could not recover interrupted ingestion jobs: {e}")
+ingestion_queue.start_heartbeat(Config.INGESTION_HEARTBEAT_SECONDS, recover_interrupted_jobs)
+
+# Load embedding model một lần cho worker process này
+if Config.PRELOAD_EMBEDDING_MODEL:
+    try:
+        embedding_registry.get_model(Config.MODEL_PATH)
+    except Exception as e:
+        app.logger.warning(f"Could not preload embedding model: {e}")
+    if Config.RERANKER_ENABLED:
+        try:
+            get_reranker(Config)
+        except Exception as e:
+            app.logger.warning(f"Could not preload reranker model: {e}")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5050, debug=True)
\ No newline at end of file
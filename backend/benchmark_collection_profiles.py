@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark recall@k and search latency of the Qdrant collection profiles
+
+Copies a sample of points from the chunks collection into one temporary collection per profile,
+uses the stored vectors of random chunks as queries, and compares every profile against
+exact (brute-force) search on the source collection.
+
+Usage: python benchmark_collection_profiles.py [sample_size] [num_queries] [top_k]
+"""
+
+import random
+import sys
+import time
+import numpy as np
+from qdrant_client.models import PointStruct, SearchParams
+from app.config import Config
+from services.qdrant_service import QdrantService
+from services.collection_profiles import (
+    COLLECTION_PROFILES, get_collection_profile, collection_create_kwargs, search_params
+)
+
+def load_sample(client, collection, sample_size, batch_size=256):
+    points, offset = [], None
+    while len(points) < sample_size:
+        batch, offset = client.scroll(
+            collection_name=collection,
+            limit=min(batch_size, sample_size - len(points)),
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        points.extend(batch)
+        if offset is None:
+            break
+    # Chỉ benchmark dense vector (bỏ sparse vector lexical nếu có)
+    for point in points:
+        if isinstance(point.vector, dict):
+            point.vector = point.vector['']
+    return points
+
+def build_collection(client, name, profile, vector_size, points, batch_size=256):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(collection_name=name, **collection_create_kwargs(profile, vector_size))
+    for start in range(0, len(points), batch_size):
+        client.upsert(
+            collection_name=name,
+            points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points[start:start + batch_size]],
+            wait=True
+        )
+    # Chờ optimizer build xong index để đo đúng
+    while not str(client.get_collection(name).status).lower().endswith('green'):
+        time.sleep(1)
+
+def run_queries(client, name, queries, top_k, params):
+    ids, latencies = [], []
+    for vector in queries:
+        started = time.perf_counter()
+        hits = client.search(collection_name=name, query_vector=vector, limit=top_k, search_params=params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        ids.append({hit.id for hit in hits})
+    return ids, latencies
+
+def benchmark(sample_size=20000, num_queries=200, top_k=10):
+    qdrant_service = QdrantService(Config)
+    client = qdrant_service.client
+    
+    points = load_sample(client, qdrant_service.collection_name, sample_size)
+    if not points:
+        print("❌ Collection is empty")
+        return
+    queries = [p.vector for p in random.sample(points, min(num_queries, len(points)))]
+    print(f"Loaded {len(points)} points, {len(queries)} queries, top_k={top_k}")
+    
+    results = {}
+    truth = None
+    for name in COLLECTION_PROFILES:
+        profile = get_collection_profile(name)
+        bench_collection = f"{qdrant_service.collection_name}_bench_{name}"
+        build_collection(client, bench_collection, profile, qdrant_service.vector_size, points)
+        try:
+            if truth is None:
+                truth, _ = run_queries(client, bench_collection, queries, top_k, SearchParams(exact=True))
+            found, latencies = run_queries(client, bench_collection, queries, top_k, search_params(profile))
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth) if t])
+            results[name] = {
+                'recall': float(recall),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95))
+            }
+        finally:
+            client.delete_collection(bench_collection)
+    
+    print(f"\n{'profile':<10} {'recall@' + str(top_k):>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['recall']:>10.4f} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f}")
+    return results
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    benchmark(*args)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Maintenance script to delete Qdrant vectors of knowledge bases that no longer exist in PostgreSQL
+"""
+
+from app.config import Config
+from db.database import get_all_knowledge_base_ids
+from services.qdrant_service import QdrantService
+
+def cleanup_orphaned_chunks():
+    """Delete every point whose kb_id is not in knowledge_base_files, using a single filter-based delete"""
+    
+    kb_ids = get_all_knowledge_base_ids()
+    print(f"Found {len(kb_ids)} knowledge bases in PostgreSQL")
+    
+    qdrant_service = QdrantService(Config)
+    _, before = qdrant_service.get_collection_info()
+    
+    success, msg = qdrant_service.delete_orphaned_chunks(kb_ids)
+    if not success:
+        print(f"❌ Cleanup failed: {msg}")
+        raise SystemExit(1)
+    
+    ok, after = qdrant_service.get_collection_info()
+    if ok and not isinstance(before, str):
+        print(f"✅ Removed {before.points_count - after.points_count} orphaned points")
+    else:
+        print("✅ Orphaned points removed")
+
+if __name__ == "__main__":
+    print("🔄 Starting orphaned chunks cleanup...")
+    cleanup_orphaned_chunks()
+    print("✅ Cleanup finished!")
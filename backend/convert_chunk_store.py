@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Migration script to convert stored chunks from pretty-printed _chunks.json files
+to the compressed columnar segment format (_chunks.seg + _chunks.manifest.json)
+
+Knowledge bases that already have a manifest are skipped, so the script can be re-run.
+With --delete-json the old _chunks.json/_chunks.idx.json objects are removed after
+conversion; restart the backend afterwards so no process keeps the old index cached.
+
+Usage: python convert_chunk_store.py [--delete-json]
+"""
+
+import json
+import os
+import sys
+import tempfile
+from io import BytesIO
+from app.config import Config
+from db.database import connection
+from services.minio_service import MinioService
+from services.chunking import iter_chunks_from_file
+from services.chunk_segments import ColumnarChunkWriter
+from services.chunk_store import (
+    chunks_object_name, chunk_index_object_name,
+    chunk_segments_object_name, chunk_manifest_object_name
+)
+
+def get_knowledge_base_files():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, filename FROM knowledge_base_files ORDER BY id")
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+def convert_file(minio_service, filename, work_dir):
+    """Convert one knowledge base file, returns (json_bytes, segment_bytes)"""
+    json_path = os.path.join(work_dir, 'chunks.json')
+    success, msg = minio_service.download_file(chunks_object_name(filename), json_path)
+    if not success:
+        raise RuntimeError(msg)
+
+    with open(os.path.join(work_dir, 'chunks.seg'), 'w+b') as seg_file:
+        writer = ColumnarChunkWriter(seg_file, filename, segment_size=Config.CHUNK_SEGMENT_SIZE)
+        for chunk in iter_chunks_from_file(json_path):
+            writer.write(chunk)
+        size = writer.close()
+
+        success, msg = minio_service.upload_file(seg_file, chunk_segments_object_name(filename), 'application/octet-stream', length=size)
+        if not success:
+            raise RuntimeError(msg)
+
+    # Manifest ghi sau cùng để reader chỉ thấy segments đã upload đầy đủ
+    manifest_data = json.dumps(writer.manifest(), ensure_ascii=False).encode('utf-8')
+    success, msg = minio_service.upload_file(
+        BytesIO(manifest_data), chunk_manifest_object_name(filename), 'application/json', length=len(manifest_data)
+    )
+    if not success:
+        raise RuntimeError(msg)
+
+    return os.path.getsize(json_path), size + len(manifest_data)
+
+def convert_chunk_store(delete_json=False):
+    minio_service = MinioService(Config)
+    converted = skipped = failed = 0
+    json_total = segment_total = 0
+
+    for kb_id, filename in get_knowledge_base_files():
+        manifest = minio_service.get_file(chunk_manifest_object_name(filename))
+        if manifest is not None:
+            manifest.close()
+            manifest.release_conn()
+            skipped += 1
+            continue
+
+        with tempfile.TemporaryDirectory(prefix='daomed-convert-') as work_dir:
+            try:
+                json_size, segment_size = convert_file(minio_service, filename, work_dir)
+            except Exception as e:
+                print(f"  ❌ KB {kb_id} ({filename}): {str(e)}")
+                failed += 1
+                continue
+
+        json_total += json_size
+        segment_total += segment_size
+        converted += 1
+        print(f"  ✅ KB {kb_id} ({filename}): {json_size} -> {segment_size} bytes")
+
+        if delete_json:
+            minio_service.delete_file(chunks_object_name(filename))
+            minio_service.delete_file(chunk_index_object_name(filename))
+
+    print(f"Converted {converted} files, skipped {skipped} already converted, {failed} failed")
+    if converted:
+        print(f"Storage: {json_total} -> {segment_total} bytes ({segment_total / json_total:.1%})")
+    return failed == 0
+
+if __name__ == "__main__":
+    print("🔄 Converting chunk store to columnar segments...")
+    if not convert_chunk_store(delete_json='--delete-json' in sys.argv[1:]):
+        raise SystemExit(1)
+    print("✅ Conversion finished!")
@@ -0,0 +1,75 @@
+# Các truy vấn dùng trong async chat endpoint (app/asgi.py), chạy bằng asyncpg trên event loop
+# của ASGI server thay vì chiếm một thread như psycopg2. Kết quả có cùng dạng với các hàm
+# tương ứng trong db/database.py
+from app.config import Config
+import asyncio
+import json
+import asyncpg
+
+_pool = None
+_pool_lock = None
+
+
+async def _init_connection(conn):
+    # JSONB trả về dict giống psycopg2 (model_config của dialog)
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def get_async_pool():
+    """Pool asyncpg của process, tạo ở lần dùng đầu tiên trong event loop của ASGI server"""
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    host=Config.POSTGRES_HOST,
+                    port=Config.POSTGRES_PORT,
+                    database=Config.POSTGRES_DB,
+                    user=Config.POSTGRES_USER,
+                    password=Config.POSTGRES_PASSWORD,
+                    min_size=Config.DB_POOL_MIN_SIZE,
+                    max_size=Config.DB_POOL_MAX_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    init=_init_connection
+                )
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def aget_dialog_by_id(dialog_id, user_id):
+    pool = await get_async_pool()
+    row = await pool.fetchrow('''
+        SELECT d.id, d.name, d.created_at, d.system_prompt, d.model_config, d.max_chunks, d.cosine_threshold, d.kb_ids
+        FROM dialogs d
+        WHERE d.id = $1
+    ''', dialog_id)
+    if not row:
+        return None
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'system_prompt': row['system_prompt'],
+        'model_config': row['model_config'],
+        'max_chunks': row['max_chunks'],
+        'cosine_threshold': row['cosine_threshold'],
+        'kb_ids': list(row['kb_ids']) if row['kb_ids'] is not None else None
+    }
+
+
+async def aadd_message(dialog_id, sender, message):
+    pool = await get_async_pool()
+    row = await pool.fetchrow('''
+        INSERT INTO messages (dialog_id, sender, message)
+        VALUES ($1, $2, $3)
+        RETURNING id, timestamp;
+    ''', dialog_id, sender, message)
+    return {'id': row['id'], 'timestamp': row['timestamp']}
@@ -1,6 +1,10 @@
 # Table Scripts
 from app.config import Config
-import psycopg2
+from db.pool import ConnectionPool
+from psycopg2.extras import execute_values
+from contextlib import contextmanager
+import json
+import threading
 from flask import jsonify
 
 """
@@ -36,6 +40,9 @@ CREATE TABLE messages (
 );
 """
 
+# Giá trị mặc định cho tham số có thể được set thành NULL
+UNSET = object()
+
 # Removed validate_account function as it uses Flask request
     
 ### Registration: 
@@ -72,55 +79,55 @@ def get_chat_history(cur, dialog_id, limit=50):
 # Removed create_conversations_table function as conversations table is not used
 
 def create_dialogs_table():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS dialogs (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(255),
-            system_prompt TEXT DEFAULT 'You are a knowledgeable and helpful chatbot specializing in Traditional Eastern Medicine.',
-            model_config JSONB DEFAULT '{"model": "gemini-2.0-flash", "temperature": 0.7, "max_tokens": 1000}',
-            max_chunks INTEGER DEFAULT 8,
-            cosine_threshold FLOAT DEFAULT 0.5,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    ''')
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS dialogs (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(255),
+                system_prompt TEXT DEFAULT 'You are a knowledgeable and helpful chatbot specializing in Traditional Eastern Medicine.',
+                model_config JSONB DEFAULT '{"model": "gemini-2.0-flash", "temperature": 0.7, "max_tokens": 1000}',
+                max_chunks INTEGER DEFAULT 8,
+                cosine_threshold FLOAT DEFAULT 0.5,
+                kb_ids INTEGER[],
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        # Database tạo trước migrate_schema_v3 chưa có kb_ids (NULL = tất cả KB của user)
+        cur.execute("ALTER TABLE dialogs ADD COLUMN IF NOT EXISTS kb_ids INTEGER[]")
+        conn.commit()
+        cur.close()
 
 def create_messages_table():
-    conn = get_connection()
-    cur = conn.cursor()
+    with connection() as conn:
+        cur = conn.cursor()
     
-    # Chỉ tạo table nếu chưa tồn tại, không drop table cũ
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id SERIAL PRIMARY KEY,
-            dialog_id INT REFERENCES dialogs(id) ON DELETE CASCADE,
-            sender VARCHAR(50),
-            message TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    ''')
-    conn.commit()
-    cur.close()
-    conn.close()
+        # Chỉ tạo table nếu chưa tồn tại, không drop table cũ
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id SERIAL PRIMARY KEY,
+                dialog_id INT REFERENCES dialogs(id) ON DELETE CASCADE,
+                sender VARCHAR(50),
+                message TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        conn.commit()
+        cur.close()
 
 # Removed create_conversation function as conversations table is not used
 
 def create_dialog(name=None, system_prompt=None, model_config=None, max_chunks=8, cosine_threshold=0.5):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO dialogs (name, system_prompt, model_config, max_chunks, cosine_threshold)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING id, name, created_at, system_prompt, model_config, max_chunks, cosine_threshold;
-    ''', (name, system_prompt, model_config, max_chunks, cosine_threshold))
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO dialogs (name, system_prompt, model_config, max_chunks, cosine_threshold)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, name, created_at, system_prompt, model_config, max_chunks, cosine_threshold;
+        ''', (name, system_prompt, model_config, max_chunks, cosine_threshold))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
     return {
         'id': row[0], 
         'name': row[1],
@@ -132,195 +139,540 @@ def create_dialog(name=None, system_prompt=None, model_config=None, max_chunks=8
     }
 
 def add_message(dialog_id, sender, message):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO messages (dialog_id, sender, message)
-        VALUES (%s, %s, %s)
-        RETURNING id, timestamp;
-    ''', (dialog_id, sender, message))
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO messages (dialog_id, sender, message)
+            VALUES (%s, %s, %s)
+            RETURNING id, timestamp;
+        ''', (dialog_id, sender, message))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
     return {'id': row[0], 'timestamp': row[1]}
 
 # Removed get_conversations_by_user function as conversations table is not used
 
 def get_dialogs_by_user(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT d.id, d.name, d.created_at,
-               COUNT(m.id) as message_count,
-               MAX(m.timestamp) as last_message_at
-        FROM dialogs d
-        LEFT JOIN messages m ON d.id = m.dialog_id
-        GROUP BY d.id, d.name, d.created_at
-        ORDER BY d.created_at DESC
-    ''')
-    rows = cur.fetchall()
-    dialogs = [
-        {
-            'id': row[0],
-            'name': row[1],
-            'created_at': row[2].isoformat() if row[2] else None,
-            'message_count': row[3],
-            'last_message_at': row[4].isoformat() if row[4] else None
-        }
-        for row in rows
-    ]
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT d.id, d.name, d.created_at,
+                   COUNT(m.id) as message_count,
+                   MAX(m.timestamp) as last_message_at
+            FROM dialogs d
+            LEFT JOIN messages m ON d.id = m.dialog_id
+            GROUP BY d.id, d.name, d.created_at
+            ORDER BY d.created_at DESC
+        ''')
+        rows = cur.fetchall()
+        dialogs = [
+            {
+                'id': row[0],
+                'name': row[1],
+                'created_at': row[2].isoformat() if row[2] else None,
+                'message_count': row[3],
+                'last_message_at': row[4].isoformat() if row[4] else None
+            }
+            for row in rows
+        ]
+        cur.close()
     return dialogs
 
 # Removed get_conversation_by_id function as conversations table is not used
 
 def get_dialog_by_id(dialog_id, user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT d.id, d.name, d.created_at, d.system_prompt, d.model_config, d.max_chunks, d.cosine_threshold
-        FROM dialogs d
-        WHERE d.id = %s
-    ''', (dialog_id,))
-    row = cur.fetchone()
-    if row:
-        dialog = {
-            'id': row[0],
-            'name': row[1],
-            'created_at': row[2].isoformat() if row[2] else None,
-            'system_prompt': row[3],
-            'model_config': row[4],
-            'max_chunks': row[5],
-            'cosine_threshold': row[6]
-        }
-    else:
-        dialog = None
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT d.id, d.name, d.created_at, d.system_prompt, d.model_config, d.max_chunks, d.cosine_threshold, d.kb_ids
+            FROM dialogs d
+            WHERE d.id = %s
+        ''', (dialog_id,))
+        row = cur.fetchone()
+        if row:
+            dialog = {
+                'id': row[0],
+                'name': row[1],
+                'created_at': row[2].isoformat() if row[2] else None,
+                'system_prompt': row[3],
+                'model_config': row[4],
+                'max_chunks': row[5],
+                'cosine_threshold': row[6],
+                'kb_ids': row[7]
+            }
+        else:
+            dialog = None
+        cur.close()
     return dialog
 
-def update_dialog_config(dialog_id, user_id, system_prompt=None, model_config=None, max_chunks=None, cosine_threshold=None):
-    conn = get_connection()
-    cur = conn.cursor()
+def update_dialog_config(dialog_id, user_id, system_prompt=None, model_config=None, max_chunks=None, cosine_threshold=None, kb_ids=UNSET):
+    with connection() as conn:
+        cur = conn.cursor()
     
-    # Build dynamic query based on what's provided
-    updates = []
-    params = []
+        # Build dynamic query based on what's provided
+        updates = []
+        params = []
     
-    if system_prompt is not None:
-        updates.append("system_prompt = %s")
-        params.append(system_prompt)
+        if system_prompt is not None:
+            updates.append("system_prompt = %s")
+            params.append(system_prompt)
     
-    if model_config is not None:
-        updates.append("model_config = %s")
-        params.append(model_config)
+        if model_config is not None:
+            updates.append("model_config = %s")
+            params.append(model_config)
     
-    if max_chunks is not None:
-        updates.append("max_chunks = %s")
-        params.append(max_chunks)
+        if max_chunks is not None:
+            updates.append("max_chunks = %s")
+            params.append(max_chunks)
     
-    if cosine_threshold is not None:
-        updates.append("cosine_threshold = %s")
-        params.append(cosine_threshold)
+        if cosine_threshold is not None:
+            updates.append("cosine_threshold = %s")
+            params.append(cosine_threshold)
     
-    if not updates:
-        return False
+        # kb_ids = None nghĩa là dùng tất cả KB của user
+        if kb_ids is not UNSET:
+            updates.append("kb_ids = %s")
+            params.append(kb_ids)
     
-    params.append(dialog_id)
+        if not updates:
+            return False
     
-    query = f'''
-        UPDATE dialogs 
-        SET {', '.join(updates)}
-        WHERE id = %s
-    '''
+        params.append(dialog_id)
     
-    cur.execute(query, params)
-    updated = cur.rowcount > 0
-    conn.commit()
-    cur.close()
-    conn.close()
+        query = f'''
+            UPDATE dialogs 
+            SET {', '.join(updates)}
+            WHERE id = %s
+        '''
+    
+        cur.execute(query, params)
+        updated = cur.rowcount > 0
+        conn.commit()
+        cur.close()
     return updated
 
 # Removed delete_conversation function as conversations table is not used
 
 def delete_dialog(dialog_id, user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        DELETE FROM dialogs 
-        WHERE id = %s
-    ''', (dialog_id,))
-    deleted = cur.rowcount > 0
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            DELETE FROM dialogs 
+            WHERE id = %s
+        ''', (dialog_id,))
+        deleted = cur.rowcount > 0
+        conn.commit()
+        cur.close()
     return deleted
 
 def create_knowledge_base_table():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS knowledge_base_files (
-            id SERIAL PRIMARY KEY,
-            filename VARCHAR(255) NOT NULL,
-            minio_path VARCHAR(255) NOT NULL,
-            user_id INT REFERENCES users(id) ON DELETE CASCADE,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            num_chunks INT NOT NULL,
-            file_size INT,
-            description TEXT
-        );
-    ''')
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def insert_knowledge_base_file(filename, minio_path, num_chunks, file_size, description=None, user_id=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO knowledge_base_files (filename, minio_path, num_chunks, file_size, description, user_id)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        RETURNING id, uploaded_at;
-    ''', (filename, minio_path, num_chunks, file_size, description, user_id))
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_base_files (
+                id SERIAL PRIMARY KEY,
+                filename VARCHAR(255) NOT NULL,
+                minio_path VARCHAR(255) NOT NULL,
+                user_id INT REFERENCES users(id) ON DELETE CASCADE,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                num_chunks INT NOT NULL,
+                file_size BIGINT,
+                description TEXT,
+                content_hash VARCHAR(64)
+            );
+        ''')
+        # Database tạo trước migrate_schema_v4 chưa có content_hash, file_size còn là INT
+        cur.execute("ALTER TABLE knowledge_base_files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+        cur.execute('''
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'knowledge_base_files' AND column_name = 'file_size'
+        ''')
+        row = cur.fetchone()
+        if row and row[0] == 'integer':
+            cur.execute("ALTER TABLE knowledge_base_files ALTER COLUMN file_size TYPE BIGINT")
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_knowledge_base_files_user_hash
+            ON knowledge_base_files (user_id, content_hash)
+        ''')
+        conn.commit()
+        cur.close()
+
+def create_knowledge_base_chunk_hashes_table():
+    """Hash nội dung từng chunk của knowledge base, dùng để chỉ embed lại chunks thay đổi khi upload lại file"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_base_chunk_hashes (
+                kb_id INT REFERENCES knowledge_base_files(id) ON DELETE CASCADE,
+                chunk_id INT NOT NULL,
+                content_hash CHAR(32) NOT NULL,
+                PRIMARY KEY (kb_id, chunk_id)
+            );
+        ''')
+        conn.commit()
+        cur.close()
+
+def insert_knowledge_base_file(filename, minio_path, num_chunks, file_size, description=None, user_id=None, content_hash=None):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO knowledge_base_files (filename, minio_path, num_chunks, file_size, description, user_id, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, uploaded_at;
+        ''', (filename, minio_path, num_chunks, file_size, description, user_id, content_hash))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
     return {'id': row[0], 'uploaded_at': row[1]}
 
+def update_knowledge_base_file_content(kb_id, num_chunks, file_size, content_hash, minio_path):
+    """Cập nhật knowledge base sau khi upload lại phiên bản mới của file"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            UPDATE knowledge_base_files
+            SET num_chunks = %s, file_size = %s, content_hash = %s, minio_path = %s, uploaded_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        ''', (num_chunks, file_size, content_hash, minio_path, kb_id))
+        conn.commit()
+        cur.close()
+
+def delete_knowledge_base_file(kb_id):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM knowledge_base_files WHERE id = %s", (kb_id,))
+        conn.commit()
+        cur.close()
+
+def get_all_knowledge_base_ids():
+    """ID của tất cả knowledge bases (dùng cho việc dọn vectors mồ côi trong Qdrant)"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM knowledge_base_files")
+        ids = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return ids
+
+def get_knowledge_base_file(kb_id, user_id):
+    """Lấy một knowledge base file, chỉ trả về nếu thuộc về user"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT id, filename, minio_path, num_chunks, file_size, uploaded_at, content_hash
+            FROM knowledge_base_files
+            WHERE id = %s AND user_id = %s
+        ''', (kb_id, user_id))
+        row = cur.fetchone()
+        cur.close()
+    if not row:
+        return None
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'minio_path': row[2],
+        'num_chunks': row[3],
+        'file_size': row[4],
+        'uploaded_at': row[5].isoformat() if row[5] else None,
+        'content_hash': row[6]
+    }
+
+def find_knowledge_base_file(user_id, content_hash=None, filename=None):
+    """
+    Tìm knowledge base của user có cùng nội dung (content_hash) hoặc cùng tên file,
+    dùng để bỏ qua file upload trùng và nhận biết upload lại phiên bản mới
+    """
+    column, value = ('content_hash', content_hash) if content_hash is not None else ('filename', filename)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT id, filename, minio_path, num_chunks, file_size, uploaded_at, content_hash
+            FROM knowledge_base_files
+            WHERE user_id = %s AND {column} = %s
+            ORDER BY uploaded_at DESC
+            LIMIT 1
+        ''', (user_id, value))
+        row = cur.fetchone()
+        cur.close()
+    if not row:
+        return None
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'minio_path': row[2],
+        'num_chunks': row[3],
+        'file_size': row[4],
+        'uploaded_at': row[5].isoformat() if row[5] else None,
+        'content_hash': row[6]
+    }
+
+def get_knowledge_base_chunk_hashes(kb_id):
+    """{chunk_id: content_hash} của một knowledge base"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT chunk_id, content_hash FROM knowledge_base_chunk_hashes WHERE kb_id = %s", (kb_id,))
+        hashes = dict(cur.fetchall())
+        cur.close()
+    return hashes
+
+def reset_knowledge_base_chunk_hashes(kb_id):
+    """
+    Xóa hash của chunks và của file: vectors không còn khớp với hash đã lưu (ví dụ cập nhật
+    bị dừng giữa chừng), lần ingest sau phải embed lại toàn bộ
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM knowledge_base_chunk_hashes WHERE kb_id = %s", (kb_id,))
+        cur.execute("UPDATE knowledge_base_files SET content_hash = NULL WHERE id = %s", (kb_id,))
+        conn.commit()
+        cur.close()
+
+def save_knowledge_base_chunk_hashes(kb_id, hashes, num_chunks=None):
+    """
+    Ghi (upsert) hash của các chunks mới/thay đổi và xóa hash của chunks có chunk_id >= num_chunks
+    (rows đã bị bỏ khỏi file), trong một transaction
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        if num_chunks is not None:
+            cur.execute(
+                "DELETE FROM knowledge_base_chunk_hashes WHERE kb_id = %s AND chunk_id >= %s",
+                (kb_id, num_chunks)
+            )
+        if hashes:
+            execute_values(cur, '''
+                INSERT INTO knowledge_base_chunk_hashes (kb_id, chunk_id, content_hash)
+                VALUES %s
+                ON CONFLICT (kb_id, chunk_id) DO UPDATE SET content_hash = EXCLUDED.content_hash
+            ''', [(kb_id, chunk_id, content_hash) for chunk_id, content_hash in hashes.items()], page_size=1000)
+        conn.commit()
+        cur.close()
+
 def get_knowledge_base_files_by_user(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT id, filename, minio_path, num_chunks, file_size, uploaded_at
-        FROM knowledge_base_files 
-        WHERE user_id = %s
-        ORDER BY uploaded_at DESC
-    ''', (user_id,))
-    rows = cur.fetchall()
-    files = [
-        {
-            'id': row[0],
-            'filename': row[1],
-            'minio_path': row[2],
-            'num_chunks': row[3],
-            'file_size': row[4],
-            'uploaded_at': row[5].isoformat() if row[5] else None
-        }
-        for row in rows
-    ]
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT id, filename, minio_path, num_chunks, file_size, uploaded_at
+            FROM knowledge_base_files 
+            WHERE user_id = %s
+            ORDER BY uploaded_at DESC
+        ''', (user_id,))
+        rows = cur.fetchall()
+        files = [
+            {
+                'id': row[0],
+                'filename': row[1],
+                'minio_path': row[2],
+                'num_chunks': row[3],
+                'file_size': row[4],
+                'uploaded_at': row[5].isoformat() if row[5] else None
+            }
+            for row in rows
+        ]
+        cur.close()
     return files
 
-def get_connection():
-    return psycopg2.connect(
-        host=Config.POSTGRES_HOST,
-        port=Config.POSTGRES_PORT,
-        dbname=Config.POSTGRES_DB,
-        user=Config.POSTGRES_USER,
-        password=Config.POSTGRES_PASSWORD
-    )
+def create_ingestion_jobs_table():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id SERIAL PRIMARY KEY,
+                user_id INT REFERENCES users(id) ON DELETE CASCADE,
+                kb_id INT REFERENCES knowledge_base_files(id) ON DELETE SET NULL,
+                job_type VARCHAR(32) NOT NULL DEFAULT 'upload',
+                filename VARCHAR(255) NOT NULL,
+                minio_path VARCHAR(255) NOT NULL,
+                file_size BIGINT,
+                status VARCHAR(32) NOT NULL DEFAULT 'queued',
+                stage VARCHAR(64),
+                total_rows INT,
+                rows_processed INT NOT NULL DEFAULT 0,
+                result JSONB,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                worker_id VARCHAR(128),
+                heartbeat_at TIMESTAMP
+            );
+        ''')
+        # Process đang giữ job và lần cuối process đó báo còn sống
+        cur.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(128)")
+        cur.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP")
+        conn.commit()
+        cur.close()
+
+INGESTION_JOB_COLUMNS = [
+    'id', 'user_id', 'kb_id', 'job_type', 'filename', 'minio_path', 'file_size',
+    'status', 'stage', 'total_rows', 'rows_processed', 'result', 'error',
+    'created_at', 'started_at', 'updated_at', 'finished_at', 'worker_id', 'heartbeat_at'
+]
+
+def _ingestion_job_from_row(row):
+    job = dict(zip(INGESTION_JOB_COLUMNS, row))
+    for key in ('created_at', 'started_at', 'updated_at', 'finished_at', 'heartbeat_at'):
+        job[key] = job[key].isoformat() if job[key] else None
+    return job
+
+def create_ingestion_job(user_id, filename, minio_path, file_size=None, job_type='upload', kb_id=None, exclusive=False):
+    """
+    Tạo job mới. exclusive=True: trả về None (không tạo) nếu user đang có job queued/running
+    cho cùng filename; advisory lock theo (user_id, filename) để hai request đồng thời
+    không cùng vượt qua bước kiểm tra
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        if exclusive:
+            cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (user_id, filename))
+            cur.execute('''
+                SELECT 1 FROM ingestion_jobs
+                WHERE user_id = %s AND filename = %s AND status IN ('queued', 'running')
+                LIMIT 1
+            ''', (user_id, filename))
+            if cur.fetchone():
+                conn.rollback()
+                cur.close()
+                return None
+        cur.execute('''
+            INSERT INTO ingestion_jobs (user_id, filename, minio_path, file_size, job_type, kb_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id, created_at;
+        ''', (user_id, filename, minio_path, file_size, job_type, kb_id))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+    return {'id': row[0], 'created_at': row[1]}
+
+def update_ingestion_job(job_id, **fields):
+    """Cập nhật các cột của job; 'started_at'/'finished_at'/'heartbeat_at' = True nghĩa là NOW()"""
+    updates = ["updated_at = CURRENT_TIMESTAMP"]
+    params = []
+    
+    for column, value in fields.items():
+        if column not in INGESTION_JOB_COLUMNS or column in ('id', 'created_at', 'updated_at'):
+            raise ValueError(f"Unknown ingestion job column: {column}")
+        if column in ('started_at', 'finished_at', 'heartbeat_at') and value is True:
+            updates.append(f"{column} = CURRENT_TIMESTAMP")
+        elif column == 'result' and value is not None:
+            updates.append("result = %s")
+            params.append(json.dumps(value, default=str))
+        else:
+            updates.append(f"{column} = %s")
+            params.append(value)
+    
+    params.append(job_id)
+    
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+            UPDATE ingestion_jobs
+            SET {', '.join(updates)}
+            WHERE id = %s
+        ''', params)
+        conn.commit()
+        cur.close()
+
+def touch_ingestion_jobs(job_ids, worker_id):
+    """Heartbeat: đánh dấu các job chưa xong của process worker_id vẫn đang được xử lý"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            UPDATE ingestion_jobs
+            SET heartbeat_at = CURRENT_TIMESTAMP, worker_id = %s
+            WHERE id = ANY(%s) AND status IN ('queued', 'running')
+        ''', (worker_id, list(job_ids)))
+        conn.commit()
+        cur.close()
+
+def fail_stale_ingestion_jobs(error, stale_seconds):
+    """
+    Đánh dấu failed các job còn 'queued'/'running' nhưng không có heartbeat hay cập nhật nào
+    trong stale_seconds (process giữ job đã dừng), trả về list
+    {'id', 'job_type', 'kb_id', 'user_id', 'filename', 'minio_path'} của các job đó.
+    Job của các process khác còn sống vẫn được heartbeat nên không bị ảnh hưởng
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'failed', error = %s, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
+              AND GREATEST(heartbeat_at, updated_at) < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            RETURNING id, job_type, kb_id, user_id, filename, minio_path
+        ''', (error, stale_seconds))
+        jobs = [
+            dict(zip(('id', 'job_type', 'kb_id', 'user_id', 'filename', 'minio_path'), row))
+            for row in cur.fetchall()
+        ]
+        conn.commit()
+        cur.close()
+    return jobs
+
+def get_ingestion_job(job_id, user_id):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT {', '.join(INGESTION_JOB_COLUMNS)}
+            FROM ingestion_jobs
+            WHERE id = %s AND user_id = %s
+        ''', (job_id, user_id))
+        row = cur.fetchone()
+        cur.close()
+    return _ingestion_job_from_row(row) if row else None
+
+def get_ingestion_jobs_by_user(user_id, limit=50):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT {', '.join(INGESTION_JOB_COLUMNS)}
+            FROM ingestion_jobs
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+            LIMIT %s
+        ''', (user_id, int(limit)))
+        rows = cur.fetchall()
+        cur.close()
+    return [_ingestion_job_from_row(row) for row in rows]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Pool kết nối dùng chung cho cả process, khởi tạo ở lần dùng đầu tiên"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    dsn_kwargs={
+                        'host': Config.POSTGRES_HOST,
+                        'port': Config.POSTGRES_PORT,
+                        'dbname': Config.POSTGRES_DB,
+                        'user': Config.POSTGRES_USER,
+                        'password': Config.POSTGRES_PASSWORD
+                    },
+                    min_size=Config.DB_POOL_MIN_SIZE,
+                    max_size=Config.DB_POOL_MAX_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    healthcheck_interval=Config.DB_POOL_HEALTHCHECK_INTERVAL
+                )
+    return _pool
+
+@contextmanager
+def connection():
+    """Mượn một kết nối từ pool, tự trả lại (và rollback nếu lỗi) khi ra khỏi block"""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+def get_pool_stats():
+    return get_pool().get_stats()
@@ -0,0 +1,154 @@
+from collections import deque
+import logging
+import threading
+import time
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Pool kết nối PostgreSQL dùng chung giữa các thread.
+    - Tối đa max_size kết nối, checkout sẽ chờ (tối đa timeout giây) khi pool đầy
+    - Kết nối idle lâu hơn healthcheck_interval được kiểm tra bằng SELECT 1 trước khi dùng
+    - Kết nối hỏng hoặc còn transaction dở khi trả về sẽ bị rollback/đóng
+    """
+
+    def __init__(self, dsn_kwargs, min_size=1, max_size=10, timeout=30.0, healthcheck_interval=30.0):
+        self.dsn_kwargs = dsn_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()  # (conn, last_used)
+        self._opened = 0
+        self._in_use = 0
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'healthcheck_failures': 0
+        }
+
+        for _ in range(min_size):
+            try:
+                self._idle.append((self._connect(), time.monotonic()))
+            except Exception as e:
+                logger.warning(f"Could not pre-open PostgreSQL connection: {str(e)}")
+                break
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.dsn_kwargs)
+        with self._lock:
+            self._opened += 1
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+            self._stats['connections_discarded'] += 1
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._lock:
+                self._stats['healthcheck_failures'] += 1
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['waits'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise PoolTimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        waited = time.monotonic() - started
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._connect()
+                elif self._is_healthy(*item):
+                    conn = item[0]
+                else:
+                    self._discard(item[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['total_wait_seconds'] += waited
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                # Transaction chưa commit thì rollback trước khi cho thread khác dùng
+                conn.rollback()
+            if conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except Exception:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'open_connections': self._opened,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'utilization': round(self._in_use / self.max_size, 3) if self.max_size else None
+            })
+        checkouts = stats['checkouts']
+        stats['avg_wait_seconds'] = round(stats['total_wait_seconds'] / checkouts, 6) if checkouts else 0.0
+        return stats
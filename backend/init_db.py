@@ -36,6 +36,7 @@ def init_database():
             model_config JSONB DEFAULT '{"model": "gemini-2.0-flash", "temperature": 0.7, "max_tokens": 1000}',
             max_chunks INTEGER DEFAULT 8,
             cosine_threshold FLOAT DEFAULT 0.5,
+            kb_ids INTEGER[],
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     ''')
@@ -60,8 +61,48 @@ def init_database():
             user_id INT REFERENCES users(id) ON DELETE CASCADE,
             uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             num_chunks INT NOT NULL,
-            file_size INT,
-            description TEXT
+            file_size BIGINT,
+            description TEXT,
+            content_hash VARCHAR(64)
+        );
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_knowledge_base_files_user_hash
+        ON knowledge_base_files (user_id, content_hash);
+    ''')
+
+    # Tạo bảng knowledge_base_chunk_hashes
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS knowledge_base_chunk_hashes (
+            kb_id INT REFERENCES knowledge_base_files(id) ON DELETE CASCADE,
+            chunk_id INT NOT NULL,
+            content_hash CHAR(32) NOT NULL,
+            PRIMARY KEY (kb_id, chunk_id)
+        );
+    ''')
+    
+    # Tạo bảng ingestion_jobs
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id SERIAL PRIMARY KEY,
+            user_id INT REFERENCES users(id) ON DELETE CASCADE,
+            kb_id INT REFERENCES knowledge_base_files(id) ON DELETE SET NULL,
+            job_type VARCHAR(32) NOT NULL DEFAULT 'upload',
+            filename VARCHAR(255) NOT NULL,
+            minio_path VARCHAR(255) NOT NULL,
+            file_size BIGINT,
+            status VARCHAR(32) NOT NULL DEFAULT 'queued',
+            stage VARCHAR(64),
+            total_rows INT,
+            rows_processed INT NOT NULL DEFAULT 0,
+            result JSONB,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            worker_id VARCHAR(128),
+            heartbeat_at TIMESTAMP
         );
     ''')
     
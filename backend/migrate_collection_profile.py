@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Migration script to switch the existing chunks collection to a storage profile
+(int8 quantization, on-disk vectors/payloads, HNSW parameters) without re-uploading vectors
+
+Usage: python migrate_collection_profile.py [default|balanced|compact]
+       (defaults to QDRANT_COLLECTION_PROFILE)
+"""
+
+import sys
+import time
+from app.config import Config
+from services.qdrant_service import QdrantService
+from services.collection_profiles import get_collection_profile, collection_update_kwargs
+
+def migrate_collection_profile(profile_name):
+    """Apply the profile with update_collection and wait until the optimizer has rebuilt the segments"""
+    
+    profile = get_collection_profile(profile_name)
+    qdrant_service = QdrantService(Config)
+    client = qdrant_service.client
+    collection = qdrant_service.collection_name
+    
+    print(f"Applying profile '{profile_name}' to {collection}...")
+    client.update_collection(collection_name=collection, **collection_update_kwargs(profile))
+    
+    # Qdrant build lại HNSW/quantization ở background, collection vẫn phục vụ search trong lúc đó
+    while True:
+        info = client.get_collection(collection)
+        print(f"  status={info.status} optimizer={info.optimizer_status} "
+              f"points={info.points_count} indexed={info.indexed_vectors_count}")
+        if str(info.status).lower().endswith('green'):
+            break
+        time.sleep(5)
+    
+    print(f"✅ Collection {collection} now uses profile '{profile_name}'")
+    print("   Set QDRANT_COLLECTION_PROFILE to the same value so search uses matching parameters")
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else Config.QDRANT_COLLECTION_PROFILE
+    print("🔄 Starting Qdrant collection profile migration...")
+    migrate_collection_profile(name)
+    print("✅ Migration finished!")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Migration script to build the lexical (sparse) index for existing chunks
+
+Qdrant cannot add a new sparse vector to an existing collection, so this copies
+every point of QDRANT_COLLECTION_NAME into a new collection created with the
+'lexical' sparse vector, computing the sparse vector from the stored chunk text.
+The source collection is left untouched; point QDRANT_COLLECTION_NAME at the new
+collection and restart the backend when the copy has finished.
+
+Usage: python migrate_lexical_index.py [target_collection]
+"""
+
+import sys
+from qdrant_client.models import PointStruct, SparseVector, SparseVectorParams, Modifier
+from app.config import Config
+from services.qdrant_service import QdrantService, ensure_payload_indexes
+from services.collection_profiles import collection_create_kwargs
+from services.lexical import LEXICAL_VECTOR_NAME, sparse_vector
+
+BATCH_SIZE = 256
+
+def migrate_lexical_index(target, batch_size=BATCH_SIZE):
+    """Copy points in batches into `target`, adding the lexical sparse vector"""
+    
+    qdrant_service = QdrantService(Config)
+    client = qdrant_service.client
+    source = qdrant_service.collection_name
+    
+    if not client.collection_exists(target):
+        client.create_collection(
+            collection_name=target,
+            sparse_vectors_config={LEXICAL_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
+            **collection_create_kwargs(qdrant_service.profile, qdrant_service.vector_size)
+        )
+        print(f"Created collection {target}")
+    
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        if points:
+            batch = []
+            for point in points:
+                dense = point.vector[''] if isinstance(point.vector, dict) else point.vector
+                indices, values = sparse_vector(point.payload['text'])
+                batch.append(PointStruct(
+                    id=point.id,
+                    vector={'': dense, LEXICAL_VECTOR_NAME: SparseVector(indices=indices, values=values)},
+                    payload=point.payload
+                ))
+            client.upsert(collection_name=target, points=batch, wait=True)
+            copied += len(batch)
+            print(f"  copied {copied} points")
+        if offset is None:
+            break
+    
+    # Tạo payload index user_id/kb_id trên collection mới
+    ensure_payload_indexes(client, target, client.get_collection(target))
+    
+    print(f"✅ Copied {copied} points from {source} to {target}")
+    print(f"   Set QDRANT_COLLECTION_NAME={target} and restart the backend to enable hybrid search")
+
+if __name__ == "__main__":
+    target_name = sys.argv[1] if len(sys.argv) > 1 else f"{Config.QDRANT_COLLECTION_NAME}_hybrid"
+    print("🔄 Starting lexical index migration...")
+    migrate_lexical_index(target_name)
+    print("✅ Migration finished!")
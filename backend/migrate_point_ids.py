@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Migration script to rewrite Qdrant point IDs from kb_id * 10000 + chunk_id to the 64-bit (kb_id, chunk_id) packing
+"""
+
+from qdrant_client.models import PointStruct, PointIdsList, Filter, FieldCondition, MatchValue
+from app.config import Config
+from db.database import connection
+from services.qdrant_service import QdrantService, make_point_id
+
+BATCH_SIZE = 256
+
+def migrate_point_ids(batch_size=BATCH_SIZE):
+    """Scroll the collection in batches, re-upsert each legacy point under its new ID and delete the old one"""
+    
+    qdrant_service = QdrantService(Config)
+    client = qdrant_service.client
+    collection = qdrant_service.collection_name
+    
+    scanned = migrated = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        scanned += len(points)
+        
+        legacy = [
+            point for point in points
+            if point.id != make_point_id(point.payload['kb_id'], point.payload['chunk_id'])
+        ]
+        if legacy:
+            # Ghi point mới trước rồi mới xóa point cũ, chạy lại script vẫn an toàn
+            client.upsert(
+                collection_name=collection,
+                points=[
+                    PointStruct(
+                        id=make_point_id(point.payload['kb_id'], point.payload['chunk_id']),
+                        vector=point.vector,
+                        payload=point.payload
+                    )
+                    for point in legacy
+                ],
+                wait=True
+            )
+            client.delete(
+                collection_name=collection,
+                points_selector=PointIdsList(points=[point.id for point in legacy]),
+                wait=True
+            )
+            migrated += len(legacy)
+        
+        print(f"  scanned {scanned} points, migrated {migrated}")
+        if offset is None:
+            break
+    
+    print(f"✅ Migrated {migrated} of {scanned} points")
+    return qdrant_service
+
+def report_incomplete_kbs(qdrant_service):
+    """KB có hơn 10000 rows đã bị ghi đè bởi KB kế tiếp dưới scheme cũ, cần reindex/upload lại"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, filename, num_chunks FROM knowledge_base_files ORDER BY id")
+        rows = cur.fetchall()
+        cur.close()
+    
+    for kb_id, filename, num_chunks in rows:
+        count = qdrant_service.client.count(
+            collection_name=qdrant_service.collection_name,
+            count_filter=Filter(must=[FieldCondition(key='kb_id', match=MatchValue(value=kb_id))]),
+            exact=True
+        ).count
+        if num_chunks and count != num_chunks:
+            print(f"⚠️  KB {kb_id} ({filename}): {count} vectors for {num_chunks} chunks, run POST /api/kb/{kb_id}/reindex")
+
+if __name__ == "__main__":
+    print("🔄 Starting Qdrant point ID migration...")
+    service = migrate_point_ids()
+    report_incomplete_kbs(service)
+    print("✅ Migration finished!")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Migration script to add kb_ids column to dialogs table
+"""
+
+import psycopg2
+from app.config import Config
+
+def migrate_dialogs_kb_ids():
+    """Add kb_ids column (subset of knowledge bases used for retrieval) to dialogs table"""
+    
+    conn = psycopg2.connect(
+        host=Config.POSTGRES_HOST,
+        database=Config.POSTGRES_DB,
+        user=Config.POSTGRES_USER,
+        password=Config.POSTGRES_PASSWORD,
+        port=Config.POSTGRES_PORT
+    )
+    
+    cur = conn.cursor()
+    
+    try:
+        # Check if column already exists
+        cur.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'dialogs' 
+            AND column_name = 'kb_ids'
+        """)
+        
+        if not cur.fetchone():
+            print("Adding kb_ids column...")
+            cur.execute("""
+                ALTER TABLE dialogs 
+                ADD COLUMN kb_ids INTEGER[]
+            """)
+            print("✅ Added kb_ids column (NULL = all knowledge bases of the user)")
+        
+        conn.commit()
+        print("🎉 Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    print("🔄 Starting dialogs kb_ids migration...")
+    migrate_dialogs_kb_ids()
+    print("✅ Migration finished!")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Migration script to add content hashes for knowledge base deduplication and incremental re-upload
+"""
+
+import psycopg2
+from app.config import Config
+
+def migrate_knowledge_base_hashes():
+    """Add content_hash column, widen file_size and create knowledge_base_chunk_hashes table"""
+    
+    conn = psycopg2.connect(
+        host=Config.POSTGRES_HOST,
+        database=Config.POSTGRES_DB,
+        user=Config.POSTGRES_USER,
+        password=Config.POSTGRES_PASSWORD,
+        port=Config.POSTGRES_PORT
+    )
+    
+    cur = conn.cursor()
+    
+    try:
+        # Check if column already exists
+        cur.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'knowledge_base_files' 
+            AND column_name = 'content_hash'
+        """)
+        
+        if not cur.fetchone():
+            print("Adding content_hash column...")
+            cur.execute("""
+                ALTER TABLE knowledge_base_files 
+                ADD COLUMN content_hash VARCHAR(64)
+            """)
+            print("✅ Added content_hash column (NULL for files uploaded before this migration)")
+        
+        # File upload lớn hơn 2GB không vừa INT
+        cur.execute("""
+            ALTER TABLE knowledge_base_files 
+            ALTER COLUMN file_size TYPE BIGINT
+        """)
+        print("✅ file_size is BIGINT")
+        
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_knowledge_base_files_user_hash
+            ON knowledge_base_files (user_id, content_hash)
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS knowledge_base_chunk_hashes (
+                kb_id INT REFERENCES knowledge_base_files(id) ON DELETE CASCADE,
+                chunk_id INT NOT NULL,
+                content_hash CHAR(32) NOT NULL,
+                PRIMARY KEY (kb_id, chunk_id)
+            )
+        """)
+        print("✅ Created knowledge_base_chunk_hashes table")
+        
+        conn.commit()
+        print("🎉 Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    print("🔄 Starting knowledge base content hash migration...")
+    migrate_knowledge_base_hashes()
+    print("✅ Migration finished!")
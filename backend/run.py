@@ -1,7 +1,9 @@
-from app.main import app
+from app.config import Config
 import multiprocessing
+import uvicorn
 
 if __name__ == "__main__":
     # Fix multiprocessing issues on macOS
     multiprocessing.set_start_method('spawn', force=True)
-    app.run(host="0.0.0.0", port=5050, debug=True, use_reloader=False) 
\ No newline at end of file
+    # ASGI app: async chat endpoint + Flask app cho các route còn lại
+    uvicorn.run("app.asgi:application", host="0.0.0.0", port=5050, workers=Config.SERVER_WORKERS)
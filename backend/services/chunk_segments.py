@@ -0,0 +1,176 @@
+import gzip
+import json
+import logging
+from .chunking import split_chunk_fields, join_chunk_fields
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # zstd là tùy chọn, không có thì dùng gzip
+    zstandard = None
+
+SEGMENT_FORMAT = 'daomed-columnar'
+SEGMENT_FORMAT_VERSION = 1
+
+# Số chunks trong một segment: đơn vị nén và đơn vị đọc random access
+DEFAULT_SEGMENT_SIZE = 1024
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def _compress(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Chunk segments are zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    return data
+
+
+class ColumnarChunkWriter:
+    """
+    Ghi chunks theo định dạng cột nén: chunks được gom thành các segment
+    (tối đa segment_size chunks, cùng bộ headers), mỗi segment lưu ids, row_index
+    và giá trị theo từng cột (headers chỉ lưu một lần trong manifest), rồi nén
+    gzip/zstd và ghi nối tiếp vào file. Manifest ghi offset/length của từng segment
+    để đọc streaming hoặc đọc random access một đoạn chunks.
+    """
+
+    def __init__(self, file_obj, filename, segment_size=DEFAULT_SEGMENT_SIZE, codec=None):
+        self.file_obj = file_obj
+        self.filename = filename
+        self.segment_size = segment_size
+        self.codec = codec or default_codec()
+        self.count = 0
+        self.error = None
+        self.raw_bytes = 0
+
+        self._header_sets = []
+        self._header_ids = {}
+        self._segments = []
+        self._buffer = []
+        self._buffer_headers = None
+
+    def _header_id(self, headers):
+        key = tuple(headers)
+        if key not in self._header_ids:
+            self._header_ids[key] = len(self._header_sets)
+            self._header_sets.append(list(key))
+        return self._header_ids[key]
+
+    def write(self, chunk):
+        headers = tuple(chunk.get('headers') or ())
+        if self._buffer and (headers != self._buffer_headers or len(self._buffer) >= self.segment_size):
+            self._flush()
+        self._buffer.append(chunk)
+        self._buffer_headers = headers
+        self.count += 1
+
+    def tee(self, chunks):
+        """Ghi từng chunk đồng thời chuyển tiếp cho bước xử lý tiếp theo (lỗi đọc giữ ở self.error)"""
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+                yield chunk
+        except Exception as e:
+            self.error = e
+            raise
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        headers = list(self._buffer_headers)
+        segment = {
+            'headers': self._header_id(headers),
+            'ids': [chunk['id'] for chunk in self._buffer],
+            'row_index': [chunk.get('row_index') for chunk in self._buffer]
+        }
+
+        rows = []
+        for chunk in self._buffer:
+            values = split_chunk_fields(chunk['text'], headers)
+            if values is None or join_chunk_fields(headers, values) != chunk['text']:
+                rows = None
+                break
+            rows.append(values)
+        if rows is not None:
+            # Lưu theo cột: các giá trị cùng cột nằm cạnh nhau nên nén tốt hơn
+            segment['columns'] = [list(column) for column in zip(*rows)] if rows else []
+        else:
+            # Text không tách được theo headers thì lưu nguyên văn
+            segment['texts'] = [chunk['text'] for chunk in self._buffer]
+
+        raw = json.dumps(segment, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        data = _compress(self.codec, raw)
+        offset = self.file_obj.tell()
+        self.file_obj.write(data)
+        self._segments.append({
+            'start': self.count - len(self._buffer),
+            'count': len(self._buffer),
+            'offset': offset,
+            'length': len(data)
+        })
+        self.raw_bytes += len(raw)
+        self._buffer = []
+
+    def close(self):
+        """Ghi segment cuối, trả về kích thước file (bytes)"""
+        self._flush()
+        self.file_obj.flush()
+        size = self.file_obj.tell()
+        self.file_obj.seek(0)
+        return size
+
+    def manifest(self):
+        """Manifest của file segments (gọi sau close)"""
+        return {
+            'format': SEGMENT_FORMAT,
+            'version': SEGMENT_FORMAT_VERSION,
+            'filename': self.filename,
+            'codec': self.codec,
+            'total_chunks': self.count,
+            'header_sets': self._header_sets,
+            'segments': self._segments
+        }
+
+
+def decode_segment(manifest, data):
+    """Giải nén một segment, trả về list chunk dicts (cùng dạng với iter_chunks)"""
+    segment = json.loads(_decompress(manifest['codec'], data).decode('utf-8'))
+    headers = manifest['header_sets'][segment['headers']]
+    if 'texts' in segment:
+        texts = segment['texts']
+    else:
+        texts = [join_chunk_fields(headers, values) for values in zip(*segment['columns'])] if segment['columns'] else []
+    return [
+        {'id': chunk_id, 'text': text, 'row_index': row_index, 'headers': headers}
+        for chunk_id, text, row_index in zip(segment['ids'], texts, segment['row_index'])
+    ]
+
+
+def iter_segment_chunks(manifest, file_obj):
+    """Đọc streaming toàn bộ chunks từ file segments, mỗi lần giữ một segment trong bộ nhớ"""
+    for info in manifest['segments']:
+        file_obj.seek(info['offset'])
+        for chunk in decode_segment(manifest, file_obj.read(info['length'])):
+            yield chunk
+
+
+def segments_for_range(manifest, start, end):
+    """Các segment chứa chunks ở vị trí [start, end)"""
+    return [
+        info for info in manifest['segments']
+        if info['start'] < end and info['start'] + info['count'] > start
+    ]
@@ -0,0 +1,239 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+from .minio_service import MinioService
+from .chunk_segments import decode_segment, segments_for_range, iter_segment_chunks
+from .chunking import iter_chunks_from_file
+
+logger = logging.getLogger(__name__)
+
+
+def chunks_object_name(filename):
+    """Tên object chứa chunks của file upload"""
+    return f"{os.path.splitext(filename)[0]}_chunks.json"
+
+
+def chunk_index_object_name(filename):
+    """Tên object chứa byte offsets của file chunks"""
+    return f"{os.path.splitext(filename)[0]}_chunks.idx.json"
+
+
+def chunk_segments_object_name(filename):
+    """Tên object chứa chunks dạng cột nén (các segment nối tiếp)"""
+    return f"{os.path.splitext(filename)[0]}_chunks.seg"
+
+
+def chunk_manifest_object_name(filename):
+    """Tên object chứa manifest của file segments"""
+    return f"{os.path.splitext(filename)[0]}_chunks.manifest.json"
+
+
+def stored_chunk_object_names(filename):
+    """Tất cả objects chunks có thể có của một file (định dạng mới và cũ)"""
+    return [
+        chunk_segments_object_name(filename),
+        chunk_manifest_object_name(filename),
+        chunks_object_name(filename),
+        chunk_index_object_name(filename)
+    ]
+
+
+def _read_json_object(minio_service, object_name):
+    response = minio_service.get_file(object_name)
+    if response is None:
+        return None
+    try:
+        return json.loads(response.read().decode('utf-8'))
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _iter_segment_file(manifest, path):
+    with open(path, 'rb') as f:
+        yield from iter_segment_chunks(manifest, f)
+
+
+def download_stored_chunks(minio_service, filename, work_dir):
+    """
+    Tải chunks đã lưu của file về work_dir, trả về iterator đọc streaming từng chunk.
+    Ưu tiên định dạng segments, sau đó tới _chunks.json; raise nếu không có cả hai
+    """
+    manifest = _read_json_object(minio_service, chunk_manifest_object_name(filename))
+    if manifest is not None:
+        path = os.path.join(work_dir, 'chunks.seg')
+        success, msg = minio_service.download_file(chunk_segments_object_name(filename), path)
+        if not success:
+            raise RuntimeError(f"Failed to download {chunk_segments_object_name(filename)} from MinIO: {msg}")
+        return _iter_segment_file(manifest, path)
+
+    path = os.path.join(work_dir, 'chunks.json')
+    success, msg = minio_service.download_file(chunks_object_name(filename), path)
+    if not success:
+        raise RuntimeError(f"Failed to download {chunks_object_name(filename)} from MinIO: {msg}")
+    return iter_chunks_from_file(path)
+
+
+class ChunkPageStore:
+    """
+    Đọc một trang chunks từ MinIO bằng range request thay vì tải và parse toàn bộ
+    file chunks: định dạng segments dùng offset trong manifest, _chunks.json dùng
+    index byte offsets. Manifest/index và các trang vừa xem được giữ trong LRU cache
+    của process. File chunks cũ chưa có index thì đọc cả file.
+    """
+
+    def __init__(self, minio_service, max_pages=256):
+        self.minio_service = minio_service
+        self.max_pages = max_pages
+
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()  # (kb_id, filename, page, page_size) -> (chunks, total)
+        self._indexes = OrderedDict()  # (kb_id, filename) -> ('segments' | 'json', manifest/index)
+        self._stats = {'page_hits': 0, 'page_misses': 0, 'range_reads': 0, 'bytes_read': 0, 'legacy_reads': 0}
+
+    def _cache_get(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_pages:
+                cache.popitem(last=False)
+
+    def _load_index(self, kb_id, filename):
+        key = (kb_id, filename)
+        index = self._cache_get(self._indexes, key)
+        if index is None:
+            manifest = _read_json_object(self.minio_service, chunk_manifest_object_name(filename))
+            if manifest is not None:
+                index = ('segments', manifest)
+            else:
+                offsets = _read_json_object(self.minio_service, chunk_index_object_name(filename))
+                if offsets is None:
+                    # Không cache kết quả "chưa có": KB đang xử lý sẽ có manifest khi job xong
+                    return None
+                index = ('json', offsets)
+            self._cache_put(self._indexes, key, index)
+        return index
+
+    def get_page(self, kb_id, filename, page, page_size):
+        """Trả về (chunks của trang, tổng số chunks); None nếu không có file chunks"""
+        key = (kb_id, filename, page, page_size)
+        cached = self._cache_get(self._pages, key)
+        if cached is not None:
+            with self._lock:
+                self._stats['page_hits'] += 1
+            return cached
+        with self._lock:
+            self._stats['page_misses'] += 1
+
+        index = self._load_index(kb_id, filename)
+        if index is None:
+            result = self._read_legacy_page(filename, page, page_size)
+        elif index[0] == 'segments':
+            result = self._read_segment_page(filename, index[1], page, page_size)
+        else:
+            result = self._read_indexed_page(filename, index[1], page, page_size)
+        if result is not None:
+            self._cache_put(self._pages, key, result)
+        return result
+
+    def _read_segment_page(self, filename, manifest, page, page_size):
+        total = manifest['total_chunks']
+        start = (page - 1) * page_size
+        end = min(start + page_size, total)
+        if start >= end:
+            return [], total
+
+        # Các segment liên tiếp nhau trong file nên đọc bằng một range request
+        segments = segments_for_range(manifest, start, end)
+        byte_start = segments[0]['offset']
+        byte_end = segments[-1]['offset'] + segments[-1]['length']
+        data = self.minio_service.get_file_range(chunk_segments_object_name(filename), byte_start, byte_end - byte_start)
+        if data is None:
+            return None
+        with self._lock:
+            self._stats['range_reads'] += 1
+            self._stats['bytes_read'] += len(data)
+
+        chunks = []
+        for info in segments:
+            offset = info['offset'] - byte_start
+            chunks.extend(decode_segment(manifest, data[offset:offset + info['length']]))
+        skip = start - segments[0]['start']
+        return chunks[skip:skip + (end - start)], total
+
+    def _read_indexed_page(self, filename, index, page, page_size):
+        total = index['total_chunks']
+        start = (page - 1) * page_size
+        end = min(start + page_size, total)
+        if start >= end:
+            return [], total
+
+        stride, offsets = index['stride'], index['offsets']
+        first_block = start // stride
+        last_block = (end - 1) // stride + 1
+        byte_start = offsets[first_block]
+        byte_end = offsets[last_block] if last_block < len(offsets) else index['data_end']
+
+        data = self.minio_service.get_file_range(chunks_object_name(filename), byte_start, byte_end - byte_start)
+        if data is None:
+            return None
+        with self._lock:
+            self._stats['range_reads'] += 1
+            self._stats['bytes_read'] += len(data)
+
+        lines = [line.rstrip(b',') for line in data.split(b'\n') if line.strip()]
+        skip = start - first_block * stride
+        chunks = [json.loads(line) for line in lines[skip:skip + (end - start)]]
+        return chunks, total
+
+    def _read_legacy_page(self, filename, page, page_size):
+        """File chunks ghi trước khi có index: tải cả file rồi cắt trang"""
+        chunks_file = self.minio_service.get_file(chunks_object_name(filename))
+        if not chunks_file:
+            return None
+        try:
+            all_chunks = json.loads(chunks_file.read().decode('utf-8')).get('chunks', [])
+        finally:
+            chunks_file.close()
+            chunks_file.release_conn()
+        with self._lock:
+            self._stats['legacy_reads'] += 1
+        start = (page - 1) * page_size
+        return all_chunks[start:start + page_size], len(all_chunks)
+
+    def invalidate(self, kb_id):
+        """Bỏ index và các trang đã cache của KB (khi KB bị xóa hoặc chunks thay đổi)"""
+        with self._lock:
+            for cache in (self._pages, self._indexes):
+                for key in [key for key in cache if key[0] == kb_id]:
+                    del cache[key]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_pages'] = len(self._pages)
+            stats['cached_indexes'] = len(self._indexes)
+        return stats
+
+
+_chunk_page_store = None
+_chunk_page_store_lock = threading.Lock()
+
+
+def get_chunk_page_store(config):
+    """Store dùng chung cho cả process, khởi tạo từ config ở lần gọi đầu tiên"""
+    global _chunk_page_store
+    if _chunk_page_store is None:
+        with _chunk_page_store_lock:
+            if _chunk_page_store is None:
+                _chunk_page_store = ChunkPageStore(MinioService(config), max_pages=config.CHUNK_PAGE_CACHE_SIZE)
+    return _chunk_page_store
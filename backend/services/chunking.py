@@ -0,0 +1,178 @@
+from itertools import islice
+import csv
+import hashlib
+import json
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CHUNK_FIELD_SEPARATOR = " | "
+
+# Các giá trị pandas mặc định coi là NaN (keep_default_na), dùng cho cell text của XLSX
+DEFAULT_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+
+def _unique_headers(raw_headers):
+    """Đặt tên header giống pandas: cột trống -> 'Unnamed: i', trùng tên -> 'name.1'"""
+    headers = []
+    seen = {}
+    for i, header in enumerate(raw_headers):
+        name = f"Unnamed: {i}" if header is None or str(header).strip() == "" else str(header)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+
+def iter_row_batches(file_path, ext, batch_size):
+    """
+    Đọc file CSV/XLSX/XLS theo từng batch rows, yield DataFrame có tối đa batch_size rows.
+    CSV đọc bằng TAB delimiter như upload cũ; XLSX đọc bằng openpyxl read-only
+    để không phải load cả workbook vào bộ nhớ.
+    Không để pandas suy luận dtype theo từng batch (cột số có NaN trong batch sẽ thành
+    float, '5' thành '5.0'): CSV giữ nguyên text, XLSX giữ nguyên giá trị của cell,
+    nên chunk text và hash không phụ thuộc vào cách chia batch.
+    """
+    if ext == '.csv':
+        reader = pd.read_csv(file_path, encoding='utf-8', sep='\t', dtype=str, chunksize=batch_size)
+        for df in reader:
+            yield df
+    elif ext == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            first_row = next(rows, None)
+            if first_row is None:
+                return
+            headers = _unique_headers(first_row)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                # Bỏ các dòng trống hoàn toàn giống pd.read_excel
+                batch = [row for row in batch if any(value is not None for value in row)]
+                if batch:
+                    df = pd.DataFrame(batch, columns=headers, dtype=object)
+                    yield df.mask(df.isin(DEFAULT_NA_VALUES))
+        finally:
+            workbook.close()
+    else:
+        # xlrd không hỗ trợ đọc streaming, file .xls tối đa 65536 rows nên đọc một lần
+        df = pd.read_excel(file_path, engine='xlrd')
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+
+
+def count_rows(file_path, ext):
+    """Đếm nhanh số data rows (không tính header) để tính tiến độ, None nếu không biết"""
+    try:
+        if ext == '.csv':
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                return max(sum(1 for _ in csv.reader(f, delimiter='\t')) - 1, 0)
+        if ext == '.xlsx':
+            from openpyxl import load_workbook
+            workbook = load_workbook(file_path, read_only=True)
+            try:
+                max_row = workbook.active.max_row
+            finally:
+                workbook.close()
+            return max(max_row - 1, 0) if max_row else None
+    except Exception as e:
+        logger.warning(f"Could not count rows in {file_path}: {str(e)}")
+    return None
+
+
+def format_chunk_texts(df):
+    """
+    Tạo chunk text 'header: value | header: value' cho cả DataFrame bằng các phép
+    toán theo cột thay vì duyệt từng cell
+    """
+    headers = [str(header) for header in df.columns]
+    if df.empty:
+        return []
+    parts = None
+    for position, header in enumerate(headers):
+        column = df.iloc[:, position]
+        values = column.astype(object).where(column.notna(), "").astype(str).str.strip()
+        part = f"{header}: " + values
+        parts = part if parts is None else parts + CHUNK_FIELD_SEPARATOR + part
+    return parts.tolist()
+
+
+def split_chunk_fields(text, headers):
+    """Ngược lại của format_chunk_texts: tách text thành list values theo headers, None nếu không đúng định dạng"""
+    if not headers:
+        return None
+    parts = text.split(CHUNK_FIELD_SEPARATOR)
+    if len(parts) != len(headers):
+        return None
+    values = []
+    for header, part in zip(headers, parts):
+        prefix = f"{header}: "
+        if part.startswith(prefix):
+            values.append(part[len(prefix):].strip())
+        elif part == f"{header}:":
+            values.append("")
+        else:
+            return None
+    return values
+
+
+def join_chunk_fields(headers, values):
+    """Tạo lại chunk text từ headers và values (cùng định dạng với format_chunk_texts)"""
+    return CHUNK_FIELD_SEPARATOR.join(f"{header}: {value}" for header, value in zip(headers, values))
+
+
+def chunk_content_hash(chunk):
+    """Hash nội dung của một chunk (text và headers), dùng để nhận biết row thay đổi khi upload lại file"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(chunk['text'].encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(CHUNK_FIELD_SEPARATOR.join(chunk['headers']).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def iter_chunks(row_batches, start_id=0):
+    """
+    Chuyển từng batch rows thành chunks (mỗi row một chunk), yield lần lượt từng chunk.
+    chunk id/row_index là số thứ tự row trong file, bắt đầu từ start_id.
+    """
+    next_id = start_id
+    for df in row_batches:
+        headers = [str(header) for header in df.columns]
+        for text in format_chunk_texts(df):
+            yield {
+                'id': next_id,
+                'text': text,
+                'row_index': next_id,
+                'headers': headers
+            }
+            next_id += 1
+
+
+def iter_chunks_from_file(file_path):
+    """
+    Đọc lại chunks từ file <name>_chunks.json (định dạng trước chunk segments) đã tải về.
+    File ghi tăng dần có mỗi chunk một dòng nên đọc từng dòng;
+    file định dạng cũ (json.dumps indent=2) thì phải parse cả file.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+        if first_line.rstrip().endswith('"chunks": ['):
+            for line in f:
+                line = line.strip().rstrip(',')
+                if line.startswith('{'):
+                    yield json.loads(line)
+            return
+    
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for chunk in json.load(f).get('chunks', []):
+            yield chunk
@@ -0,0 +1,95 @@
+from qdrant_client.models import (
+    Distance, VectorParams, HnswConfigDiff, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, QuantizationSearchParams, SearchParams, Disabled,
+    VectorParamsDiff, CollectionParamsDiff
+)
+
+# Các profile lưu trữ cho collection chunks:
+# - default: float32 trong RAM, HNSW mặc định (giống trước đây)
+# - balanced: int8 quantized trong RAM, vector gốc trên disk dùng để rescore
+# - compact: như balanced nhưng cả payload và HNSW graph cũng nằm trên disk
+COLLECTION_PROFILES = {
+    'default': {
+        'on_disk_vectors': False,
+        'on_disk_payload': False,
+        'quantization': None,
+        'hnsw': {'m': 16, 'ef_construct': 100, 'on_disk': False},
+        'search': {'hnsw_ef': None, 'rescore': False, 'oversampling': None}
+    },
+    'balanced': {
+        'on_disk_vectors': True,
+        'on_disk_payload': False,
+        'quantization': 'int8',
+        'hnsw': {'m': 16, 'ef_construct': 128, 'on_disk': False},
+        'search': {'hnsw_ef': 128, 'rescore': True, 'oversampling': 2.0}
+    },
+    'compact': {
+        'on_disk_vectors': True,
+        'on_disk_payload': True,
+        'quantization': 'int8',
+        'hnsw': {'m': 12, 'ef_construct': 100, 'on_disk': True},
+        'search': {'hnsw_ef': 96, 'rescore': True, 'oversampling': 3.0}
+    }
+}
+
+
+def get_collection_profile(name, search_ef=None):
+    """Lấy profile theo tên; search_ef (nếu có) ghi đè hnsw_ef lúc search"""
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown Qdrant collection profile '{name}', expected one of {sorted(COLLECTION_PROFILES)}")
+    profile = {key: dict(value) if isinstance(value, dict) else value for key, value in COLLECTION_PROFILES[name].items()}
+    profile['name'] = name
+    if search_ef:
+        profile['search']['hnsw_ef'] = search_ef
+    return profile
+
+
+def _quantization_config(profile):
+    if profile['quantization'] != 'int8':
+        return None
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def collection_create_kwargs(profile, vector_size):
+    """Tham số cho client.create_collection"""
+    return {
+        'vectors_config': VectorParams(
+            size=vector_size,
+            distance=Distance.COSINE,
+            on_disk=profile['on_disk_vectors']
+        ),
+        'on_disk_payload': profile['on_disk_payload'],
+        'hnsw_config': HnswConfigDiff(**profile['hnsw']),
+        'quantization_config': _quantization_config(profile)
+    }
+
+
+def collection_update_kwargs(profile):
+    """
+    Tham số cho client.update_collection để chuyển collection đang có sang profile
+    (Qdrant build lại index/quantization ở background, collection vẫn phục vụ search)
+    """
+    quantization = _quantization_config(profile)
+    return {
+        'vectors_config': {'': VectorParamsDiff(on_disk=profile['on_disk_vectors'])},
+        'collection_params': CollectionParamsDiff(on_disk_payload=profile['on_disk_payload']),
+        'hnsw_config': HnswConfigDiff(**profile['hnsw']),
+        # Profile không quantization thì tắt hẳn quantization đang có của collection
+        'quantization_config': quantization if quantization is not None else Disabled.DISABLED
+    }
+
+
+def search_params(profile):
+    """SearchParams theo profile, None nếu dùng mặc định của Qdrant"""
+    search = profile['search']
+    quantization = None
+    if profile['quantization'] is not None:
+        quantization = QuantizationSearchParams(
+            rescore=search['rescore'],
+            oversampling=search['oversampling']
+        )
+    if search['hnsw_ef'] is None and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=search['hnsw_ef'], quantization=quantization)
@@ -0,0 +1,144 @@
+import logging
+import re
+import threading
+from .chunking import CHUNK_FIELD_SEPARATOR, split_chunk_fields
+
+logger = logging.getLogger(__name__)
+
+# Hai chunk có tập từ trùng nhau >= ngưỡng này được coi là trùng lặp
+DEDUP_JACCARD_THRESHOLD = 0.9
+
+_WHITESPACE = re.compile(r'\s+')
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding(encoding_name):
+    """Load tiktoken encoding một lần; None nếu không load được (ví dụ không có mạng để tải BPE)"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(encoding_name)
+                except Exception as e:
+                    logger.warning(f"Could not load tiktoken encoding {encoding_name}, estimating tokens from length: {str(e)}")
+                    _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text, encoding_name='cl100k_base'):
+    """
+    Số tokens của text theo tiktoken. Gemini dùng tokenizer khác nên đây là ước lượng,
+    đủ để giới hạn kích thước prompt
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return max(1, len(text) // 3)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class ContextPacker:
+    """
+    Đóng gói các chunks đã retrieve thành context gửi cho LLM trong giới hạn token_budget:
+    - Bỏ chunks trùng lặp (cùng nội dung hoặc gần như cùng tập từ)
+    - Các chunks cùng bộ cột chỉ ghi tên cột một lần, mỗi chunk chỉ còn các giá trị;
+      cột trống ở mọi chunk trong nhóm thì bỏ
+    - Thêm lần lượt chunks theo thứ tự xếp hạng, bỏ qua chunk không còn vừa budget
+    """
+
+    def __init__(self, token_budget=3000, encoding_name='cl100k_base'):
+        self.token_budget = token_budget
+        self.encoding_name = encoding_name
+
+    def _tokens(self, text):
+        return count_tokens(text, self.encoding_name)
+
+    @staticmethod
+    def _is_duplicate(words, kept_words):
+        for other in kept_words:
+            union = len(words | other)
+            if union and len(words & other) / union >= DEDUP_JACCARD_THRESHOLD:
+                return True
+        return False
+
+    def pack(self, search_results):
+        """Trả về (context, packed_results, stats)"""
+        stats = {
+            'token_budget': self.token_budget,
+            'context_tokens': 0,
+            'chunks_retrieved': len(search_results),
+            'chunks_packed': 0,
+            'duplicates_removed': 0,
+            'chunks_over_budget': 0
+        }
+        if not search_results:
+            return "", [], stats
+
+        # 1. Bỏ trùng lặp, tách giá trị theo cột
+        candidates = []
+        seen_texts = set()
+        kept_words = []
+        for result in search_results:
+            content = result.get('content', '')
+            normalized = _WHITESPACE.sub(' ', content).strip().lower()
+            words = set(_WORD.findall(normalized))
+            if normalized in seen_texts or self._is_duplicate(words, kept_words):
+                stats['duplicates_removed'] += 1
+                continue
+            seen_texts.add(normalized)
+            kept_words.append(words)
+
+            headers = tuple(str(h) for h in result.get('metadata', {}).get('headers') or ())
+            values = split_chunk_fields(content, headers)
+            candidates.append((result, headers if values is not None else None, values))
+
+        # 2. Cột trống ở mọi chunk cùng nhóm headers thì bỏ
+        non_empty = {}
+        for _, headers, values in candidates:
+            if values is not None:
+                mask = non_empty.setdefault(headers, [False] * len(headers))
+                for i, value in enumerate(values):
+                    mask[i] = mask[i] or bool(value)
+
+        # 3. Thêm chunks theo thứ tự xếp hạng trong budget
+        groups = {}  # (source, headers) -> list dòng
+        group_order = []
+        packed = []
+        used = 0
+        for result, headers, values in candidates:
+            number = len(packed) + 1
+            prefix = f"[{number}] ({result.get('score', 0.0):.2f}) "
+            if values is None:
+                key = (result.get('source'), None)
+                line = prefix + _WHITESPACE.sub(' ', result.get('content', '')).strip()
+                header_line = f"Nguồn: {result.get('source')}"
+            else:
+                keep = non_empty[headers]
+                key = (result.get('source'), headers)
+                line = prefix + CHUNK_FIELD_SEPARATOR.join(v for v, k in zip(values, keep) if k)
+                header_line = f"Nguồn: {result.get('source')} | Cột: " + CHUNK_FIELD_SEPARATOR.join(
+                    h for h, k in zip(headers, keep) if k
+                )
+
+            cost = self._tokens(line) + 1
+            if key not in groups:
+                cost += self._tokens(header_line) + 1
+            if used + cost > self.token_budget:
+                stats['chunks_over_budget'] += 1
+                continue
+
+            if key not in groups:
+                groups[key] = [header_line]
+                group_order.append(key)
+            groups[key].append(line)
+            packed.append(result)
+            used += cost
+
+        context = "\n\n".join("\n".join(groups[key]) for key in group_order)
+        stats['context_tokens'] = self._tokens(context) if context else 0
+        stats['chunks_packed'] = len(packed)
+        return context, packed, stats
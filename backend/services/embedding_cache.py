@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Mỗi lần vượt giới hạn thì xóa thêm một phần để không phải evict sau mỗi lần ghi
+EVICTION_HEADROOM = 0.1
+
+# Ước lượng overhead của một row SQLite ngoài vector (key, model, last_used, index)
+ROW_OVERHEAD_BYTES = 96
+
+
+def normalize_text(text):
+    """Chuẩn hóa text trước khi hash: Unicode NFC và gộp khoảng trắng"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def model_fingerprint(model_path):
+    """
+    Định danh phiên bản model: tên thư mục model cùng hash của config.json và kích thước
+    các file weights, nên thay model ở cùng đường dẫn thì cache cũ không còn được dùng
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for name in ('config.json', 'config_sentence_transformers.json', 'modules.json'):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    for name in ('model.safetensors', 'pytorch_model.bin'):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path):
+            digest.update(f"{name}:{os.path.getsize(path)}".encode('utf-8'))
+    return f"{os.path.basename(os.path.normpath(model_path))}@{digest.hexdigest()}"
+
+
+class EmbeddingCache:
+    """
+    Cache embedding của chunk texts lưu trên đĩa (SQLite), key là hash của
+    (model id, text đã chuẩn hóa). Dùng chung giữa các lần ingestion/reindex và giữa
+    các user, nên những đoạn văn trùng nhau giữa nhiều KB chỉ cần encode một lần.
+    Giới hạn theo dung lượng: vượt max_bytes thì xóa các entries lâu không dùng nhất.
+    """
+
+    def __init__(self, path, model_id, dim, max_bytes):
+        self.path = path
+        self.model_id = model_id
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.max_entries = max(1, int(max_bytes // (dim * 4 + ROW_OVERHEAD_BYTES)))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Nhiều worker process có thể dùng chung file, SQLite tự lock giữa các process
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                id INTEGER PRIMARY KEY,
+                key BLOB NOT NULL UNIQUE,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)')
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def key(self, text):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.model_id.encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(normalize_text(text).encode('utf-8'))
+        return digest.digest()
+
+    def get_many(self, keys):
+        """{key: vector} của các keys có trong cache, đồng thời đánh dấu vừa được dùng"""
+        if not keys:
+            return {}
+        found = {}
+        now = int(time.time())
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # SQLite giới hạn số tham số mỗi câu lệnh
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    self._conn.execute(
+                        f'UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})', [now, *batch]
+                    )
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(unique) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Ghi list (key, vector) vào cache, evict nếu vượt giới hạn dung lượng"""
+        if not items:
+            return
+        now = int(time.time())
+        rows = [(key, self.model_id, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)', rows
+                )
+                inserted = self._conn.total_changes - before
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._entries += inserted
+            self._stats['writes'] += inserted
+            if self._entries > self.max_entries:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        # Đếm lại vì các worker process khác cũng ghi vào cùng file
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        excess = self._entries - int(self.max_entries * (1 - EVICTION_HEADROOM))
+        if self._entries <= self.max_entries or excess <= 0:
+            return
+        deleted = self._conn.execute(
+            'DELETE FROM embeddings WHERE id IN (SELECT id FROM embeddings ORDER BY last_used LIMIT ?)', (excess,)
+        ).rowcount
+        self._entries -= deleted
+        self._stats['evictions'] += deleted
+        logger.info(f"Evicted {deleted} entries from embedding cache {self.path}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'path': self.path,
+                'model_id': self.model_id,
+                'entries': self._entries,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            })
+        try:
+            stats['file_bytes'] = os.path.getsize(self.path)
+        except OSError:
+            stats['file_bytes'] = None
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache(config, dim):
+    """Cache dùng chung cho cả process; None nếu tắt hoặc không mở được file cache"""
+    global _embedding_cache
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                try:
+                    _embedding_cache = EmbeddingCache(
+                        path=config.EMBEDDING_CACHE_PATH,
+                        model_id=model_fingerprint(config.MODEL_PATH),
+                        dim=dim,
+                        max_bytes=int(config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not open embedding cache {config.EMBEDDING_CACHE_PATH}: {str(e)}")
+                    _embedding_cache = False
+    return _embedding_cache or None
@@ -0,0 +1,153 @@
+from concurrent.futures import Future
+from bisect import bisect_left
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class LatencyHistogram:
+    """Histogram đơn giản theo các bucket cố định (ms)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect_left(self.buckets, value_ms)] += 1
+        self.total += 1
+        self.sum_ms += value_ms
+
+    def snapshot(self):
+        labels = [f"<={bucket}" for bucket in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'count': self.total,
+            'avg_ms': round(self.sum_ms / self.total, 3) if self.total else 0.0,
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+
+class EmbeddingDispatcher:
+    """
+    Gom các request encode một câu query từ nhiều thread thành một batch.
+    Thread nền lấy request đầu tiên trong hàng đợi, chờ thêm tối đa max_wait_ms
+    (hoặc tới khi đủ max_batch_size) rồi encode cả batch trong một lần forward,
+    trả kết quả về cho từng thread đang chờ qua Future.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._queue_wait = LatencyHistogram()
+        self._latency = LatencyHistogram()
+        self._batch_sizes = {}
+        self._batches = 0
+        self._errors = 0
+
+        self._thread = threading.Thread(target=self._run, name='embedding-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """Đưa text vào hàng đợi, trả về Future chứa numpy float32 vector"""
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, texts):
+        """Encode nhiều texts qua dispatcher (có thể được gộp với request của thread khác)"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            try:
+                vectors = self.model.encode(
+                    [text for text, _, _ in batch],
+                    batch_size=len(batch),
+                    show_progress_bar=False,
+                    convert_to_numpy=True
+                )
+                vectors = np.asarray(vectors, dtype=np.float32)
+            except Exception as e:
+                logger.error(f"Embedding dispatcher batch failed: {str(e)}")
+                with self._stats_lock:
+                    self._errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+                for _, _, enqueued in batch:
+                    self._queue_wait.observe((started - enqueued) * 1000)
+                    self._latency.observe((finished - enqueued) * 1000)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'errors': self._errors,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'queue_wait_ms': self._queue_wait.snapshot(),
+                'latency_ms': self._latency.snapshot()
+            }
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_embedding_dispatcher(config, model_path, model):
+    """Mỗi model một dispatcher dùng chung cho cả process"""
+    dispatcher = _dispatchers.get(model_path)
+    if dispatcher is None:
+        with _dispatchers_lock:
+            dispatcher = _dispatchers.get(model_path)
+            if dispatcher is None:
+                dispatcher = EmbeddingDispatcher(
+                    model,
+                    max_batch_size=config.EMBEDDING_DISPATCH_MAX_BATCH,
+                    max_wait_ms=config.EMBEDDING_DISPATCH_MAX_WAIT_MS
+                )
+                _dispatchers[model_path] = dispatcher
+    return dispatcher
+
+
+def get_dispatcher_stats():
+    with _dispatchers_lock:
+        dispatchers = dict(_dispatchers)
+    return {model_path: dispatcher.get_stats() for model_path, dispatcher in dispatchers.items()}
@@ -0,0 +1,91 @@
+from sentence_transformers import SentenceTransformer, CrossEncoder
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingModelRegistry:
+    """
+    Giữ mỗi embedding model một instance duy nhất trong mỗi worker process.
+    Model được load lazily ở lần dùng đầu tiên (hoặc preload lúc startup) và
+    được chia sẻ giữa các thread; encode() của SentenceTransformer chỉ đọc weights
+    nên không cần lock khi inference.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get_model(self, model_path, model_class=SentenceTransformer):
+        """Lấy model đã load, load nếu chưa có (model_class: SentenceTransformer hoặc CrossEncoder)"""
+        model = self._models.get(model_path)
+        if model is not None:
+            return model
+
+        # Mỗi model một lock riêng để các thread không load trùng
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_path, threading.Lock())
+
+        with load_lock:
+            model = self._models.get(model_path)
+            if model is not None:
+                return model
+
+            logger.info(f"Loading model from: {model_path}")
+            started = time.perf_counter()
+            try:
+                model = model_class(model_path)
+            except Exception as e:
+                logger.error(f"Error loading model from {model_path}: {str(e)}")
+                raise
+            load_seconds = time.perf_counter() - started
+
+            self._stats[model_path] = {
+                'model_path': model_path,
+                'model_type': model_class.__name__,
+                'load_seconds': round(load_seconds, 3),
+                'loaded_at': time.time(),
+                'resident_bytes': self._estimate_resident_bytes(model),
+                'embedding_dim': (
+                    model.get_sentence_embedding_dimension()
+                    if isinstance(model, SentenceTransformer) else None
+                )
+            }
+            self._models[model_path] = model
+            logger.info(f"Successfully loaded model from {model_path} in {load_seconds:.2f}s")
+            return model
+
+    def is_loaded(self, model_path):
+        return model_path in self._models
+
+    def get_stats(self):
+        """Thông tin monitoring: thời gian load và dung lượng weights của từng model"""
+        return list(self._stats.values())
+
+    @staticmethod
+    def _estimate_resident_bytes(model):
+        """Tổng dung lượng parameters + buffers của model (bytes)"""
+        try:
+            # CrossEncoder bọc transformers model trong thuộc tính .model
+            module = model.model if isinstance(model, CrossEncoder) else model
+            total = sum(p.numel() * p.element_size() for p in module.parameters())
+            total += sum(b.numel() * b.element_size() for b in module.buffers())
+            return int(total)
+        except Exception:
+            return None
+
+
+# Registry dùng chung cho toàn bộ process
+embedding_registry = EmbeddingModelRegistry()
+
+
+def get_embedding_model(model_path):
+    return embedding_registry.get_model(model_path)
+
+
+def get_cross_encoder(model_path):
+    return embedding_registry.get_model(model_path, CrossEncoder)
@@ -0,0 +1,192 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import shutil
+import socket
+import tempfile
+import uuid
+from db.database import update_ingestion_job, touch_ingestion_jobs
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Định danh process xử lý job (ghi vào ingestion_jobs.worker_id), khác nhau giữa các lần khởi động
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobProgress:
+    """
+    Ghi nhận tiến độ của một ingestion job vào Postgres.
+    Việc ghi rows_processed được throttle để không spam DB ở mỗi batch.
+    """
+
+    def __init__(self, job_id, flush_interval=1.0):
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.rows_processed = 0
+        self._last_flush = 0.0
+
+    def stage(self, name, **fields):
+        logger.info(f"Ingestion job {self.job_id}: stage={name}")
+        update_ingestion_job(self.job_id, stage=name, **fields)
+
+    def set_total(self, total_rows):
+        update_ingestion_job(self.job_id, total_rows=total_rows)
+
+    def advance(self, rows):
+        self.rows_processed += rows
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        update_ingestion_job(self.job_id, rows_processed=self.rows_processed)
+
+
+def staging_prefix(prefix):
+    """Prefix file tạm gắn với PID của process tạo ra nó, để cleanup không xóa file của process khác"""
+    return f"{prefix}{os.getpid()}-"
+
+
+def _staging_owner_alive(name, prefix):
+    try:
+        pid = int(name[len(prefix):].split('-', 1)[0])
+    except ValueError:
+        # File tạo trước khi prefix có PID
+        return False
+    if pid == os.getpid():
+        # Cùng PID với process vừa khởi động (ví dụ PID 1 trong container): file của lần chạy trước
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def cleanup_staging_dir(staging_dir, prefixes):
+    """
+    Xóa file/thư mục tạm còn sót lại của các ingestion job chưa chạy hoặc chạy dở
+    khi process tạo ra chúng dừng. Gọi lúc startup, trước khi nhận upload mới; file của
+    các worker process khác còn chạy được giữ lại
+    """
+    staging_dir = staging_dir or tempfile.gettempdir()
+    removed = 0
+    try:
+        names = os.listdir(staging_dir)
+    except OSError as e:
+        logger.warning(f"Could not list upload staging dir {staging_dir}: {str(e)}")
+        return 0
+    for name in names:
+        prefix = next((prefix for prefix in prefixes if name.startswith(prefix)), None)
+        if prefix is None or _staging_owner_alive(name, prefix):
+            continue
+        path = os.path.join(staging_dir, name)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove stale staging file {path}: {str(e)}")
+    if removed:
+        logger.info(f"Removed {removed} stale staging files from {staging_dir}")
+    return removed
+
+
+class IngestionQueue:
+    """
+    Worker pool cục bộ xử lý ingestion jobs ở background.
+    Số worker bị giới hạn (INGESTION_WORKERS) để các job nặng không chiếm hết
+    CPU/threads của chat requests. Hàng đợi nằm trong bộ nhớ của process, nên các job
+    (cả đang chờ lẫn đang chạy) được heartbeat định kỳ để process khác biết job còn người xử lý.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingestion')
+        self._lock = threading.Lock()
+        self._active = set()
+        self._owned = set()
+        self._heartbeat_thread = None
+
+    def submit(self, job_id, handler, *args, **kwargs):
+        """Đưa job vào hàng đợi; handler(progress, *args, **kwargs) trả về result dict"""
+        update_ingestion_job(job_id, worker_id=WORKER_ID, heartbeat_at=True)
+        with self._lock:
+            self._owned.add(job_id)
+        return self._executor.submit(self._run, job_id, handler, *args, **kwargs)
+
+    def start_heartbeat(self, interval, on_heartbeat=None):
+        """
+        Chạy thread heartbeat cho các job của process này; on_heartbeat (ví dụ dọn job
+        của process đã dừng) được gọi sau mỗi lần heartbeat
+        """
+        if self._heartbeat_thread is not None or interval <= 0:
+            return
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, args=(interval, on_heartbeat), name='ingestion-heartbeat', daemon=True
+        )
+        self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self, interval, on_heartbeat):
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                job_ids = list(self._owned)
+            try:
+                if job_ids:
+                    touch_ingestion_jobs(job_ids, WORKER_ID)
+                if on_heartbeat is not None:
+                    on_heartbeat()
+            except Exception as e:
+                logger.warning(f"Ingestion heartbeat failed: {str(e)}")
+
+    def _run(self, job_id, handler, *args, **kwargs):
+        with self._lock:
+            self._active.add(job_id)
+        progress = JobProgress(job_id)
+        try:
+            update_ingestion_job(job_id, status='running', started_at=True)
+            result = handler(progress, *args, **kwargs)
+            progress.flush()
+            update_ingestion_job(job_id, status='completed', stage='done', result=result, finished_at=True)
+            logger.info(f"Ingestion job {job_id} completed")
+            return result
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            try:
+                update_ingestion_job(job_id, status='failed', error=str(e), finished_at=True)
+            except Exception as db_error:
+                logger.error(f"Could not mark ingestion job {job_id} as failed: {str(db_error)}")
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+                self._owned.discard(job_id)
+
+    def get_stats(self):
+        with self._lock:
+            active = len(self._active)
+        return {'max_workers': self.max_workers, 'active_jobs': active, 'worker_id': WORKER_ID}
+
+
+def estimate_eta_seconds(job):
+    """Ước lượng thời gian còn lại dựa trên tốc độ xử lý từ lúc job bắt đầu"""
+    if job.get('status') != 'running' or not job.get('total_rows') or not job.get('rows_processed'):
+        return None
+    if not job.get('started_at') or not job.get('updated_at'):
+        return None
+    started = datetime.fromisoformat(job['started_at'])
+    updated = datetime.fromisoformat(job['updated_at'])
+    elapsed = (updated - started).total_seconds()
+    if elapsed <= 0:
+        return None
+    rate = job['rows_processed'] / elapsed
+    remaining = max(job['total_rows'] - job['rows_processed'], 0)
+    return round(remaining / rate, 1)
@@ -0,0 +1,100 @@
+from collections import Counter
+import re
+import unicodedata
+import zlib
+
+# Tên sparse vector trong collection Qdrant
+LEXICAL_VECTOR_NAME = 'lexical'
+
+# Hằng số k1 của BM25: tần suất term trong chunk được bão hòa, IDF do Qdrant tính (Modifier.IDF)
+BM25_K1 = 1.2
+
+# Hằng số k của reciprocal rank fusion
+RRF_K = 60
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def _is_cjk(char):
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF      # CJK Unified Ideographs
+        or 0x3400 <= code <= 0x4DBF   # Extension A
+        or 0x20000 <= code <= 0x2A6DF # Extension B
+        or 0xF900 <= code <= 0xFAFF   # Compatibility Ideographs
+    )
+
+
+def _split_cjk(word):
+    """Tách một từ thành các đoạn (is_cjk, text) liên tiếp"""
+    segments = []
+    for char in word:
+        cjk = _is_cjk(char)
+        if segments and segments[-1][0] == cjk:
+            segments[-1][1].append(char)
+        else:
+            segments.append((cjk, [char]))
+    return [(cjk, ''.join(chars)) for cjk, chars in segments]
+
+
+def tokenize(text):
+    """
+    Tách text thành terms cho lexical index:
+    - Tiếng Việt: mỗi âm tiết (giữ dấu, chữ thường) và bigram hai âm tiết liền nhau,
+      vì từ tiếng Việt thường gồm nhiều âm tiết ("thương hàn", "quế chi")
+    - Chữ Hán: từng chữ và bigram chữ liền nhau (桂枝湯 -> 桂, 枝, 湯, 桂枝, 枝湯)
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFC', text).lower()
+
+    terms = []
+    previous_syllable = None
+    for word in _TOKEN_PATTERN.findall(text):
+        for cjk, segment in _split_cjk(word):
+            if cjk:
+                terms.extend(segment)
+                terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+                previous_syllable = None
+            else:
+                terms.append(segment)
+                if previous_syllable is not None:
+                    terms.append(f"{previous_syllable} {segment}")
+                previous_syllable = segment
+    return terms
+
+
+def term_index(term):
+    """Index ổn định giữa các process (không dùng hash() vì bị random hóa)"""
+    return zlib.crc32(term.encode('utf-8')) & 0x7FFFFFFF
+
+
+def sparse_vector(text):
+    """
+    Trả về (indices, values) của sparse vector cho text.
+    values là tần suất term đã bão hòa kiểu BM25; hash trùng thì cộng dồn
+    """
+    counts = Counter(term_index(term) for term in tokenize(text))
+    indices = sorted(counts)
+    values = [counts[i] * (BM25_K1 + 1) / (counts[i] + BM25_K1) for i in indices]
+    return indices, values
+
+
+def query_sparse_vector(text):
+    """Sparse vector cho câu query: mỗi term một trọng số, IDF do Qdrant áp dụng"""
+    indices = sorted({term_index(term) for term in tokenize(text)})
+    return indices, [1.0] * len(indices)
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    Gộp nhiều danh sách kết quả đã xếp hạng (mỗi phần tử là (key, item)).
+    Trả về list (key, fused_score, item) theo fused_score giảm dần
+    """
+    scores = {}
+    items = {}
+    for ranked in ranked_lists:
+        for rank, (key, item) in enumerate(ranked, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(key, item)
+    return [(key, score, items[key]) for key, score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)]
@@ -1,35 +1,77 @@
 from minio import Minio
 from minio.error import S3Error
 from flask import current_app
+import logging
+import threading
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+_bucket_ready = False
+
+
+def get_minio_client(app_config):
+    """
+    Minio client dùng chung cho cả process với urllib3 PoolManager riêng,
+    để các request tái sử dụng kết nối HTTP thay vì mở kết nối mới
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = urllib3.PoolManager(
+                    maxsize=app_config.MINIO_POOL_SIZE,
+                    block=False,
+                    timeout=urllib3.Timeout(connect=app_config.MINIO_CONNECT_TIMEOUT, read=app_config.MINIO_READ_TIMEOUT),
+                    retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+                )
+                _client = Minio(
+                    app_config.MINIO_ENDPOINT,
+                    access_key=app_config.MINIO_ACCESS_KEY,
+                    secret_key=app_config.MINIO_SECRET_KEY,
+                    secure=False,  # Nếu dùng HTTPS thì để True
+                    http_client=http_client
+                )
+    return _client
+
+
+def ensure_bucket(app_config):
+    """Tạo bucket nếu chưa có; chỉ gọi MinIO lần đầu tiên trong process (lỗi được raise ra ngoài)"""
+    global _bucket_ready
+    if _bucket_ready:
+        return
+    client = get_minio_client(app_config)
+    with _client_lock:
+        if not _bucket_ready:
+            if not client.bucket_exists(app_config.MINIO_BUCKET_NAME):
+                client.make_bucket(app_config.MINIO_BUCKET_NAME)
+            _bucket_ready = True
+
 
 class MinioService:
     def __init__(self, app_config):
-        self.client = Minio(
-            app_config.MINIO_ENDPOINT,
-            access_key=app_config.MINIO_ACCESS_KEY,
-            secret_key=app_config.MINIO_SECRET_KEY,
-            secure=False  # Nếu dùng HTTPS thì để True
-        )
+        self.client = get_minio_client(app_config)
         self.bucket = app_config.MINIO_BUCKET_NAME
-        # Tạo bucket nếu chưa có
+        # Tạo bucket nếu chưa có (thường đã được kiểm tra lúc startup)
         try:
-            if not self.client.bucket_exists(self.bucket):
-                self.client.make_bucket(self.bucket)
+            ensure_bucket(app_config)
         except Exception as e:
-            print(f"Warning: Could not initialize MinIO bucket: {e}")
+            logger.warning(f"Could not initialize MinIO bucket: {e}")
             # Bucket sẽ được tạo khi cần thiết
+        self.app_config = app_config
 
-    def upload_file(self, file_obj, filename, content_type):
+    def upload_file(self, file_obj, filename, content_type, length=-1):
         try:
-            # Đảm bảo bucket tồn tại
-            if not self.client.bucket_exists(self.bucket):
-                self.client.make_bucket(self.bucket)
+            # Đảm bảo bucket tồn tại (không tốn round trip khi đã kiểm tra)
+            ensure_bucket(self.app_config)
             
             self.client.put_object(
                 self.bucket,
                 filename,
                 file_obj,
-                length=-1,  # Đọc hết stream
+                length=length,  # -1: đọc hết stream
                 part_size=10*1024*1024,  # 10MB
                 content_type=content_type
             )
@@ -39,6 +81,24 @@ class MinioService:
         except Exception as e:
             return False, f"MinIO error: {str(e)}"
 
+    def upload_local_file(self, file_path, filename, content_type):
+        """Upload file local theo stream với kích thước biết trước (multipart cho file lớn)"""
+        try:
+            ensure_bucket(self.app_config)
+            
+            self.client.fput_object(
+                self.bucket,
+                filename,
+                file_path,
+                content_type=content_type,
+                part_size=10*1024*1024  # 10MB
+            )
+            return True, f"File '{filename}' uploaded to bucket '{self.bucket}'"
+        except S3Error as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"MinIO error: {str(e)}"
+
     def delete_file(self, filename):
         try:
             self.client.remove_object(self.bucket, filename)
@@ -46,12 +106,32 @@ class MinioService:
         except S3Error as e:
             return False, str(e)
 
+    def download_file(self, filename, file_path):
+        """Tải object về file local theo stream, không đọc toàn bộ vào bộ nhớ"""
+        try:
+            self.client.fget_object(self.bucket, filename, file_path)
+            return True, file_path
+        except S3Error as e:
+            return False, str(e)
+
     def get_file(self, filename):
         try:
             return self.client.get_object(self.bucket, filename)
         except S3Error as e:
             return None
 
+    def get_file_range(self, filename, offset, length):
+        """Đọc một đoạn bytes của object (HTTP range request), None nếu không có object"""
+        try:
+            response = self.client.get_object(self.bucket, filename, offset=offset, length=length)
+        except S3Error:
+            return None
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
     def list_files(self):
         try:
             objects = self.client.list_objects(self.bucket)
@@ -1,152 +1,521 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    PointStruct, PayloadSchemaType, SparseVector, SparseVectorParams, Modifier,
+    NamedSparseVector, SearchRequest,
+    Filter, FieldCondition, MatchValue, MatchAny, Range, FilterSelector
+)
+from .embedding_registry import get_embedding_model
+from .query_embedding_cache import get_query_embedding_cache
+from .embedding_dispatcher import get_embedding_dispatcher
+from .embedding_cache import get_embedding_cache
+from .collection_profiles import get_collection_profile, collection_create_kwargs, search_params
+from .lexical import LEXICAL_VECTOR_NAME, RRF_K, sparse_vector, query_sparse_vector, reciprocal_rank_fusion
 import logging
 import os
+import threading
+import time
+import uuid
+from itertools import islice
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
-class QdrantService:
-    def __init__(self, config):
-        self.client = QdrantClient(
+# Size của vietnamese-bi-encoder
+VECTOR_SIZE = 768
+
+# Các payload field được đánh index để filter theo user/KB
+PAYLOAD_INDEX_FIELDS = ('user_id', 'kb_id')
+
+# Point ID 64-bit: kb_id ở 32 bit cao, chunk_id ở 32 bit thấp
+CHUNK_ID_BITS = 32
+MAX_CHUNK_ID = (1 << CHUNK_ID_BITS) - 1
+
+def make_point_id(kb_id, chunk_id):
+    """Point ID không trùng giữa các KB, mỗi KB chứa tối đa ~4 tỷ chunks"""
+    if not 0 <= chunk_id <= MAX_CHUNK_ID:
+        raise ValueError(f"chunk_id {chunk_id} out of range for point ID")
+    return (kb_id << CHUNK_ID_BITS) | chunk_id
+
+def _iter_batches(items, batch_size):
+    """Chia một iterable thành các list có tối đa batch_size phần tử"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+_client = None
+_client_lock = threading.Lock()
+
+# collection_name -> collection có sparse vector lexical hay không; kiểm tra một lần mỗi process
+_ready_collections = {}
+_ready_collections_lock = threading.Lock()
+
+def get_qdrant_client(config):
+    """
+    QdrantClient dùng chung cho cả process để giữ kết nối HTTP keep-alive
+    (hoặc gRPC channel khi QDRANT_PREFER_GRPC) thay vì mở kết nối mới mỗi request
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = QdrantClient(
+                    host=config.QDRANT_HOST,
+                    port=config.QDRANT_PORT,
+                    grpc_port=config.QDRANT_GRPC_PORT,
+                    prefer_grpc=config.QDRANT_PREFER_GRPC,
+                    api_key=config.QDRANT_API_KEY or None,
+                    timeout=config.QDRANT_TIMEOUT
+                )
+    return _client
+
+_async_client = None
+
+def get_async_qdrant_client(config):
+    """
+    AsyncQdrantClient dùng chung cho async chat endpoint. Chỉ gọi từ trong event loop của
+    ASGI server (mỗi process một loop), client giữ kết nối gắn với loop đó
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncQdrantClient(
             host=config.QDRANT_HOST,
             port=config.QDRANT_PORT,
-            api_key=config.QDRANT_API_KEY or None
+            grpc_port=config.QDRANT_GRPC_PORT,
+            prefer_grpc=config.QDRANT_PREFER_GRPC,
+            api_key=config.QDRANT_API_KEY or None,
+            timeout=config.QDRANT_TIMEOUT
         )
+    return _async_client
+
+def ensure_payload_indexes(client, collection_name, info):
+    """Tạo payload index cho user_id và kb_id để filter được thực hiện trong Qdrant"""
+    existing = set((info.payload_schema or {}).keys())
+    for field_name in PAYLOAD_INDEX_FIELDS:
+        if field_name not in existing:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PayloadSchemaType.INTEGER
+            )
+            logger.info(f"Created payload index on {field_name} for {collection_name}")
+
+def _create_or_inspect_collection(client, collection_name, profile):
+    """Tạo collection nếu chưa có, trả về collection có sparse vector lexical hay không"""
+    try:
+        collections = client.get_collections()
+        collection_names = [col.name for col in collections.collections]
         
-        # Use configurable model path
-        model_path = config.MODEL_PATH
-        logger.info(f"Loading model from: {model_path}")
+        if collection_name not in collection_names:
+            client.create_collection(
+                collection_name=collection_name,
+                sparse_vectors_config={
+                    LEXICAL_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)
+                },
+                **collection_create_kwargs(profile, VECTOR_SIZE)
+            )
+            logger.info(f"Created Qdrant collection: {collection_name} (profile {profile['name']})")
+        else:
+            logger.info(f"Qdrant collection {collection_name} already exists")
         
-        try:
-            self.model = SentenceTransformer(model_path)
-            logger.info(f"Successfully loaded model from {model_path}")
-        except Exception as e:
-            logger.error(f"Error loading model from {model_path}: {str(e)}")
-            raise
+        info = client.get_collection(collection_name)
+        ensure_payload_indexes(client, collection_name, info)
+        if LEXICAL_VECTOR_NAME not in (info.config.params.sparse_vectors or {}):
+            # Collection tạo trước khi có lexical index: chỉ dùng dense cho tới khi chạy migrate_lexical_index.py
+            logger.warning(f"Collection {collection_name} has no '{LEXICAL_VECTOR_NAME}' sparse vector, hybrid search disabled")
+            return False
+        return True
+            
+    except Exception as e:
+        logger.error(f"Error ensuring collection exists: {str(e)}")
+        raise
+
+def ensure_collection(config):
+    """
+    Đảm bảo collection tồn tại, chỉ gọi Qdrant ở lần đầu tiên trong process
+    (lúc startup); trả về collection có sparse vector lexical hay không
+    """
+    collection_name = config.QDRANT_COLLECTION_NAME
+    lexical_available = _ready_collections.get(collection_name)
+    if lexical_available is None:
+        with _ready_collections_lock:
+            lexical_available = _ready_collections.get(collection_name)
+            if lexical_available is None:
+                lexical_available = _create_or_inspect_collection(
+                    get_qdrant_client(config), collection_name, get_collection_profile(config.QDRANT_COLLECTION_PROFILE)
+                )
+                _ready_collections[collection_name] = lexical_available
+    return lexical_available
+
+class QdrantService:
+    def __init__(self, config, model=None):
+        self.config = config
+        self.client = get_qdrant_client(config)
+        
+        # Mượn model từ registry thay vì load lại mỗi request
+        self.model_path = config.MODEL_PATH
+        self.model = model if model is not None else get_embedding_model(config.MODEL_PATH)
+        self.query_cache = get_query_embedding_cache(config)
+        self.dispatcher = (
+            get_embedding_dispatcher(config, self.model_path, self.model)
+            if config.EMBEDDING_DISPATCH_ENABLED and model is None else None
+        )
         
-        self.collection_name = "daomed_chunks"
-        self.vector_size = 768  # Size của vietnamese-bi-encoder
+        self.collection_name = config.QDRANT_COLLECTION_NAME
+        self.vector_size = VECTOR_SIZE
+        # Cache embedding của chunk texts trên đĩa, chỉ dùng với model của MODEL_PATH
+        self.embedding_cache = get_embedding_cache(config, VECTOR_SIZE) if model is None else None
+        self.embedding_batch_size = config.EMBEDDING_BATCH_SIZE
+        self.upsert_batch_size = config.QDRANT_UPSERT_BATCH_SIZE
+        self.profile = get_collection_profile(config.QDRANT_COLLECTION_PROFILE, config.QDRANT_SEARCH_EF)
+        self.search_params = search_params(self.profile)
         
-        # Tạo collection nếu chưa có
-        self._ensure_collection_exists()
+        # Tạo collection nếu chưa có (đã kiểm tra lúc startup thì không tốn round trip)
+        self.lexical_enabled = config.LEXICAL_INDEX_ENABLED and ensure_collection(config)
     
-    def _ensure_collection_exists(self):
-        """Đảm bảo collection tồn tại"""
-        try:
-            collections = self.client.get_collections()
-            collection_names = [col.name for col in collections.collections]
-            
-            if self.collection_name not in collection_names:
-                self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.vector_size,
-                        distance=Distance.COSINE
-                    )
-                )
-                logger.info(f"Created Qdrant collection: {self.collection_name}")
-            else:
-                logger.info(f"Qdrant collection {self.collection_name} already exists")
-                
-        except Exception as e:
-            logger.error(f"Error ensuring collection exists: {str(e)}")
-            raise
+    @staticmethod
+    def build_filter(user_id=None, kb_ids=None):
+        """Filter giới hạn search trong KB của user (và tập kb_ids nếu có)"""
+        conditions = []
+        if user_id is not None:
+            conditions.append(FieldCondition(key='user_id', match=MatchValue(value=user_id)))
+        if kb_ids is not None:
+            conditions.append(FieldCondition(key='kb_id', match=MatchAny(any=list(kb_ids))))
+        return Filter(must=conditions) if conditions else None
     
-    def vectorize_chunks(self, chunks, kb_id, user_id):
+    def encode_texts(self, texts):
+        """
+        Encode danh sách texts theo batch, trả về numpy float32 array (N, dim)
+        """
+        if not texts:
+            return np.empty((0, self.vector_size), dtype=np.float32)
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.embedding_batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+    def encode_documents(self, texts):
         """
-        Vectorize chunks và lưu vào Qdrant
+        Như encode_texts nhưng tra embedding cache trước, chỉ encode các texts chưa có
+        (texts trùng nhau trong cùng batch cũng chỉ encode một lần)
+        """
+        if self.embedding_cache is None or not texts:
+            return self.encode_texts(texts)
+        
+        keys = [self.embedding_cache.key(text) for text in texts]
+        cached = self.embedding_cache.get_many(keys)
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            encoded = self.encode_texts(list(missing.values()))
+            self.embedding_cache.put_many(list(zip(missing, encoded)))
+            cached.update(zip(missing, encoded))
+        
+        return np.stack([cached[key] for key in keys])
+
+    def vectorize_chunks(self, chunks, kb_id, user_id, progress_callback=None, generation=None):
+        """
+        Vectorize chunks và lưu vào Qdrant theo từng batch.
+        Mỗi batch upsert được sort theo độ dài text để giảm padding khi encode,
+        nên bộ nhớ chỉ phụ thuộc vào batch size chứ không phụ thuộc số chunks.
         """
         try:
-            if not chunks:
+            started = time.perf_counter()
+            total = 0
+            
+            for batch in _iter_batches(chunks, self.upsert_batch_size):
+                count = self._vectorize_batch(batch, kb_id, user_id, generation)
+                total += count
+                if progress_callback:
+                    progress_callback(count)
+            
+            if total == 0:
                 logger.warning("No chunks to vectorize")
                 return False, "No chunks provided"
             
-            # Tạo points cho Qdrant
-            points = []
-            
-            for chunk in chunks:
-                # Vectorize chunk text
-                chunk_text = chunk['text']
-                vector = self.model.encode(chunk_text, show_progress_bar=False).tolist()
-                
-                # Tạo point ID dạng integer: kb_id * 10000 + chunk_id
-                # Đảm bảo unique và Qdrant chấp nhận
-                point_id = kb_id * 10000 + chunk['id']
-                
-                # Tạo point với metadata
-                point = PointStruct(
-                    id=point_id,  # Integer ID thay vì string
-                    vector=vector,
-                    payload={
-                        'chunk_id': chunk['id'],
-                        'kb_id': kb_id,
-                        'user_id': user_id,
-                        'text': chunk_text,
-                        'row_index': chunk['row_index'],
-                        'headers': chunk['headers']
-                    }
-                )
-                points.append(point)
-            
-            # Upload points vào Qdrant
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=points
-            )
+            elapsed = time.perf_counter() - started
+            stats = {
+                'vectorized_chunks': total,
+                'elapsed_seconds': round(elapsed, 3),
+                'chunks_per_sec': round(total / elapsed, 2) if elapsed > 0 else None
+            }
             
-            logger.info(f"Successfully vectorized and stored {len(points)} chunks for KB {kb_id}")
-            return True, f"Vectorized {len(points)} chunks"
+            logger.info(f"Successfully vectorized and stored {total} chunks for KB {kb_id} ({stats['chunks_per_sec']} chunks/sec)")
+            return True, stats
             
         except Exception as e:
             logger.error(f"Error vectorizing chunks: {str(e)}")
             return False, str(e)
     
-    def search_chunks(self, query, user_id, top_k=5, score_threshold=0.5):
+    def _vectorize_batch(self, chunks, kb_id, user_id, generation=None):
+        """Encode một batch chunks và upsert vào Qdrant"""
+        # Sort theo độ dài để các câu dài ngắn tương đương nằm chung batch encode
+        chunks = sorted(chunks, key=lambda chunk: len(chunk['text']))
+        vectors = self.encode_documents([chunk['text'] for chunk in chunks])
+        
+        points = []
+        for chunk, vector in zip(chunks, vectors):
+            point_id = make_point_id(kb_id, chunk['id'])
+            
+            # Dense vector không tên + sparse vector cho lexical search (nếu collection hỗ trợ)
+            point_vector = vector.tolist()
+            if self.lexical_enabled:
+                indices, values = sparse_vector(chunk['text'])
+                point_vector = {'': point_vector, LEXICAL_VECTOR_NAME: SparseVector(indices=indices, values=values)}
+            
+            payload = {
+                'chunk_id': chunk['id'],
+                'kb_id': kb_id,
+                'user_id': user_id,
+                'text': chunk['text'],
+                'row_index': chunk['row_index'],
+                'headers': chunk['headers']
+            }
+            if generation is not None:
+                payload['index_generation'] = generation
+            
+            points.append(PointStruct(
+                id=point_id,
+                vector=point_vector,
+                payload=payload
+            ))
+        
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=points
+        )
+        return len(points)
+    
+    def encode_query(self, query):
+        """Encode một câu query thành numpy float32 vector (có cache)"""
+        return self.encode_queries([query])[0]
+
+    def encode_queries(self, queries):
+        """
+        Encode nhiều queries, trả về list numpy float32 vectors theo đúng thứ tự.
+        Query đã có trong cache không encode lại; các query còn thiếu được encode
+        chung trong một lần forward, query đang được thread khác encode thì chờ kết quả.
+        """
+        keys = [(self.model_path, query.strip()) for query in queries]
+        vectors = [None] * len(keys)
+        owned = {}
+        waiting = {}
+        
+        for i, key in enumerate(keys):
+            if key in owned or key in waiting:
+                continue
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                vectors[i] = cached
+                continue
+            future, is_owner = self.query_cache.claim(key)
+            if is_owner:
+                owned[key] = future
+            else:
+                waiting[key] = future
+        
+        results = {}
+        if owned:
+            owned_keys = list(owned)
+            try:
+                texts = [key[1] for key in owned_keys]
+                if self.dispatcher is not None:
+                    # Gộp với query của các request khác đang chờ encode
+                    encoded = self.dispatcher.encode(texts)
+                else:
+                    encoded = self.encode_texts(texts)
+            except Exception as e:
+                for key in owned_keys:
+                    self.query_cache.fail(key, e)
+                raise
+            for key, vector in zip(owned_keys, encoded):
+                self.query_cache.resolve(key, vector)
+                results[key] = vector
+        
+        for key, future in waiting.items():
+            results[key] = future.result()
+        
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                vectors[i] = results[key]
+        return vectors
+
+    def search_chunks(self, query, user_id, top_k=5, score_threshold=0.5, query_vector=None, kb_ids=None):
         """
-        Tìm kiếm chunks liên quan đến query
+        Tìm kiếm chunks liên quan đến query trong các KB của user
+        query_vector: embedding đã tính sẵn của query (nếu có) để không encode lại
+        kb_ids: chỉ tìm trong các KB này (None = tất cả KB của user)
         """
         try:
+            if kb_ids is not None and not kb_ids:
+                return True, []
+            
             # Vectorize query
-            query_vector = self.model.encode(query, show_progress_bar=False).tolist()
+            if query_vector is None:
+                query_vector = self.encode_query(query)
             
             # Search trong Qdrant
-            search_results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=top_k,
-                score_threshold=score_threshold,
-                query_filter=None  # Có thể thêm filter theo user_id nếu cần
-            )
+            requests = self._search_requests(query, user_id, top_k, score_threshold, query_vector, kb_ids, hybrid=False)
+            responses = self.client.search_batch(collection_name=self.collection_name, requests=requests)
+            return True, self._search_results(query, responses, top_k, score_threshold, query_vector, hybrid=False)
             
-            # Format kết quả
-            results = []
-            for result in search_results:
-                results.append({
-                    'chunk_id': result.payload['chunk_id'],
-                    'kb_id': result.payload['kb_id'],
-                    'text': result.payload['text'],
-                    'row_index': result.payload['row_index'],
-                    'headers': result.payload['headers'],
-                    'score': result.score
-                })
+        except Exception as e:
+            logger.error(f"Error searching chunks: {str(e)}")
+            return False, str(e)
+    
+    def hybrid_search(self, query, user_id, top_k=5, score_threshold=0.5, query_vector=None, kb_ids=None, candidates=None):
+        """
+        Dense + lexical (sparse, IDF) search trong một request search_batch, gộp bằng reciprocal rank fusion.
+        Mỗi nhánh lấy `candidates` kết quả (mặc định 2 * top_k). score vẫn là cosine similarity như
+        search_chunks và score_threshold áp dụng cho mọi kết quả: chunk chỉ nhánh lexical tìm thấy được
+        tính cosine từ dense vector đã lưu. Thứ tự theo rrf_score (điểm RRF chuẩn hóa về [0, 1]),
+        kèm dense_score/lexical_score của từng nhánh.
+        """
+        if not self.lexical_enabled:
+            return self.search_chunks(query, user_id, top_k, score_threshold, query_vector, kb_ids)
+        
+        try:
+            if kb_ids is not None and not kb_ids:
+                return True, []
             
-            logger.info(f"Found {len(results)} relevant chunks for query: {query}")
-            return True, results
+            if query_vector is None:
+                query_vector = self.encode_query(query)
+            requests = self._search_requests(query, user_id, top_k, score_threshold, query_vector, kb_ids, candidates, hybrid=True)
+            responses = self.client.search_batch(collection_name=self.collection_name, requests=requests)
+            return True, self._search_results(query, responses, top_k, score_threshold, query_vector, hybrid=True)
             
         except Exception as e:
-            logger.error(f"Error searching chunks: {str(e)}")
+            logger.error(f"Error in hybrid search: {str(e)}")
+            return False, str(e)
+    
+    async def asearch(self, query, user_id, query_vector, top_k=5, score_threshold=0.5, kb_ids=None, candidates=None, hybrid=True):
+        """
+        Bản async của hybrid_search (hybrid=True) / search_chunks cho async chat endpoint, gọi Qdrant
+        qua AsyncQdrantClient nên không giữ thread trong lúc chờ. query_vector bắt buộc: encode
+        là CPU-bound, caller chạy nó ngoài event loop
+        """
+        hybrid = hybrid and self.lexical_enabled
+        try:
+            if kb_ids is not None and not kb_ids:
+                return True, []
+            
+            requests = self._search_requests(query, user_id, top_k, score_threshold, query_vector, kb_ids, candidates, hybrid=hybrid)
+            responses = await get_async_qdrant_client(self.config).search_batch(
+                collection_name=self.collection_name, requests=requests
+            )
+            return True, self._search_results(query, responses, top_k, score_threshold, query_vector, hybrid=hybrid)
+            
+        except Exception as e:
+            logger.error(f"Error in async search: {str(e)}")
             return False, str(e)
     
+    def _search_requests(self, query, user_id, top_k, score_threshold, query_vector, kb_ids, candidates=None, hybrid=True):
+        """SearchRequest cho nhánh dense, và nhánh lexical nếu hybrid (query có token trong lexical index)"""
+        query_filter = self.build_filter(user_id, kb_ids)
+        dense = SearchRequest(
+            vector=np.asarray(query_vector, dtype=np.float32).tolist(),
+            filter=query_filter,
+            limit=(candidates or top_k * 2) if hybrid else top_k,
+            score_threshold=score_threshold,
+            params=self.search_params,
+            with_payload=True
+        )
+        if not hybrid:
+            return [dense]
+        
+        requests = [dense]
+        indices, values = query_sparse_vector(query)
+        if indices:
+            requests.append(SearchRequest(
+                vector=NamedSparseVector(
+                    name=LEXICAL_VECTOR_NAME,
+                    vector=SparseVector(indices=indices, values=values)
+                ),
+                filter=query_filter,
+                limit=candidates or top_k * 2,
+                with_payload=True,
+                # Dense vector để tính cosine cho các chunk nhánh dense không trả về
+                with_vector=True
+            ))
+        return requests
+    
+    def _search_results(self, query, responses, top_k, score_threshold, query_vector, hybrid=True):
+        """Kết quả của search_batch thành list chunks; hybrid thì gộp các nhánh bằng RRF"""
+        if not hybrid:
+            results = [self._format_hit(hit) for hit in responses[0]]
+            logger.info(f"Found {len(results)} relevant chunks for query: {query}")
+            return results
+        
+        ranked_lists = [[(hit.id, hit) for hit in hits] for hits in responses]
+        dense_scores = {hit.id: hit.score for hit in responses[0]}
+        lexical_scores = {hit.id: hit.score for hit in responses[1]} if len(responses) > 1 else {}
+        # Điểm RRF lớn nhất có thể: đứng đầu ở mọi nhánh
+        max_score = len(ranked_lists) / (RRF_K + 1)
+        
+        query_unit = np.asarray(query_vector, dtype=np.float32)
+        query_unit = query_unit / (np.linalg.norm(query_unit) or 1.0)
+        
+        results = []
+        below_threshold = 0
+        for point_id, fused_score, hit in reciprocal_rank_fusion(ranked_lists):
+            if len(results) >= top_k:
+                break
+            cosine = dense_scores.get(point_id)
+            if cosine is None:
+                cosine = self._cosine_from_hit(hit, query_unit)
+                if score_threshold is not None and (cosine is None or cosine < score_threshold):
+                    below_threshold += 1
+                    continue
+            result = self._format_hit(hit)
+            result['score'] = cosine
+            result['rrf_score'] = fused_score / max_score
+            result['dense_score'] = dense_scores.get(point_id)
+            result['lexical_score'] = lexical_scores.get(point_id)
+            results.append(result)
+        if below_threshold:
+            logger.info(f"Dropped {below_threshold} lexical-only chunks below cosine threshold {score_threshold}")
+        
+        logger.info(f"Hybrid search found {len(results)} chunks ({len(dense_scores)} dense, {len(lexical_scores)} lexical) for query: {query}")
+        return results
+    
+    @staticmethod
+    def _format_hit(hit):
+        return {
+            'chunk_id': hit.payload['chunk_id'],
+            'kb_id': hit.payload['kb_id'],
+            'text': hit.payload['text'],
+            'row_index': hit.payload['row_index'],
+            'headers': hit.payload['headers'],
+            'score': hit.score
+        }
+    
+    @staticmethod
+    def _cosine_from_hit(hit, query_unit):
+        """Cosine giữa query (đã chuẩn hóa) và dense vector trả về kèm hit; None nếu hit không có vector"""
+        vector = hit.vector.get('') if isinstance(hit.vector, dict) else hit.vector
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return float(np.dot(vector, query_unit) / norm) if norm else 0.0
+    
     def delete_kb_chunks(self, kb_id):
         """
-        Xóa tất cả chunks của một knowledge base
+        Xóa tất cả chunks của một knowledge base (delete theo payload filter)
         """
         try:
-            # Tìm và xóa tất cả points có kb_id
             self.client.delete(
                 collection_name=self.collection_name,
-                points_selector=f"kb_id:{kb_id}"
+                points_selector=FilterSelector(filter=self.build_filter(kb_ids=[kb_id])),
+                wait=True
             )
             logger.info(f"Deleted all chunks for KB {kb_id}")
             return True, f"Deleted chunks for KB {kb_id}"
@@ -155,6 +524,74 @@ class QdrantService:
             logger.error(f"Error deleting KB chunks: {str(e)}")
             return False, str(e)
     
+    def delete_chunks_from(self, kb_id, start_chunk_id):
+        """
+        Xóa các chunks có chunk_id >= start_chunk_id của knowledge base (dùng khi upload lại
+        file có ít rows hơn). Delete theo payload filter nên không cần biết danh sách chunk_id cũ
+        """
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=FilterSelector(filter=Filter(must=[
+                    FieldCondition(key='kb_id', match=MatchValue(value=kb_id)),
+                    FieldCondition(key='chunk_id', range=Range(gte=start_chunk_id))
+                ])),
+                wait=True
+            )
+            logger.info(f"Deleted chunks of KB {kb_id} from chunk_id {start_chunk_id}")
+            return True, f"Deleted chunks of KB {kb_id} from chunk_id {start_chunk_id}"
+        except Exception as e:
+            logger.error(f"Error deleting chunks of KB {kb_id}: {str(e)}")
+            return False, str(e)
+    
+    def delete_orphaned_chunks(self, valid_kb_ids):
+        """
+        Xóa points của các KB không còn tồn tại (không nằm trong valid_kb_ids)
+        """
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                # Không còn KB nào thì mọi point đều mồ côi (Filter rỗng khớp tất cả)
+                points_selector=FilterSelector(filter=Filter(
+                    must_not=[FieldCondition(key='kb_id', match=MatchAny(any=list(valid_kb_ids)))]
+                ) if valid_kb_ids else Filter()),
+                wait=True
+            )
+            logger.info(f"Deleted chunks of KBs outside {len(valid_kb_ids)} known knowledge bases")
+            return True, "Deleted orphaned chunks"
+        except Exception as e:
+            logger.error(f"Error deleting orphaned chunks: {str(e)}")
+            return False, str(e)
+    
+    def reindex_kb(self, chunks, kb_id, user_id, progress_callback=None):
+        """
+        Embed lại toàn bộ chunks của một KB mà không làm gián đoạn search:
+        points mới được upsert đè lên point cũ cùng ID (từng point được thay thế nguyên tử)
+        và gắn index_generation mới, sau đó xóa các point còn lại của generation cũ.
+        """
+        generation = uuid.uuid4().hex
+        success, result = self.vectorize_chunks(
+            chunks, kb_id, user_id, progress_callback=progress_callback, generation=generation
+        )
+        if not success:
+            return False, result
+        
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=FilterSelector(filter=Filter(
+                    must=[FieldCondition(key='kb_id', match=MatchValue(value=kb_id))],
+                    must_not=[FieldCondition(key='index_generation', match=MatchValue(value=generation))]
+                )),
+                wait=True
+            )
+        except Exception as e:
+            logger.error(f"Error deleting stale chunks of KB {kb_id}: {str(e)}")
+            return False, str(e)
+        
+        logger.info(f"Reindexed KB {kb_id}: {result}")
+        return True, {**result, 'generation': generation}
+    
     def get_collection_info(self):
         """
         Lấy thông tin collection
@@ -171,8 +608,7 @@ class QdrantService:
         Lấy vector của một chunk cụ thể
         """
         try:
-            # Tạo point ID dạng integer: kb_id * 10000 + chunk_id
-            point_id = kb_id * 10000 + chunk_id
+            point_id = make_point_id(kb_id, chunk_id)
             
             # Lấy point từ Qdrant
             points = self.client.retrieve(
@@ -189,7 +625,8 @@ class QdrantService:
             
             # Format kết quả
             vector_data = {
-                'vector': point.vector,
+                # Collection có sparse vector thì point.vector là dict theo tên vector
+                'vector': point.vector.get('') if isinstance(point.vector, dict) else point.vector,
                 'metadata': {
                     'chunk_id': point.payload['chunk_id'],
                     'kb_id': point.payload['kb_id'],
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import logging
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache query -> float32 embedding, giới hạn theo tổng dung lượng (bytes).
+    Ngoài ra theo dõi các query đang được encode dở (in-flight) để nhiều request
+    cùng lúc cho cùng một query chỉ encode một lần.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (vector, size)
+        self._inflight = {}  # key -> Future
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    @staticmethod
+    def _entry_size(key, vector):
+        return vector.nbytes + sys.getsizeof(key[1])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def claim(self, key):
+        """
+        Đăng ký encode một key chưa có trong cache.
+        Trả về (future, is_owner): is_owner=True thì thread gọi phải encode và gọi
+        resolve/fail; ngược lại chỉ cần chờ future của thread đang encode.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Thread khác vừa encode xong giữa lúc get() và claim()
+                future = Future()
+                future.set_result(entry[0])
+                return future, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def resolve(self, key, vector):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            self._put_locked(key, vector)
+        if future is not None:
+            future.set_result(vector)
+
+    def fail(self, key, error):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_exception(error)
+
+    def _put_locked(self, key, vector):
+        size = self._entry_size(key, vector)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        self._entries[key] = (vector, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._stats['evictions'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'inflight': len(self._inflight)
+            })
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_query_embedding_cache = None
+_query_embedding_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache(config):
+    """Cache dùng chung cho cả process, khởi tạo từ config ở lần gọi đầu tiên"""
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        with _query_embedding_cache_lock:
+            if _query_embedding_cache is None:
+                _query_embedding_cache = QueryEmbeddingCache(
+                    max_bytes=int(config.QUERY_EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+                )
+    return _query_embedding_cache
@@ -1,14 +1,20 @@
+import asyncio
 import os
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 import google.generativeai as genai
 from .qdrant_service import QdrantService
 from .minio_service import MinioService
+from .response_cache import SemanticResponseCache, get_response_cache
+from .reranker import get_reranker
+from .context_packer import ContextPacker
 
 logger = logging.getLogger(__name__)
 
+EMPTY_RESPONSE_MESSAGE = "Xin lỗi, tôi không thể tạo câu trả lời. Vui lòng thử lại."
+
 class RAGService:
-    def __init__(self, config, system_prompt=None, model_config=None, max_chunks=8, cosine_threshold=0.5):
+    def __init__(self, config, system_prompt=None, model_config=None, max_chunks=8, cosine_threshold=0.5, kb_ids=None):
         # Initialize Gemini
         genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
         
@@ -21,10 +27,16 @@ class RAGService:
             model_name = model_config.get('model', 'gemini-2.0-flash')
             temperature = model_config.get('temperature', 0.7)
             max_tokens = model_config.get('max_tokens', 1000)
+            retrieval_mode = model_config.get('retrieval_mode', config.RETRIEVAL_MODE)
+            rerank = model_config.get('rerank', config.RERANKER_ENABLED)
+            context_token_budget = model_config.get('context_token_budget', config.CONTEXT_TOKEN_BUDGET)
         else:
             model_name = 'gemini-2.0-flash'
             temperature = 0.1
             max_tokens = 1000
+            retrieval_mode = config.RETRIEVAL_MODE
+            rerank = config.RERANKER_ENABLED
+            context_token_budget = config.CONTEXT_TOKEN_BUDGET
         
         self.model = genai.GenerativeModel(
             model_name,
@@ -41,6 +53,25 @@ class RAGService:
         # RAG configuration
         self.max_chunks = max_chunks
         self.cosine_threshold = cosine_threshold
+        self.model_config = model_config
+        # Chỉ retrieve trong các KB này (None = tất cả KB của user)
+        self.kb_ids = list(kb_ids) if kb_ids is not None else None
+        # hybrid: dense + lexical gộp bằng RRF, dense: chỉ cosine similarity
+        self.retrieval_mode = retrieval_mode
+        # Rerank: lấy max_chunks * multiplier ứng viên rồi giữ lại max_chunks chunks tốt nhất.
+        # Chỉ bật khi server cho phép; không load được model thì chạy không rerank
+        self.reranker = None
+        if rerank is True and config.RERANKER_ENABLED:
+            try:
+                self.reranker = get_reranker(config)
+            except Exception as e:
+                logger.error(f"Could not load reranker, continuing without reranking: {str(e)}")
+        self.rerank_candidate_multiplier = config.RERANKER_CANDIDATE_MULTIPLIER
+        # Giới hạn tokens của context gửi cho LLM
+        self.context_packer = ContextPacker(int(context_token_budget), config.CONTEXT_TOKEN_ENCODING)
+        
+        # Cache câu trả lời theo câu hỏi gần giống nhau
+        self.response_cache = get_response_cache(config) if config.RESPONSE_CACHE_ENABLED else None
         
         # Use provided system prompt or default
         self.system_prompt = system_prompt or """You are a knowledgeable and helpful chatbot specializing in Traditional Eastern Medicine.
@@ -63,69 +94,94 @@ Provide accurate, faithful answers based only on the content from the six books
 Quote, summarize, or explain relevant passages as needed, but never fabricate information.
 If a question cannot be sufficiently answered using the available knowledge base, respond politely and gently, acknowledging the limitation and expressing your intent to help as much as possible."""
 
-    def search_knowledge_base(self, query: str, user_id: int = None, limit: int = None) -> List[Dict[str, Any]]:
+    def search_knowledge_base(self, query: str, user_id: int = None, limit: int = None, query_vector=None) -> List[Dict[str, Any]]:
         """Search knowledge base for relevant information"""
         try:
             # Use instance max_chunks if limit not provided
             if limit is None:
                 limit = self.max_chunks
             
-            # Search in Qdrant with cosine threshold
-            success, search_results = self.qdrant_service.search_chunks(
+            # Search in Qdrant with cosine threshold (hybrid thêm lexical match cho tên vị thuốc, chữ Hán)
+            search = (
+                self.qdrant_service.hybrid_search if self.retrieval_mode == 'hybrid'
+                else self.qdrant_service.search_chunks
+            )
+            success, search_results = search(
                 query, 
                 user_id=user_id, 
-                top_k=limit, 
-                score_threshold=self.cosine_threshold
+                top_k=self._search_top_k(limit), 
+                score_threshold=self.cosine_threshold,
+                query_vector=query_vector,
+                kb_ids=self.kb_ids
             )
+            return self._finish_search(query, success, search_results, limit)
+        except Exception as e:
+            logger.error(f"Error searching knowledge base: {str(e)}")
+            return []
+
+    async def asearch_knowledge_base(self, query: str, user_id: int = None, query_vector=None, limit: int = None) -> List[Dict[str, Any]]:
+        """Bản async của search_knowledge_base: chờ Qdrant trên event loop, rerank (CPU) chạy trong thread"""
+        try:
+            if limit is None:
+                limit = self.max_chunks
             
-            if not success:
-                logger.error(f"Search failed: {search_results}")
-                return []
-            
-            # Format results
-            formatted_results = []
-            for result in search_results:
-                formatted_results.append({
-                    'content': result.get('text', ''),
-                    'source': f"KB_{result.get('kb_id', 'unknown')}",
-                    'score': result.get('score', 0.0),
-                    'metadata': {
-                        'chunk_id': result.get('chunk_id'),
-                        'kb_id': result.get('kb_id'),
-                        'row_index': result.get('row_index'),
-                        'headers': result.get('headers', [])
-                    }
-                })
-            
-            return formatted_results
+            success, search_results = await self.qdrant_service.asearch(
+                query,
+                user_id=user_id,
+                query_vector=query_vector,
+                top_k=self._search_top_k(limit),
+                score_threshold=self.cosine_threshold,
+                kb_ids=self.kb_ids,
+                hybrid=self.retrieval_mode == 'hybrid'
+            )
+            if self.reranker:
+                return await asyncio.to_thread(self._finish_search, query, success, search_results, limit)
+            return self._finish_search(query, success, search_results, limit)
         except Exception as e:
             logger.error(f"Error searching knowledge base: {str(e)}")
             return []
 
-    def generate_context(self, search_results: List[Dict[str, Any]]) -> str:
-        """Generate context from search results"""
-        if not search_results:
-            return ""
+    def _search_top_k(self, limit):
+        """Số ứng viên lấy từ Qdrant: dư ra để rerank nếu bật reranker"""
+        return limit * self.rerank_candidate_multiplier if self.reranker else limit
+
+    def _finish_search(self, query, success, search_results, limit):
+        """Format kết quả search của Qdrant, rerank nếu bật và giữ lại limit chunks"""
+        if not success:
+            logger.error(f"Search failed: {search_results}")
+            return []
         
-        context_parts = []
-        for i, result in enumerate(search_results, 1):
-            content = result['content']
-            source = result['source']
-            score = result['score']
-            
-            context_parts.append(f"**Tài liệu {i}** (Độ liên quan: {score:.2f})\n")
-            context_parts.append(f"Nguồn: {source}\n")
-            context_parts.append(f"Nội dung: {content}\n")
-            context_parts.append("-" * 50 + "\n")
+        # Format results
+        formatted_results = []
+        for result in search_results:
+            formatted_results.append({
+                'content': result.get('text', ''),
+                'source': f"KB_{result.get('kb_id', 'unknown')}",
+                'score': result.get('score', 0.0),
+                'metadata': {
+                    'chunk_id': result.get('chunk_id'),
+                    'kb_id': result.get('kb_id'),
+                    'row_index': result.get('row_index'),
+                    'headers': result.get('headers', []),
+                    'dense_score': result.get('dense_score'),
+                    'lexical_score': result.get('lexical_score'),
+                    'rrf_score': result.get('rrf_score')
+                }
+            })
+        
+        if self.reranker and len(formatted_results) > 1:
+            formatted_results, _ = self.reranker.rerank(query, formatted_results, limit)
         
-        return "\n".join(context_parts)
+        return formatted_results[:limit]
 
-    def generate_response(self, user_message: str, context: str = "") -> str:
-        """Generate response using Gemini with RAG"""
-        try:
-            # Prepare prompt
-            if context:
-                prompt = f"""Dựa trên thông tin từ knowledge base và kiến thức y học cổ truyền, hãy trả lời câu hỏi sau:
+    def pack_context(self, search_results: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """Đóng gói search results thành context trong token budget: (context, chunks đã dùng, thống kê tokens)"""
+        return self.context_packer.pack(search_results)
+
+    def build_prompt(self, user_message: str, context: str = "") -> str:
+        """Build prompt gửi cho Gemini"""
+        if context:
+            return f"""Dựa trên thông tin từ knowledge base và kiến thức y học cổ truyền, hãy trả lời câu hỏi sau:
 
 **Thông tin từ Knowledge Base:**
 {context}
@@ -134,59 +190,223 @@ If a question cannot be sufficiently answered using the available knowledge base
 {user_message}
 
 Hãy trả lời dựa trên thông tin có sẵn và kiến thức y học cổ truyền."""
-            else:
-                prompt = f"""Dựa trên kiến thức y học cổ truyền, hãy trả lời câu hỏi sau:
+        return f"""Dựa trên kiến thức y học cổ truyền, hãy trả lời câu hỏi sau:
 
 **Câu hỏi của người dùng:**
 {user_message}
 
 Hãy trả lời dựa trên kiến thức y học cổ truyền."""
 
-            # Generate response
-            response = self.model.generate_content(prompt)
-            
-            if response.text:
-                return response.text
-            else:
-                return "Xin lỗi, tôi không thể tạo câu trả lời. Vui lòng thử lại."
-                
+    def generate_response(self, user_message: str, context: str = "") -> str:
+        """Generate response using Gemini with RAG"""
+        try:
+            return self._generate_text(user_message, context) or EMPTY_RESPONSE_MESSAGE
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return f"Xin lỗi, có lỗi xảy ra: {str(e)}"
 
-    def chat_with_rag(self, user_message: str, user_id: int = None) -> Dict[str, Any]:
-        """Main RAG workflow for chat"""
+    def _generate_text(self, user_message: str, context: str = "") -> str:
+        """Gọi Gemini, trả về text hoặc None nếu model không trả lời; lỗi được raise ra ngoài"""
+        prompt = self.build_prompt(user_message, context)
+        response = self.model.generate_content(prompt)
+        return response.text or None
+
+    async def _agenerate_text(self, user_message: str, context: str = "") -> str:
+        """Bản async của _generate_text, dùng async client của Gemini"""
+        prompt = self.build_prompt(user_message, context)
+        response = await self.model.generate_content_async(prompt)
+        return response.text or None
+
+    def generate_response_stream(self, user_message: str, context: str = "") -> Iterator[str]:
+        """Generate response từ Gemini theo từng đoạn text ngay khi model trả về"""
+        prompt = self.build_prompt(user_message, context)
+        response = self.model.generate_content(prompt, stream=True)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk không có text (ví dụ bị safety filter chặn)
+                continue
+            if text:
+                yield text
+
+    def _cache_scope(self, user_id):
+        return SemanticResponseCache.make_scope(
+            user_id, self.system_prompt, self.model_config, self.max_chunks, self.cosine_threshold, self.kb_ids
+        )
+
+    def lookup_cached_response(self, user_message: str, user_id: int = None, query_vector=None, use_cache=True):
+        """
+        Encode câu hỏi (nếu chưa có query_vector) và tra cache. Trả về (cached_result hoặc None, cache_context);
+        cache_context dùng lại cho search và store_cached_response. use_cache=False: không đọc
+        và không ghi cache
+        """
+        if query_vector is None:
+            query_vector = self.qdrant_service.encode_query(user_message)
+        if self.response_cache is None or not use_cache:
+            return None, {'query_vector': query_vector}
+        
+        scope = self._cache_scope(user_id)
+        cache_context = {
+            'query_vector': query_vector,
+            'scope': scope,
+            'user_id': user_id,
+            'kb_version': self.response_cache.kb_version(user_id)
+        }
+        cached = self.response_cache.lookup(scope, query_vector, user_id=user_id)
+        if cached is not None:
+            logger.info(f"Response cache hit for: {user_message}")
+            return {**cached, 'cache_hit': True}, cache_context
+        return None, cache_context
+
+    def store_cached_response(self, cache_context, result: Dict[str, Any]):
+        if self.response_cache is None or 'scope' not in cache_context:
+            return
+        self.response_cache.store(
+            cache_context['scope'], cache_context['query_vector'], result,
+            user_id=cache_context['user_id'], kb_version=cache_context['kb_version']
+        )
+
+    def _retrieve(self, user_message: str, user_id: int = None, query_vector=None, use_cache=True):
+        """
+        Phần chung của chat_with_rag và stream_chat_with_rag: tra response cache, search và
+        đóng gói context. Trả về (cached_result, cache_context, context, retrieval_result);
+        cached_result khác None thì không cần gọi Gemini
+        """
+        # Câu hỏi gần giống đã được trả lời với cùng cấu hình thì dùng lại
+        cached, cache_context = self.lookup_cached_response(user_message, user_id, query_vector, use_cache)
+        if cached is not None:
+            return cached, cache_context, None, None
+        
+        logger.info(f"Searching knowledge base for: {user_message}")
+        search_results = self.search_knowledge_base(
+            user_message, user_id=user_id, query_vector=cache_context['query_vector']
+        )
+        context, retrieval = self._build_retrieval(search_results)
+        return None, cache_context, context, retrieval
+
+    def _build_retrieval(self, search_results):
+        """Chỉ giữ các chunks vừa token budget, trả về (context, retrieval_result)"""
+        context, search_results, context_stats = self.pack_context(search_results)
+        logger.info(f"Packed {context_stats['chunks_packed']}/{context_stats['chunks_retrieved']} documents into {context_stats['context_tokens']} tokens")
+        
+        retrieval = {
+            'context_used': context,
+            'sources': [result['source'] for result in search_results],
+            'search_results_count': len(search_results),
+            'search_results': search_results,
+            'context_stats': context_stats
+        }
+        return context, retrieval
+
+    def _chat_result(self, cache_context, retrieval, response):
+        result = {**retrieval, 'response': response or EMPTY_RESPONSE_MESSAGE}
+        # Chỉ cache câu trả lời thành công
+        if response:
+            self.store_cached_response(cache_context, result)
+        return {**result, 'cache_hit': False}
+
+    @staticmethod
+    def _generation_error_result(retrieval, error):
+        logger.error(f"Error generating response: {str(error)}")
+        return {
+            **retrieval,
+            'response': f"Xin lỗi, có lỗi xảy ra: {str(error)}",
+            'error': str(error),
+            'cache_hit': False
+        }
+
+    @staticmethod
+    def _workflow_error_result(error):
+        logger.error(f"Error in RAG workflow: {str(error)}")
+        return {
+            'response': f"Xin lỗi, có lỗi xảy ra trong quá trình xử lý: {str(error)}",
+            'context_used': "",
+            'sources': [],
+            'search_results_count': 0,
+            'search_results': [],
+            'error': str(error)
+        }
+
+    def chat_with_rag(self, user_message: str, user_id: int = None, query_vector=None, use_cache=True) -> Dict[str, Any]:
+        """
+        Main RAG workflow for chat (query_vector: embedding của câu hỏi nếu đã encode trước,
+        use_cache=False: luôn retrieve và gọi Gemini, không dùng response cache)
+        """
         try:
-            # Step 1: Search knowledge base
-            logger.info(f"Searching knowledge base for: {user_message}")
-            search_results = self.search_knowledge_base(user_message, user_id=user_id)
-            
-            # Step 2: Generate context
-            context = self.generate_context(search_results)
-            logger.info(f"Found {len(search_results)} relevant documents")
+            cached, cache_context, context, retrieval = self._retrieve(user_message, user_id, query_vector, use_cache)
+            if cached is not None:
+                return cached
             
-            # Step 3: Generate response with RAG
             logger.info("Generating response with Gemini")
-            response = self.generate_response(user_message, context)
+            try:
+                response = self._generate_text(user_message, context)
+            except Exception as e:
+                return self._generation_error_result(retrieval, e)
+            return self._chat_result(cache_context, retrieval, response)
+        except Exception as e:
+            return self._workflow_error_result(e)
+
+    async def achat_with_rag(self, user_message: str, user_id: int = None, use_cache=True) -> Dict[str, Any]:
+        """
+        Bản async của chat_with_rag cho ASGI chat endpoint: Qdrant search và Gemini được chờ trên
+        event loop nên request không giữ thread nào trong lúc chờ. Encode câu hỏi + tra cache
+        là CPU-bound nên chạy trong thread pool mặc định của loop
+        """
+        try:
+            cached, cache_context = await asyncio.to_thread(
+                self.lookup_cached_response, user_message, user_id, None, use_cache
+            )
+            if cached is not None:
+                return cached
             
-            # Step 4: Return structured response
-            return {
-                'response': response,
-                'context_used': context,
-                'sources': [result['source'] for result in search_results],
-                'search_results_count': len(search_results),
-                'search_results': search_results
-            }
+            logger.info(f"Searching knowledge base for: {user_message}")
+            search_results = await self.asearch_knowledge_base(
+                user_message, user_id=user_id, query_vector=cache_context['query_vector']
+            )
+            context, retrieval = self._build_retrieval(search_results)
             
+            logger.info("Generating response with Gemini (async)")
+            try:
+                response = await self._agenerate_text(user_message, context)
+            except Exception as e:
+                return self._generation_error_result(retrieval, e)
+            return self._chat_result(cache_context, retrieval, response)
         except Exception as e:
-            logger.error(f"Error in RAG workflow: {str(e)}")
-            return {
-                'response': f"Xin lỗi, có lỗi xảy ra trong quá trình xử lý: {str(e)}",
-                'context_used': "",
-                'sources': [],
-                'search_results_count': 0,
-                'search_results': []
-            }
+            return self._workflow_error_result(e)
+
+    def stream_chat_with_rag(self, user_message: str, user_id: int = None) -> Iterator[Tuple[str, Any]]:
+        """
+        RAG workflow dạng streaming: yield ('retrieval', {...}) ngay sau khi search xong,
+        sau đó từng ('token', text), cuối cùng ('done', {...}) với toàn bộ câu trả lời
+        """
+        cached, cache_context, context, retrieval = self._retrieve(user_message, user_id)
+        if cached is not None:
+            yield 'retrieval', cached
+            yield 'token', cached['response']
+            yield 'done', {'response': cached['response'], 'cache_hit': True}
+            return
+        
+        yield 'retrieval', retrieval
+        
+        logger.info("Streaming response with Gemini")
+        parts = []
+        failed = False
+        try:
+            for text in self.generate_response_stream(user_message, context):
+                parts.append(text)
+                yield 'token', text
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            failed = True
+            if not parts:
+                parts.append(f"Xin lỗi, có lỗi xảy ra: {str(e)}")
+                yield 'token', parts[-1]
+        
+        response = "".join(parts)
+        if response and not failed:
+            self.store_cached_response(cache_context, {**retrieval, 'response': response})
+        yield 'done', {'response': response or EMPTY_RESPONSE_MESSAGE, 'cache_hit': False}
 
     def get_system_prompt(self) -> str:
         """Get system prompt"""
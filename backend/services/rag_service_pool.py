@@ -0,0 +1,105 @@
+from collections import OrderedDict
+import logging
+import threading
+from .rag_service import RAGService
+from .response_cache import SemanticResponseCache
+
+logger = logging.getLogger(__name__)
+
+
+class RAGServicePool:
+    """
+    Giữ các RAGService đã khởi tạo, key theo cấu hình (system_prompt, model_config,
+    max_chunks, cosine_threshold, kb_ids) để các lượt chat sau không phải tạo lại
+    Gemini model, QdrantService, MinioService. Vượt max_size thì bỏ service ít dùng nhất.
+    RAGService không giữ state theo request nên dùng chung được giữa các thread.
+    """
+
+    def __init__(self, config, max_size=64):
+        self.config = config
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._services = OrderedDict()  # key -> RAGService
+        self._dialog_keys = {}  # dialog_id -> key đang dùng
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(system_prompt=None, model_config=None, max_chunks=8, cosine_threshold=0.5, kb_ids=None):
+        return SemanticResponseCache.make_scope(None, system_prompt, model_config, max_chunks, cosine_threshold, kb_ids)
+
+    def get(self, system_prompt=None, model_config=None, max_chunks=8, cosine_threshold=0.5, kb_ids=None, dialog_id=None):
+        """Lấy RAGService cho cấu hình này, tạo mới nếu chưa có"""
+        key = self.make_key(system_prompt, model_config, max_chunks, cosine_threshold, kb_ids)
+        with self._lock:
+            service = self._services.get(key)
+            if service is not None:
+                self._services.move_to_end(key)
+                self._stats['hits'] += 1
+                if dialog_id is not None:
+                    self._dialog_keys[dialog_id] = key
+                return service
+            self._stats['misses'] += 1
+
+        # Khởi tạo ngoài lock; hai thread cùng tạo thì giữ bản tạo trước
+        service = RAGService(
+            self.config,
+            system_prompt=system_prompt,
+            model_config=model_config,
+            max_chunks=max_chunks,
+            cosine_threshold=cosine_threshold,
+            kb_ids=kb_ids
+        )
+        with self._lock:
+            service = self._services.setdefault(key, service)
+            self._services.move_to_end(key)
+            if dialog_id is not None:
+                self._dialog_keys[dialog_id] = key
+            while len(self._services) > self.max_size:
+                self._services.popitem(last=False)
+                self._stats['evictions'] += 1
+        return service
+
+    def get_for_dialog(self, dialog):
+        """RAGService theo config của một dialog (dict từ get_dialog_by_id)"""
+        return self.get(
+            system_prompt=dialog.get('system_prompt'),
+            model_config=dialog.get('model_config'),
+            max_chunks=dialog.get('max_chunks', 8),
+            cosine_threshold=dialog.get('cosine_threshold', 0.5),
+            kb_ids=dialog.get('kb_ids'),
+            dialog_id=dialog.get('id')
+        )
+
+    def invalidate_dialog(self, dialog_id):
+        """Config của dialog thay đổi hoặc dialog bị xóa: bỏ service nếu không dialog nào khác dùng"""
+        with self._lock:
+            key = self._dialog_keys.pop(dialog_id, None)
+            if key is None:
+                return
+            if key not in self._dialog_keys.values() and self._services.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._services)
+            stats['max_size'] = self.max_size
+            stats['tracked_dialogs'] = len(self._dialog_keys)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_rag_service_pool = None
+_rag_service_pool_lock = threading.Lock()
+
+
+def get_rag_service_pool(config):
+    """Pool dùng chung cho cả process, khởi tạo từ config ở lần gọi đầu tiên"""
+    global _rag_service_pool
+    if _rag_service_pool is None:
+        with _rag_service_pool_lock:
+            if _rag_service_pool is None:
+                _rag_service_pool = RAGServicePool(config, max_size=config.RAG_SERVICE_POOL_SIZE)
+    return _rag_service_pool
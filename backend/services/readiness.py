@@ -0,0 +1,72 @@
+import logging
+import time
+from db.database import connection
+from .qdrant_service import get_qdrant_client, ensure_collection
+from .minio_service import get_minio_client, ensure_bucket
+
+logger = logging.getLogger(__name__)
+
+
+def _check_postgres(config):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+
+
+def _check_qdrant(config):
+    get_qdrant_client(config).get_collection(config.QDRANT_COLLECTION_NAME)
+
+
+def _check_minio(config):
+    if not get_minio_client(config).bucket_exists(config.MINIO_BUCKET_NAME):
+        raise RuntimeError(f"Bucket {config.MINIO_BUCKET_NAME} does not exist")
+
+
+READINESS_CHECKS = (
+    ('postgres', _check_postgres),
+    ('qdrant', _check_qdrant),
+    ('minio', _check_minio)
+)
+
+
+def check_readiness(config):
+    """Kiểm tra kết nối tới các dependency, trả về (ready, {name: {'ok', 'latency_ms', 'error'}})"""
+    results = {}
+    for name, check in READINESS_CHECKS:
+        started = time.perf_counter()
+        try:
+            check(config)
+            results[name] = {'ok': True}
+        except Exception as e:
+            results[name] = {'ok': False, 'error': str(e)}
+        results[name]['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return all(result['ok'] for result in results.values()), results
+
+
+def initialize_dependencies(config):
+    """
+    Chạy lúc startup: tạo Qdrant collection và MinIO bucket nếu chưa có (một lần cho cả process),
+    thử lại tối đa STARTUP_CHECK_RETRIES lần. Với STARTUP_FAIL_FAST thì raise nếu vẫn lỗi
+    để process dừng ngay thay vì nhận request rồi lỗi ở từng API
+    """
+    last_error = None
+    for attempt in range(1, config.STARTUP_CHECK_RETRIES + 1):
+        try:
+            ensure_collection(config)
+            ensure_bucket(config)
+            ready, results = check_readiness(config)
+            if ready:
+                logger.info("All dependencies are ready")
+                return True
+            last_error = RuntimeError(f"Dependencies not ready: {results}")
+        except Exception as e:
+            last_error = e
+        logger.warning(f"Startup dependency check {attempt}/{config.STARTUP_CHECK_RETRIES} failed: {last_error}")
+        if attempt < config.STARTUP_CHECK_RETRIES:
+            time.sleep(config.STARTUP_CHECK_DELAY)
+
+    if config.STARTUP_FAIL_FAST:
+        raise RuntimeError(f"Dependencies not ready after {config.STARTUP_CHECK_RETRIES} attempts: {last_error}")
+    logger.error(f"Starting without ready dependencies: {last_error}")
+    return False
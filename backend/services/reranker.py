@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from .embedding_registry import get_cross_encoder
+from .embedding_dispatcher import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Xếp hạng lại các chunks ứng viên bằng cross-encoder chạy local (CPU).
+    Chấm điểm theo batch và kiểm tra latency budget sau mỗi batch: nếu vượt budget
+    (kể cả ở batch cuối) thì bỏ kết quả rerank, giữ nguyên thứ tự retrieval.
+    """
+
+    def __init__(self, model, batch_size=16, budget_ms=300):
+        self.model = model
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000.0
+
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self._stats = {'calls': 0, 'fallbacks': 0, 'errors': 0, 'pairs_scored': 0}
+
+    def rerank(self, query, candidates, top_n, text_key='content'):
+        """
+        Trả về (top_n candidates, reranked). reranked=False nghĩa là đã fallback
+        về thứ tự ban đầu; candidate được rerank có thêm 'rerank_score'
+        """
+        if not candidates:
+            return [], False
+
+        started = time.perf_counter()
+        scores = []
+        fallback = False
+        try:
+            for start in range(0, len(candidates), self.batch_size):
+                batch = candidates[start:start + self.batch_size]
+                scores.extend(self.model.predict(
+                    [(query, candidate[text_key]) for candidate in batch],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False
+                ))
+                if time.perf_counter() - started > self.budget:
+                    fallback = True
+                    break
+        except Exception as e:
+            logger.error(f"Reranking failed, keeping retrieval order: {str(e)}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return candidates[:top_n], False
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['pairs_scored'] += len(scores)
+            self._latency.observe(elapsed_ms)
+            if fallback:
+                self._stats['fallbacks'] += 1
+
+        if fallback:
+            logger.warning(f"Reranking exceeded {self.budget * 1000:.0f}ms budget after {len(scores)}/{len(candidates)} pairs, keeping retrieval order")
+            return candidates[:top_n], False
+
+        ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+        return [{**candidate, 'rerank_score': float(score)} for candidate, score in ranked[:top_n]], True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['budget_ms'] = self.budget * 1000
+            stats['batch_size'] = self.batch_size
+            stats['latency_ms'] = self._latency.snapshot()
+        return stats
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker(config):
+    """Reranker dùng chung cho cả process; model lấy từ registry"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker(
+                    get_cross_encoder(config.RERANKER_MODEL_PATH),
+                    batch_size=config.RERANKER_BATCH_SIZE,
+                    budget_ms=config.RERANKER_BUDGET_MS
+                )
+    return _reranker
+
+
+def get_reranker_stats():
+    return _reranker.get_stats() if _reranker is not None else None
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticResponseCache:
+    """
+    Cache câu trả lời RAG theo embedding của câu hỏi.
+    - Câu hỏi gần giống nhau (cosine >= similarity_threshold) dùng chung câu trả lời
+    - Chỉ so khớp trong cùng scope: cấu hình dialog (system_prompt, model_config,
+      max_chunks, cosine_threshold, user) và version của knowledge base
+    - Hết hạn sau ttl_seconds, vượt max_entries thì bỏ entry ít dùng nhất (LRU)
+    Cache nằm trong bộ nhớ của từng worker process.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.97):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry_id -> (key, vector, value, created_at, user_id)
+        self._scopes = {}  # (scope, kb_version) -> set(entry_id)
+        self._next_id = 0
+        self._kb_versions = {}  # user_id -> version của knowledge base
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_scope(user_id, system_prompt, model_config, max_chunks, cosine_threshold, kb_ids=None):
+        """Fingerprint của các tham số ảnh hưởng tới câu trả lời"""
+        if isinstance(model_config, str):
+            try:
+                model_config = json.loads(model_config)
+            except ValueError:
+                pass
+        raw = json.dumps({
+            'user_id': user_id,
+            'system_prompt': system_prompt,
+            'model_config': model_config,
+            'max_chunks': max_chunks,
+            'cosine_threshold': cosine_threshold,
+            'kb_ids': sorted(kb_ids) if kb_ids is not None else None
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _versioned(self, scope, user_id):
+        return (scope, self._kb_versions.get(user_id, 0))
+
+    def lookup(self, scope, query_vector, user_id=None):
+        """Trả về value đã cache của câu hỏi gần nhất trong scope, hoặc None"""
+        query = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            key = self._versioned(scope, user_id)
+            entry_ids = list(self._scopes.get(key, ()))
+            best_id, best_score = None, -1.0
+            for entry_id in entry_ids:
+                _, vector, _, created_at, _ = self._entries[entry_id]
+                if now - created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self._stats['expirations'] += 1
+                    continue
+                score = float(np.dot(query, vector))
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_id)
+                self._stats['hits'] += 1
+                return self._entries[best_id][2]
+
+            self._stats['misses'] += 1
+            return None
+
+    def kb_version(self, user_id=None):
+        with self._lock:
+            return self._kb_versions.get(user_id, 0)
+
+    def store(self, scope, query_vector, value, user_id=None, kb_version=None):
+        """
+        Lưu câu trả lời. kb_version là version đọc được lúc bắt đầu xử lý request;
+        nếu knowledge base đã thay đổi trong lúc đó thì bỏ qua để không cache kết quả cũ
+        """
+        vector = self._normalize(query_vector)
+        with self._lock:
+            if kb_version is not None and kb_version != self._kb_versions.get(user_id, 0):
+                return
+            key = self._versioned(scope, user_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, vector, value, time.time(), user_id)
+            self._scopes.setdefault(key, set()).add(entry_id)
+            self._stats['stores'] += 1
+
+            while len(self._entries) > self.max_entries:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+                self._stats['evictions'] += 1
+
+    def _remove(self, entry_id):
+        key = self._entries.pop(entry_id)[0]
+        ids = self._scopes.get(key)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._scopes[key]
+
+    def invalidate_kb(self, user_id):
+        """Knowledge base của user thay đổi: tăng version và bỏ các câu trả lời cũ của user đó"""
+        with self._lock:
+            self._kb_versions[user_id] = self._kb_versions.get(user_id, 0) + 1
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry[4] == user_id]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['tracked_users'] = len(self._kb_versions)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(config):
+    """Cache dùng chung cho cả process, khởi tạo từ config ở lần gọi đầu tiên"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = SemanticResponseCache(
+                    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                    ttl_seconds=config.RESPONSE_CACHE_TTL,
+                    similarity_threshold=config.RESPONSE_CACHE_SIMILARITY
+                )
+    return _response_cache
@@ -51,6 +51,42 @@ export const chatAPI = {
     api.post(`/api/dialog/${dialogId}/chat`, {
       message,
     }),
+  // Stream câu trả lời qua Server-Sent Events, gọi onEvent(event, data) cho từng event
+  streamMessage: async (dialogId, message, onEvent) => {
+    const response = await fetch(
+      `${api.defaults.baseURL}/api/dialog/${dialogId}/chat/stream`,
+      {
+        method: "POST",
+        credentials: "include",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ message }),
+      }
+    );
+    if (!response.ok || !response.body) {
+      throw new Error(`Stream request failed: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    // eslint-disable-next-line no-constant-condition
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const rawEvent of events) {
+        let event = "message";
+        let data = "";
+        for (const line of rawEvent.split("\n")) {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        }
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  },
   getHistory: () => api.get("/api/chat/history"),
   getConversations: () => api.get("/api/chat/conversations"),
 };
@@ -65,10 +101,13 @@ export const kbAPI = {
     }),
   delete: (id) => api.delete(`/api/kb/${id}`),
   getChunks: (id) => api.get(`/api/kb/${id}/chunks`),
+  getJob: (jobId) => api.get(`/api/kb/jobs/${jobId}`),
 };
 
 export const evaluationAPI = {
   evaluate: (data) => api.post("/api/eval/evaluate", data),
+  startJob: (data) => api.post("/api/eval/jobs", data),
+  getJob: (runId) => api.get(`/api/eval/jobs/${runId}`),
 };
 
 export default api;
@@ -1,7 +1,7 @@
 import { useEffect, useState, useRef } from 'react';
 import { List, Input, Button, Spin, message, Avatar, Empty, Tag } from 'antd';
 import { SendOutlined, UserOutlined, RobotOutlined, SearchOutlined } from '@ant-design/icons';
-import api from '../api';
+import api, { chatAPI } from '../api';
 import RAGDetailsModal from './RAGDetailsModal';
 
 // Simple markdown renderer for bold text
@@ -89,24 +89,31 @@ export default function ChatWindow({ dialogId, onMessageSent }) {
     try {
       setSending(true);
       
-      const response = await api.post(`/api/dialog/${dialogId}/chat`, {
-        message: userMessage.content
+      let streamError = null;
+      await chatAPI.streamMessage(dialogId, userMessage.content, (event, data) => {
+        if (event === 'token') {
+          // Hiển thị token ngay khi nhận được
+          setMessages(prev => prev.map(msg =>
+            msg.loading || msg.streaming
+              ? { ...msg, loading: false, streaming: true, content: msg.content + data.content }
+              : msg
+          ));
+        } else if (event === 'done') {
+          const botMessage = {
+            role: 'assistant',
+            content: data.bot_response.content,
+            timestamp: data.bot_response.timestamp,
+            loading: false,
+            ragDetails: data.rag_details || null
+          };
+          setMessages(prev => prev.map(msg =>
+            msg.loading || msg.streaming ? botMessage : msg
+          ));
+        } else if (event === 'error') {
+          streamError = new Error(data.error);
+        }
       });
-      
-      console.log('Send message response:', response.data);
-      
-      // Replace loading message with actual response
-      const botMessage = {
-        role: 'assistant',
-        content: response.data.bot_response.content,
-        timestamp: response.data.bot_response.timestamp,
-        loading: false,
-        ragDetails: response.data.rag_details || null
-      };
-      
-      setMessages(prev => prev.map(msg => 
-        msg.loading ? botMessage : msg
-      ));
+      if (streamError) throw streamError;
       
       // Gọi callback để cập nhật DialogList khi bot trả lời
       if (onMessageSent) onMessageSent();
@@ -116,7 +123,7 @@ export default function ChatWindow({ dialogId, onMessageSent }) {
       message.error('Failed to send message');
       
       // Remove loading message on error
-      setMessages(prev => prev.filter(msg => !msg.loading));
+      setMessages(prev => prev.filter(msg => !msg.loading && !msg.streaming));
     } finally {
       setSending(false);
     }
@@ -98,23 +98,24 @@ export default function KnowledgeBaseSelector() {
     formData.append('file', file);
 
     try {
-      await kbAPI.upload(formData, (progressEvent) => {
-        const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total);
+      const response = await kbAPI.upload(formData, (progressEvent) => {
+        // Upload chiếm 30% đầu, phần còn lại là xử lý ở background
+        const percentCompleted = Math.round((progressEvent.loaded * 30) / progressEvent.total);
         setUploadProgress(percentCompleted);
-        
-        // Update stage based on progress
-        if (percentCompleted < 50) {
-          setUploadStage('Đang upload file...');
-        } else if (percentCompleted < 80) {
-          setUploadStage('Đang xử lý file...');
-        } else if (percentCompleted < 95) {
-          setUploadStage('Đang tạo chunks...');
-        } else {
-          setUploadStage('Đang lưu vào vector database...');
-        }
+        setUploadStage('Đang upload file...');
       });
 
-      message.success('Upload và xử lý thành công!');
+      // Theo dõi ingestion job cho tới khi xử lý xong
+      const jobId = response.data?.job_id;
+      if (jobId) {
+        await waitForJob(jobId);
+      }
+
+      if (response.data?.duplicate) {
+        message.info('File này đã được upload trước đó, không cần xử lý lại');
+      } else {
+        message.success('Upload và xử lý thành công!');
+      }
       setUploadProgress(100);
       setUploadStage('Hoàn thành!');
       
@@ -134,6 +135,34 @@ export default function KnowledgeBaseSelector() {
     }
   };
 
+  const jobStageLabels = {
+    downloading: 'Đang xử lý file...',
+    parsing: 'Đang xử lý file...',
+    chunking: 'Đang tạo chunks...',
+    storing_chunks: 'Đang tạo chunks...',
+    saving_metadata: 'Đang lưu metadata...',
+    vectorizing: 'Đang lưu vào vector database...',
+  };
+
+  const waitForJob = async (jobId) => {
+    // eslint-disable-next-line no-constant-condition
+    while (true) {
+      const { data: job } = await kbAPI.getJob(jobId);
+      if (job.status === 'completed') {
+        return job;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Xử lý file thất bại');
+      }
+      setUploadStage(jobStageLabels[job.stage] || 'Đang chờ xử lý...');
+      if (job.total_rows) {
+        const ratio = Math.min(job.rows_processed / job.total_rows, 1);
+        setUploadProgress(30 + Math.round(ratio * 69));
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1500));
+    }
+  };
+
   const handleDelete = async (fileId) => {
     try {
       await api.delete(`/api/kb/${fileId}`);
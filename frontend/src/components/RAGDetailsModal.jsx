@@ -168,6 +168,12 @@ export default function RAGDetailsModal({ visible, onClose, ragDetails }) {
                 <FileTextOutlined style={{ marginRight: '8px', color: '#1890ff' }} />
                 Context được sử dụng
               </Title>
+              {ragDetails.context_stats && (
+                <Text type="secondary" style={{ display: 'block', marginBottom: '8px' }}>
+                  {ragDetails.context_stats.context_tokens}/{ragDetails.context_stats.token_budget} tokens · {ragDetails.context_stats.chunks_packed}/{ragDetails.context_stats.chunks_retrieved} chunks
+                  {ragDetails.context_stats.duplicates_removed > 0 && ` · ${ragDetails.context_stats.duplicates_removed} trùng lặp đã bỏ`}
+                </Text>
+              )}
               <div style={{
                 backgroundColor: '#f9f9f9',
                 padding: '16px',
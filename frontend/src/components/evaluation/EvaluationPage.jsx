@@ -21,16 +21,23 @@ const EvaluationPage = () => {
     const data = tab === "manual" ? [singleData] : bulkData;
 
     setLoading(true);
-    await evaluationAPI
-      .evaluate(data)
-      .then((result) => {
-        setResult(result.data);
-        console.log("Evaluation result:", result.data);
-      })
-      .catch((err) => {
-        console.error("Error during evaluation:", err);
-      })
-      .finally(() => setLoading(false));
+    try {
+      // Evaluation chạy ở background, poll trạng thái tới khi xong
+      let { data: job } = await evaluationAPI.startJob(data);
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        ({ data: job } = await evaluationAPI.getJob(job.run_id));
+      }
+      if (job.status !== "completed") {
+        throw new Error(job.error || "Evaluation failed");
+      }
+      setResult(job.result);
+      console.log("Evaluation result:", job.result);
+    } catch (err) {
+      console.error("Error during evaluation:", err);
+    } finally {
+      setLoading(false);
+    }
   };
 
   const columns = [